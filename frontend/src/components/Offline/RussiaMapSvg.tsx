@@ -9,10 +9,26 @@ import {
 } from '../../data/russiaRegionsGeo';
 import { useOfflineTilesStore, type DownloadStatus } from '../../stores/offlineTilesStore';
 import { REGION_PATHS, SVG_WIDTH, SVG_HEIGHT } from '../../data/russiaRegionsPaths';
+import { REGION_PATH_LODS, BASE_TOLERANCE } from '../../data/russiaRegionsPaths.lods';
 
 // Реальные контуры: если сгенерировано > 20 регионов — рисуем path, иначе fallback на circle
 const USE_PATHS = Object.keys(REGION_PATHS).length > 20;
 
+// Детальные уровни контуров (generate_svg_paths.py --lod): уровень подгружается,
+// когда приближение делает его погрешность не меньше, чем у основного файла
+// на исходном масштабе. -1 — хватает основного файла.
+function pickPathLod(zoom: number): number {
+  const needed = BASE_TOLERANCE / zoom;
+  let best = -1;
+  REGION_PATH_LODS.forEach(({ tolerance }, i) => {
+    if (tolerance < BASE_TOLERANCE && tolerance >= needed
+        && (best < 0 || tolerance < REGION_PATH_LODS[best].tolerance)) {
+      best = i;
+    }
+  });
+  return best;
+}
+
 interface RussiaMapSvgProps {
   onRegionClick: (regionId: string) => void;
 }
@@ -60,6 +76,29 @@ const RussiaMapSvg: React.FC<RussiaMapSvgProps> = ({ onRegionClick }) => {
 
   const currentZoom = INITIAL_VB.w / viewBox.w;
 
+  // ── Детальные контуры при приближении (ленивая загрузка) ──────────
+  const pathLod = USE_PATHS ? pickPathLod(currentZoom) : -1;
+  const [lodPaths, setLodPaths] = useState<Record<string, string> | null>(null);
+
+  useEffect(() => {
+    if (pathLod < 0) {
+      setLodPaths(null);
+      return;
+    }
+    let cancelled = false;
+    REGION_PATH_LODS[pathLod]
+      .load()
+      .then((d) => {
+        if (!cancelled) setLodPaths(d);
+      })
+      .catch(() => {
+        // Чанк не загрузился (офлайн) — остаёмся на основном уровне
+      });
+    return () => {
+      cancelled = true;
+    };
+  }, [pathLod]);
+
   // ── Fly-to при выборе региона из списка ───────────────────────────
   useEffect(() => {
     if (!activeRegionId || !REGIONS_GEO[activeRegionId]) return;
@@ -418,7 +457,7 @@ const RussiaMapSvg: React.FC<RussiaMapSvgProps> = ({ onRegionClick }) => {
             return (
               <path
                 key={id}
-                d={d}
+                d={lodPaths?.[id] ?? d}
                 fill={fill}
                 stroke={isActive ? '#1e293b' : isHovered ? '#475569' : '#94a3b8'}
                 strokeWidth={(isActive ? 1.0 : 0.3) / Math.sqrt(currentZoom)}
@@ -0,0 +1,20 @@
+/**
+ * Уровни детализации SVG-path контуров (к russiaRegionsPaths.ts).
+ * Модули уровней загружаются лениво (import()) — в сборке это отдельные чанки.
+ * Без --lod список пуст: рисуется только основной файл.
+ *
+ * Перегенерация:  cd offline-tiles && python generate_svg_paths.py --lod …
+ */
+
+/** Порог упрощения russiaRegionsPaths.ts, градусы */
+export const BASE_TOLERANCE = 0.005;
+
+export interface RegionPathLod {
+  /** Порог упрощения, градусы */
+  tolerance: number;
+  /** region id → SVG path d-attribute */
+  load: () => Promise<Record<string, string>>;
+}
+
+/** Детальнее основного файла, от грубого к детальному */
+export const REGION_PATH_LODS: RegionPathLod[] = [];
@@ -0,0 +1,289 @@
+"""
+Микробенчмарки CPU-горячих мест offline-tiles.
+
+Меряет ops/sec и пиковую память (tracemalloc) для перебора тайлов,
+геометрии тайлов, записи в MBTiles, Albers-проекции, конвертации
+GeoJSON → SVG path и загрузки контуров (GeoJSON против .geobin).
+Данные — синтетические полигоны и несколько реальных контуров из
+boundaries/ (небольшой город, средняя область, Чукотка через
+антимеридиан). Сеть и tileserver не нужны; на диск пишется только
+временный каталог.
+
+Требования: те же, что у generate_region_tiles.py и generate_svg_paths.py
+(requests, shapely; numpy — для векторных вариантов).
+
+Использование:
+    python benchmark_hot_paths.py                          # прогон, таблица
+    python benchmark_hot_paths.py --save baseline.json     # сохранить базу
+    python benchmark_hot_paths.py --compare baseline.json  # сравнить с базой
+    python benchmark_hot_paths.py --filter svg --min-time 2
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import tracemalloc
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+from shapely.geometry import Point, Polygon, MultiPolygon, mapping  # noqa: E402
+
+# Скрипты импортируются в main() (см. import_scripts): при импорте
+# generate_region_tiles настраивает логирование в generate_tiles.log
+svg = tiles = boundary_store = None
+
+BOUNDARY_DIR = os.path.join(SCRIPT_DIR, "boundaries")
+
+# Реальные контуры: (файл, зумы для перебора тайлов)
+REAL_REGIONS = {
+    "sevastopol": (8, 16),       # небольшой город
+    "vladimir_oblast": (4, 12),  # средняя область
+    "chukotka_ao": (4, 10),      # пересекает антимеридиан
+}
+
+REGRESSION_THRESHOLD = 0.10  # медленнее базы больше чем на 10% — регрессия
+
+
+# ─────────────────────────────────────────────────────────
+# Данные
+# ─────────────────────────────────────────────────────────
+
+def import_scripts(tmp_dir: str):
+    """Импортирует generate_svg_paths / generate_region_tiles / boundary_store
+    без следов на диске: корневой логгер настроен раньше их basicConfig
+    (generate_tiles.log не создаётся), индекс охвата регионов
+    (.bounds_index.json) — в tmp_dir, а не в boundaries/."""
+    global svg, tiles, boundary_store
+    logging.basicConfig(handlers=[logging.NullHandler()])
+    import generate_svg_paths as svg
+    import generate_region_tiles as tiles
+    import boundary_store
+    svg.BOUNDS_INDEX = os.path.join(tmp_dir, os.path.basename(svg.BOUNDS_INDEX))
+
+
+def synthetic_circle(lon: float = 40.4, lat: float = 56.1, radius: float = 1.5,
+                     vertices: int = 256):
+    """Круг с vertices вершинами (в градусах) — «регион» средней площади."""
+    return Point(lon, lat).buffer(radius, quad_segs=max(1, vertices // 4))
+
+
+def synthetic_star(lon: float = 40.4, lat: float = 56.1, radius: float = 1.5,
+                   vertices: int = 5000):
+    """Звезда с изрезанной границей — много граничных тайлов и точек."""
+    pts = []
+    for i in range(vertices):
+        a = 2 * math.pi * i / vertices
+        r = radius * (0.6 + 0.4 * math.sin(a * 37) ** 2)
+        pts.append((lon + r * math.cos(a), lat + r * math.sin(a) * 0.6))
+    return Polygon(pts)
+
+
+def synthetic_antimeridian():
+    """Мультиполигон по обе стороны 180° (как Чукотка в OSM)."""
+    east = Polygon([(170, 64), (180, 64), (180, 68), (170, 68)])
+    west = Polygon([(-180, 64), (-172, 64), (-172, 67), (-180, 67)])
+    return MultiPolygon([east, west])
+
+
+def load_geometry(rid: str):
+    """GeoJSON geometry (dict) из boundaries/ или None, если файла нет."""
+    path = os.path.join(BOUNDARY_DIR, f"{rid}.geojson")
+    if not os.path.exists(path):
+        return None
+    return boundary_store.read_geojson(path)[0]
+
+
+# ─────────────────────────────────────────────────────────
+# Бенчмарки
+# ─────────────────────────────────────────────────────────
+
+def _insert_bench(dedup: bool, batch: bool, count: int = 1000):
+    """Вставка count тайлов в свежий MBTiles (половина — одинаковые)."""
+    polygon = synthetic_circle()
+    blobs = [os.urandom(2048) if i % 2 else b"\x89PNG water" * 200 for i in range(count)]
+
+    def run():
+        with tempfile.TemporaryDirectory() as tmp:
+            db = tiles.create_mbtiles(os.path.join(tmp, "b.mbtiles"), "bench", polygon, 4, 12,
+                                      dedup=dedup, defer_index=True)
+            if batch:
+                tiles.insert_tiles(db, [(12, i, i, blobs[i]) for i in range(count)], dedup)
+            else:
+                for i in range(count):
+                    tiles.insert_tile(db, 12, i, i, blobs[i], dedup)
+            db.commit()
+            db.close()
+    return run
+
+
+def build_benchmarks(tmp_dir: str) -> dict:
+    """name → функция без аргументов. Имена стабильны: по ним сравнивается база.
+    tmp_dir — каталог для .geobin-копий реальных контуров."""
+    circle = synthetic_circle()
+    star = synthetic_star()
+    anti = synthetic_antimeridian()
+    star_geojson = mapping(star)
+
+    benches = {
+        "tile_bbox": lambda: tiles.tile_bbox(12, 2475, 1270),
+        "project": lambda: svg.project(40.4, 56.1),
+        "enumerate_tiles/quadtree/circle z4-12": lambda: sum(1 for _ in tiles.enumerate_tiles(circle, 4, 12)),
+        "enumerate_tiles/bbox/circle z4-12": lambda: sum(1 for _ in tiles.enumerate_tiles(circle, 4, 12, "bbox")),
+        "enumerate_tiles/quadtree/star z4-12": lambda: sum(1 for _ in tiles.enumerate_tiles(star, 4, 12)),
+        "plan_tiles/scalar/star z4-12": lambda: tiles.plan_tiles(star, 4, 12, vectorized=False),
+        "insert_tile/flat x1000": _insert_bench(dedup=False, batch=False),
+        "insert_tile/dedup x1000": _insert_bench(dedup=True, batch=False),
+        "insert_tiles/flat batch x1000": _insert_bench(dedup=False, batch=True),
+        "_normalize_antimeridian/synthetic": lambda: svg._normalize_antimeridian(anti),
+        "geojson_to_svg_path/star": lambda: svg.geojson_to_svg_path(star_geojson, svg.SIMPLIFY_TOLERANCE),
+    }
+    if tiles.VECTORIZED:
+        xs = tiles.np.arange(65536) % 4096
+        ys = tiles.np.arange(65536) // 16
+        benches["tile_bounds_array x65536"] = lambda: tiles.tile_bounds_array(12, xs, ys)
+
+    for rid, (min_zoom, max_zoom) in REAL_REGIONS.items():
+        geom = load_geometry(rid)
+        if geom is None:
+            print(f"⚠️  Нет boundaries/{rid}.geojson — реальные бенчмарки {rid} пропущены")
+            continue
+        # Перебор тайлов — по исходной геометрии, как в load_region_polygon
+        polygon = boundary_store.shape_geojson(geom)
+        if rid == "chukotka_ao":
+            benches[f"_normalize_antimeridian/{rid}"] = (
+                lambda g=polygon: svg._normalize_antimeridian(g)
+            )
+        benches[f"enumerate_tiles/quadtree/{rid} z{min_zoom}-{max_zoom}"] = (
+            lambda p=polygon, a=min_zoom, b=max_zoom: sum(1 for _ in tiles.enumerate_tiles(p, a, b))
+        )
+        benches[f"geojson_to_svg_path/{rid}"] = (
+            lambda g=geom: svg.geojson_to_svg_path(g, svg.SIMPLIFY_TOLERANCE)
+        )
+        # Загрузка контура с диска: GeoJSON против .geobin (во временном каталоге)
+        src = os.path.join(BOUNDARY_DIR, f"{rid}.geojson")
+        geobin = os.path.join(tmp_dir, f"{rid}.geobin")
+        boundary_store.convert_file(src, geobin)
+        benches[f"load_boundary/geojson/{rid}"] = lambda path=src: boundary_store.load_boundary(path)
+        benches[f"load_boundary/geobin/{rid}"] = lambda path=geobin: boundary_store.load_boundary(path)
+    return benches
+
+
+# ─────────────────────────────────────────────────────────
+# Замер
+# ─────────────────────────────────────────────────────────
+
+def measure(fn, min_time: float = 0.5, repeat: int = 3) -> dict:
+    """ops/sec (лучший из repeat прогонов по ≥ min_time) и пик памяти, КБ."""
+    start = time.perf_counter()
+    fn()
+    once = max(time.perf_counter() - start, 1e-7)
+    number = max(1, math.ceil(min_time / once))
+
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, time.perf_counter() - start)
+
+    # Память — отдельным прогоном: tracemalloc замедляет выполнение
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"ops_per_sec": number / best, "peak_kb": peak / 1024}
+
+
+def _fmt_ops(ops: float) -> str:
+    if ops >= 1e6:
+        return f"{ops / 1e6:.2f}M"
+    if ops >= 1e3:
+        return f"{ops / 1e3:.1f}k"
+    return f"{ops:.2f}"
+
+
+def run(benches: dict, min_time: float, baseline: dict | None, threshold: float) -> tuple[dict, list]:
+    """Прогоняет бенчмарки, печатает таблицу. Возвращает (результаты, регрессии)."""
+    results, regressions = {}, []
+    header = f"{'Бенчмарк':50s} {'ops/sec':>10s} {'пик, КБ':>10s}"
+    if baseline:
+        header += f" {'база':>10s} {'Δ':>8s}"
+    print(header)
+    print("─" * len(header))
+
+    for name, fn in benches.items():
+        res = measure(fn, min_time)
+        results[name] = res
+        line = f"{name:50s} {_fmt_ops(res['ops_per_sec']):>10s} {res['peak_kb']:>10.0f}"
+        base = (baseline or {}).get(name)
+        if base:
+            ratio = res["ops_per_sec"] / base["ops_per_sec"]
+            mark = ""
+            if ratio < 1 - threshold:
+                mark = " ⚠️"
+                regressions.append((name, ratio))
+            elif ratio > 1 + threshold:
+                mark = " ✅"
+            line += f" {_fmt_ops(base['ops_per_sec']):>10s} {(ratio - 1) * 100:>+7.0f}%{mark}"
+        print(line, flush=True)
+    return results, regressions
+
+
+def main():
+    p = argparse.ArgumentParser(description="Микробенчмарки горячих мест offline-tiles")
+    p.add_argument("--filter", help="Только бенчмарки, в имени которых есть подстрока")
+    p.add_argument("--min-time", type=float, default=0.5, help="Минимальное время одного замера, сек")
+    p.add_argument("--save", metavar="JSON", help="Сохранить результаты как базу")
+    p.add_argument("--compare", metavar="JSON", help="Сравнить с сохранённой базой")
+    p.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                   help="Порог регрессии (доля, по умолчанию 0.10)")
+    args = p.parse_args()
+
+    # Логи generate_region_tiles / generate_svg_paths искажают замер
+    logging.disable(logging.WARNING)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        import_scripts(tmp_dir)
+        # Охват Albers считается по всем boundaries/ один раз — не в замере project()
+        svg._compute_albers_bounds()
+        benches = build_benchmarks(tmp_dir)
+        if args.filter:
+            benches = {k: v for k, v in benches.items() if args.filter in k}
+        results, regressions = run(benches, args.min_time, baseline, args.threshold)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "machine": platform.machine(),
+                    "vectorized": tiles.VECTORIZED,
+                    "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                },
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 База сохранена: {args.save}")
+
+    if regressions:
+        print(f"\n⚠️  Медленнее базы больше чем на {args.threshold:.0%}:")
+        for name, ratio in regressions:
+            print(f"   {name}: ×{ratio:.2f}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Компактное бинарное хранилище контуров (.geobin) для скриптов offline-tiles.
+
+GeoJSON-контуры читаются долго: json.load многомегабайтного текста и
+поточечная сборка геометрии. .geobin — плоские массивы координат со
+смещениями колец, которые читаются через mmap и собираются в геометрию
+одним вызовом shapely.from_ragged_array (Shapely 2 + NumPy). Без NumPy
+файл разбирается модулями struct/array — медленнее, но без зависимостей.
+
+Формат (little-endian):
+    заголовок   HEADER: magic b"GEOB", версия, флаги, масштаб,
+                число полигонов, колец, точек, длина properties
+    properties  JSON (UTF-8), выровнен до 8 байт
+    polygons    int32[полигонов + 1] — смещения колец полигонов
+    rings       int32[колец + 1]     — смещения точек колец
+    coords      int32[точек × 2] (квантованные lon/lat × масштаб)
+                или float64[точек × 2], выровнены до 8 байт
+
+Квантование — 1e-7° (~1 см, точность координат OSM) и без потерь: если
+хоть одна координата не восстанавливается точно, файл пишется в float64.
+
+Требования:
+    pip install shapely
+    pip install numpy  # опционально: чтение через mmap (нужен Shapely 2)
+
+Использование:
+    python boundary_store.py boundaries/                 # все *.geojson → *.geobin
+    python boundary_store.py boundaries/ --check         # + проверка round-trip
+    python boundary_store.py boundaries/moscow_city.geojson --float64
+"""
+
+import os
+import sys
+import json
+import time
+import mmap
+import array
+import struct
+import argparse
+
+try:
+    from shapely.geometry import shape
+    from shapely.ops import unary_union
+    from shapely import __version__ as _shapely_version
+except ImportError:
+    print("❌  pip install shapely")
+    sys.exit(1)
+
+try:
+    # Опционально: чтение через mmap + from_ragged_array (Shapely 2)
+    import numpy as np
+    import shapely
+    VECTORIZED = int(_shapely_version.split(".")[0]) >= 2
+except ImportError:
+    np = None
+    VECTORIZED = False
+
+GEOBIN_EXT = ".geobin"
+GEOJSON_EXT = ".geojson"
+
+MAGIC = b"GEOB"
+VERSION = 1
+HEADER = struct.Struct("<4sHHdIIII")
+FLAG_QUANTIZED = 1
+FLAG_MULTI = 2
+SCALE = 10_000_000  # единиц квантования на градус (1e-7°)
+
+
+def _align(n: int) -> int:
+    return (n + 7) & ~7
+
+
+# ─────────────────────────────────────────────────────────
+# GeoJSON
+# ─────────────────────────────────────────────────────────
+
+def read_geojson(path: str) -> tuple[dict, dict]:
+    """(geometry, properties) из GeoJSON: Feature, FeatureCollection или голая
+    Geometry. Несколько объектов FeatureCollection объединяются."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("type") == "FeatureCollection":
+        features = [feat for feat in data["features"] if feat.get("geometry")]
+        if len(features) == 1:
+            return features[0]["geometry"], features[0].get("properties") or {}
+        merged = unary_union([shape(feat["geometry"]) for feat in features])
+        return merged.__geo_interface__, features[0].get("properties") or {}
+    if data.get("type") == "Feature":
+        return data["geometry"], data.get("properties") or {}
+    return data, {}
+
+
+def shape_geojson(geometry: dict):
+    """shape() для Polygon / MultiPolygon через массивы NumPy — та же
+    геометрия, но без поточечного разбора списков в Python."""
+    gtype = geometry.get("type")
+    coords = geometry.get("coordinates")
+    if not VECTORIZED or not coords or gtype not in ("Polygon", "MultiPolygon"):
+        return shape(geometry)
+
+    def polygon(rings):
+        shell = shapely.linearrings(np.asarray(rings[0], dtype=float))
+        holes = [shapely.linearrings(np.asarray(r, dtype=float)) for r in rings[1:]]
+        return shapely.polygons(shell, holes or None)
+
+    if gtype == "Polygon":
+        return polygon(coords)
+    return shapely.multipolygons([polygon(p) for p in coords])
+
+
+# ─────────────────────────────────────────────────────────
+# .geobin
+# ─────────────────────────────────────────────────────────
+
+def write_geobin(path: str, geometry: dict, properties: dict | None = None,
+                 quantize: bool = True) -> dict:
+    """Пишет GeoJSON geometry (Polygon / MultiPolygon) в .geobin.
+    Возвращает {"bytes", "points", "quantized"}; запись атомарная."""
+    gtype = geometry.get("type")
+    if gtype == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif gtype == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        raise ValueError(f"{path}: .geobin хранит только Polygon / MultiPolygon, не {gtype}")
+
+    part_offsets, ring_offsets, flat = [0], [0], []
+    for rings in polygons:
+        for ring in rings:
+            for pt in ring:
+                flat.append(float(pt[0]))
+                flat.append(float(pt[1]))
+            ring_offsets.append(len(flat) // 2)
+        part_offsets.append(len(ring_offsets) - 1)
+
+    flags = FLAG_MULTI if gtype == "MultiPolygon" else 0
+    if quantize and all(round(v * SCALE) / SCALE == v for v in flat):
+        flags |= FLAG_QUANTIZED
+        coords = array.array("i", (round(v * SCALE) for v in flat))
+    else:
+        coords = array.array("d", flat)
+    offsets = array.array("i", part_offsets + ring_offsets)
+    if sys.byteorder == "big":
+        coords.byteswap()
+        offsets.byteswap()
+
+    props = json.dumps(properties or {}, ensure_ascii=False).encode("utf-8")
+    header = HEADER.pack(MAGIC, VERSION, flags, float(SCALE),
+                         len(part_offsets) - 1, len(ring_offsets) - 1, len(flat) // 2, len(props))
+    head = header + props.ljust(_align(len(props)), b"\0") + offsets.tobytes()
+    body = head.ljust(_align(len(head)), b"\0") + coords.tobytes()
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(body)
+    os.replace(tmp, path)
+    return {"bytes": len(body), "points": len(flat) // 2, "quantized": bool(flags & FLAG_QUANTIZED)}
+
+
+def _layout(buf, path: str):
+    magic, version, flags, scale, n_parts, n_rings, n_points, props_len = HEADER.unpack_from(buf)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path}: не .geobin версии {VERSION}")
+    props_at = HEADER.size
+    parts_at = props_at + _align(props_len)
+    rings_at = parts_at + 4 * (n_parts + 1)
+    coords_at = _align(rings_at + 4 * (n_rings + 1))
+    properties = json.loads(bytes(buf[props_at:props_at + props_len]).decode("utf-8"))
+    return flags, scale, n_parts, n_rings, n_points, parts_at, rings_at, coords_at, properties
+
+
+def read_geobin(path: str):
+    """(геометрия Shapely, properties) из .geobin."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        flags, scale, n_parts, n_rings, n_points, parts_at, rings_at, coords_at, props = _layout(buf, path)
+        quantized = flags & FLAG_QUANTIZED
+
+        if VECTORIZED:
+            parts = np.frombuffer(buf, "<i4", n_parts + 1, parts_at).astype(np.int64)
+            rings = np.frombuffer(buf, "<i4", n_rings + 1, rings_at).astype(np.int64)
+            coords = np.frombuffer(buf, "<i4" if quantized else "<f8", 2 * n_points, coords_at)
+            # Деление, а не умножение на 1e-7: так int → float восстанавливается точно
+            coords = (coords / scale if quantized else coords.copy()).reshape(-1, 2)
+            if flags & FLAG_MULTI:
+                geom = shapely.from_ragged_array(shapely.GeometryType.MULTIPOLYGON, coords,
+                                                 (rings, parts, np.array([0, n_parts])))
+            else:
+                geom = shapely.from_ragged_array(shapely.GeometryType.POLYGON, coords,
+                                                 (rings, np.array([0, n_rings])))
+            # Массивы numpy ссылаются на mmap — освобождаем до его закрытия
+            del parts, rings, coords
+            return geom[0], props
+
+        parts = array.array("i", buf[parts_at:parts_at + 4 * (n_parts + 1)])
+        rings = array.array("i", buf[rings_at:rings_at + 4 * (n_rings + 1)])
+        coords = array.array("i" if quantized else "d",
+                             buf[coords_at:coords_at + (4 if quantized else 8) * 2 * n_points])
+
+    if sys.byteorder == "big":
+        for arr in (parts, rings, coords):
+            arr.byteswap()
+    flat = [v / scale for v in coords] if quantized else coords
+    polygons = [
+        [[[flat[2 * i], flat[2 * i + 1]] for i in range(rings[r], rings[r + 1])]
+         for r in range(parts[p], parts[p + 1])]
+        for p in range(n_parts)
+    ]
+    if flags & FLAG_MULTI:
+        return shape({"type": "MultiPolygon", "coordinates": polygons}), props
+    return shape({"type": "Polygon", "coordinates": polygons[0]}), props
+
+
+# ─────────────────────────────────────────────────────────
+# Общий API для скриптов
+# ─────────────────────────────────────────────────────────
+
+def load_boundary(path: str):
+    """Геометрия контура (Shapely) из .geobin или GeoJSON — по расширению."""
+    if path.endswith(GEOBIN_EXT):
+        return read_geobin(path)[0]
+    return shape_geojson(read_geojson(path)[0])
+
+
+def boundary_path(directory: str, rid: str) -> str:
+    """Путь к контуру rid: .geobin, если он есть и не старше .geojson,
+    иначе .geojson (даже если его нет — для сообщений об ошибке)."""
+    geojson = os.path.join(directory, rid + GEOJSON_EXT)
+    geobin = os.path.join(directory, rid + GEOBIN_EXT)
+    try:
+        binary_mtime = os.path.getmtime(geobin)
+    except OSError:
+        return geojson
+    try:
+        if os.path.getmtime(geojson) > binary_mtime:
+            return geojson
+    except OSError:
+        pass
+    return geobin
+
+
+def convert_file(src: str, dst: str | None = None, quantize: bool = True) -> dict:
+    """GeoJSON → .geobin рядом с исходником (или в dst)."""
+    geometry, properties = read_geojson(src)
+    dst = dst or os.path.splitext(src)[0] + GEOBIN_EXT
+    info = write_geobin(dst, geometry, properties, quantize=quantize)
+    info["path"] = dst
+    return info
+
+
+def _same_geometry(a, b) -> bool:
+    """Точное совпадение: тип, порядок колец и координаты бит-в-бит."""
+    if VECTORIZED:
+        return (a.geom_type == b.geom_type
+                and shapely.get_num_geometries(a) == shapely.get_num_geometries(b)
+                and np.array_equal(shapely.get_coordinates(a), shapely.get_coordinates(b)))
+    return a.geom_type == b.geom_type and a.wkb == b.wkb
+
+
+def _timed(fn, path: str) -> float:
+    started = time.perf_counter()
+    fn(path)
+    return time.perf_counter() - started
+
+
+def main():
+    p = argparse.ArgumentParser(description="Конвертация контуров GeoJSON → .geobin")
+    p.add_argument("paths", nargs="+", help="Файлы .geojson или каталоги с ними")
+    p.add_argument("--float64", action="store_true", help="Без квантования: координаты как float64")
+    p.add_argument("--check", action="store_true",
+                   help="Проверить round-trip (геометрия совпадает бит-в-бит) и сравнить время загрузки")
+    args = p.parse_args()
+
+    files = []
+    for path in args.paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(GEOJSON_EXT))
+        else:
+            files.append(path)
+    if not files:
+        print("❌  Нет файлов .geojson")
+        sys.exit(1)
+
+    total_src = total_dst = 0
+    load_src = load_dst = 0.0
+    failed = []
+    for src in files:
+        info = convert_file(src, quantize=not args.float64)
+        src_size = os.path.getsize(src)
+        total_src += src_size
+        total_dst += info["bytes"]
+        note = "int32" if info["quantized"] else "float64"
+        line = (f"  {os.path.basename(src):40s} {src_size / 1024:>8.0f} КБ → "
+                f"{info['bytes'] / 1024:>7.0f} КБ  ×{src_size / max(info['bytes'], 1):.1f}  {note}")
+        if args.check:
+            t_src = _timed(load_boundary, src)
+            t_dst = _timed(load_boundary, info["path"])
+            load_src += t_src
+            load_dst += t_dst
+            ok = _same_geometry(load_boundary(src), load_boundary(info["path"]))
+            if not ok:
+                failed.append(src)
+            line += f"  загрузка {t_src * 1000:.0f} → {t_dst * 1000:.1f} мс  {'✅' if ok else '❌'}"
+        print(line)
+
+    print(f"\nИтого: {len(files)} файлов, {total_src / 2**20:.1f} МБ → {total_dst / 2**20:.1f} МБ "
+          f"(×{total_src / max(total_dst, 1):.1f})")
+    if args.check:
+        print(f"Загрузка всех контуров: {load_src:.2f} с → {load_dst:.2f} с")
+        if failed:
+            print(f"❌  Round-trip не совпал: {', '.join(failed)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,35 +9,38 @@
     python download_boundaries.py               # скачать все 85+ регионов
     python download_boundaries.py --id vladimir  # только Владимирскую область
     python download_boundaries.py --list         # показать список доступных регионов
+    python download_boundaries.py --geobin       # + компактные .geobin рядом с .geojson
+    python download_boundaries.py --overpass-slots 1  # бережнее к Overpass
+    python download_boundaries.py --batch        # группы relation одним запросом
+
+Запросы идут параллельно на все эндпоинты Overpass (overpass_client.py):
+слоты и token bucket на эндпоинт, пауза — только после ответа 429 / 504.
 """
 
 import os
 import sys
 import json
-import time
 import argparse
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 try:
-    import requests
-except ImportError:
-    print("❌ pip install requests")
-    sys.exit(1)
-
-try:
-    from shapely.geometry import shape, mapping, MultiPolygon, Polygon
-    from shapely.ops import unary_union
+    from shapely.geometry import shape, mapping, MultiPolygon
 except ImportError:
     print("❌ pip install shapely")
     sys.exit(1)
 
+# Компактные копии контуров (--geobin)
+from boundary_store import boundary_path, convert_file  # noqa: E402
+from overpass_client import (  # noqa: E402
+    OVERPASS_ENDPOINTS, SLOTS, OverpassClient, fetch_relation, fetch_relations,
+)
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 log = logging.getLogger(__name__)
 
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "boundaries")
 
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
-
 # ─────────────────────────────────────────────────────────
 # Каталог субъектов РФ
 # id → { name_ru, osm_relation_id, capital_name_ru, capital_osm_relation_id }
@@ -134,77 +137,32 @@ REGIONS = {
 }
 
 
-def fetch_boundary_geojson(osm_relation_id: int, name: str) -> dict | None:
+def fetch_boundary_geojson(osm_relation_id: int, name: str, client: OverpassClient) -> dict | None:
     """Скачивает контур из OSM Overpass API и возвращает GeoJSON FeatureCollection."""
-    query = f"""
-[out:json][timeout:120];
-relation({osm_relation_id});
-out geom;
-"""
     log.info(f"  Запрос Overpass для {name} (relation/{osm_relation_id})...")
     try:
-        resp = requests.post(OVERPASS_URL, data={"data": query}, timeout=180)
-        resp.raise_for_status()
-        data = resp.json()
+        relation = fetch_relation(client, osm_relation_id, timeout=120)
     except Exception as e:
         log.error(f"  ❌ Ошибка запроса: {e}")
         return None
 
-    elements = data.get("elements", [])
-    if not elements:
+    if relation is None:
         log.warning(f"  ⚠️  Нет данных для relation/{osm_relation_id}")
         return None
 
-    # Собираем все outer ways в полигон
-    relation = elements[0]
-    members = relation.get("members", [])
+    return relation_geojson(relation, osm_relation_id, name)
 
-    outer_rings = []
-    for member in members:
-        if member.get("role") == "outer" and member.get("type") == "way":
-            geom = member.get("geometry", [])
-            if geom:
-                ring = [[pt["lon"], pt["lat"]] for pt in geom]
-                outer_rings.append(ring)
 
-    if not outer_rings:
+def relation_geojson(relation: dict, osm_relation_id: int, name: str) -> dict | None:
+    """Relation из parse_relations (полигон собран при разборе ответа)
+    → GeoJSON FeatureCollection."""
+    if not relation["ways"]:
         log.warning(f"  ⚠️  Не найдены outer ways для {name}")
         return None
 
-    # Пытаемся собрать кольца в полигоны
-    try:
-        from shapely.ops import polygonize
-        from shapely.geometry import LineString
-
-        lines = [LineString(r) for r in outer_rings]
-        polys = list(polygonize(lines))
-
-        if polys:
-            merged = unary_union(polys)
-        else:
-            # Fallback: каждое кольцо — отдельный полигон
-            polys = []
-            for ring in outer_rings:
-                if len(ring) >= 4:
-                    # Замыкаем кольцо если нужно
-                    if ring[0] != ring[-1]:
-                        ring.append(ring[0])
-                    try:
-                        p = Polygon(ring)
-                        if p.is_valid:
-                            polys.append(p)
-                        else:
-                            polys.append(p.buffer(0))
-                    except Exception:
-                        pass
-            merged = unary_union(polys) if polys else None
-
-        if merged is None or merged.is_empty:
-            log.warning(f"  ⚠️  Не удалось собрать полигон для {name}")
-            return None
-
-    except Exception as e:
-        log.error(f"  ❌ Ошибка сборки полигона: {e}")
+    merged = relation["geometry"]
+    if merged is None:
+        log.warning(f"  ⚠️  Не удалось собрать полигон для {name}")
         return None
 
     feature = {
@@ -230,33 +188,88 @@ def save_geojson(data: dict, filepath: str):
     log.info(f"  ✅ Сохранено: {filepath} ({size_kb:.0f} КБ)")
 
 
-def download_region(region_id: str, info: dict, download_capital: bool = True):
-    """Скачивает контур региона и его столицы."""
-    # Регион
-    region_file = os.path.join(OUTPUT_DIR, f"{region_id}.geojson")
-    if os.path.exists(region_file):
-        log.info(f"  ⏭️  {info['name']} — уже скачан")
-    else:
-        geojson = fetch_boundary_geojson(info["osm_id"], info["name"])
-        if geojson:
-            save_geojson(geojson, region_file)
-        else:
-            log.error(f"  ❌ Не удалось скачать {info['name']}")
+def save_geobin(filepath: str):
+    """Компактная копия .geobin рядом с .geojson (если её нет или она старше)."""
+    stem = os.path.splitext(os.path.basename(filepath))[0]
+    if boundary_path(os.path.dirname(filepath), stem) != filepath:
+        return
+    info = convert_file(filepath)
+    log.info(f"  ✅ Сохранено: {info['path']} ({info['bytes'] / 1024:.0f} КБ)")
+
 
-    # Столица
+def region_jobs(region_id: str, info: dict, download_capital: bool = True) -> list[tuple]:
+    """Файлы региона (и столицы): [(путь, osm_id, название)]."""
+    jobs = [(os.path.join(OUTPUT_DIR, f"{region_id}.geojson"), info["osm_id"], info["name"])]
     if download_capital and info.get("capital_osm_id"):
-        capital_file = os.path.join(OUTPUT_DIR, f"{region_id}_capital.geojson")
-        if os.path.exists(capital_file):
-            log.info(f"  ⏭️  {info['capital']} — уже скачан")
-        else:
-            geojson = fetch_boundary_geojson(info["capital_osm_id"], info["capital"])
+        jobs.append((os.path.join(OUTPUT_DIR, f"{region_id}_capital.geojson"),
+                     info["capital_osm_id"], info["capital"]))
+    return jobs
+
+
+def download_job(job: tuple, client: OverpassClient) -> bool:
+    filepath, osm_id, name = job
+    geojson = fetch_boundary_geojson(osm_id, name, client)
+    if not geojson:
+        log.error(f"  ❌ Не удалось скачать {name}")
+        return False
+    save_geojson(geojson, filepath)
+    return True
+
+
+def download_batched(jobs: list[tuple], client: OverpassClient) -> int:
+    """Скачивает контуры группами relation (fetch_relations). Возвращает число неудач."""
+    by_id = {}
+    for job in jobs:
+        by_id.setdefault(job[1], []).append(job)
+    failed = done = 0
+    for osm_id, relation in fetch_relations(client, list(by_id)):
+        for filepath, _, name in by_id[osm_id]:
+            done += 1
+            geojson = relation_geojson(relation, osm_id, name) if relation else None
             if geojson:
-                save_geojson(geojson, capital_file)
-            # Пауза чтобы не перегружать Overpass
-            time.sleep(3)
-
-    # Пауза между регионами
-    time.sleep(5)
+                save_geojson(geojson, filepath)
+            else:
+                log.error(f"  ❌ Не удалось скачать {name}")
+                failed += 1
+            log.info(f"[{done}/{len(jobs)}] {'✅' if geojson else '❌'} {name}")
+    return failed
+
+
+def download_regions(regions: dict, client: OverpassClient, download_capital: bool = True,
+                     geobin: bool = False, batch: bool = False):
+    """Скачивает контуры регионов (и столиц) параллельно: сколько запросов
+    одновременно и как часто — решает client (слоты и лимиты эндпоинтов).
+    batch — несколько relation в одном запросе."""
+    jobs = []
+    for rid, info in sorted(regions.items()):
+        for job in region_jobs(rid, info, download_capital):
+            if os.path.exists(job[0]):
+                log.info(f"  ⏭️  {job[2]} — уже скачан")
+            else:
+                jobs.append(job)
+
+    if jobs:
+        log.info(f"Запросов: {len(jobs)}, одновременно до {client.concurrency} "
+                 f"({len(client.endpoints)} эндпоинтов)")
+        failed = 0
+        if batch:
+            failed = download_batched(jobs, client)
+        else:
+            with ThreadPoolExecutor(max_workers=client.concurrency) as pool:
+                futures = {pool.submit(download_job, job, client): job for job in jobs}
+                for i, future in enumerate(as_completed(futures), 1):
+                    ok = future.result()
+                    failed += not ok
+                    log.info(f"[{i}/{len(jobs)}] {'✅' if ok else '❌'} {futures[future][2]}")
+        log.info(f"Overpass: {client.report()}")
+        if failed:
+            log.warning(f"⚠️  Не скачано: {failed} из {len(jobs)} — перезапустите, готовые файлы пропускаются")
+
+    if geobin:
+        for rid, info in sorted(regions.items()):
+            for filepath, _, _ in region_jobs(rid, info, download_capital):
+                if os.path.exists(filepath):
+                    save_geobin(filepath)
 
 
 def main():
@@ -264,6 +277,17 @@ def main():
     parser.add_argument("--id", help="ID конкретного региона (например, vladimir_oblast)")
     parser.add_argument("--list", action="store_true", help="Показать список регионов")
     parser.add_argument("--no-capitals", action="store_true", help="Не скачивать контуры столиц")
+    parser.add_argument("--overpass-slots", type=int, default=SLOTS,
+                        help=f"Одновременных запросов на эндпоинт Overpass (по умолчанию {SLOTS})")
+    parser.add_argument("--overpass-endpoint", action="append", metavar="URL",
+                        help="Эндпоинт Overpass (можно несколько; по умолчанию — "
+                             f"{len(OVERPASS_ENDPOINTS)} публичных)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Несколько relation в одном запросе Overpass "
+                             "(размер группы подстраивается под объём ответа)")
+    parser.add_argument("--geobin", action="store_true",
+                        help="Дополнительно сохранять компактные .geobin (boundary_store.py); "
+                             "для уже скачанных контуров — тоже")
     args = parser.parse_args()
 
     if args.list:
@@ -276,17 +300,16 @@ def main():
 
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+    client = OverpassClient(args.overpass_endpoint, slots=args.overpass_slots)
     if args.id:
         if args.id not in REGIONS:
             log.error(f"Регион '{args.id}' не найден. Используйте --list для списка.")
             sys.exit(1)
-        download_region(args.id, REGIONS[args.id], not args.no_capitals)
+        download_regions({args.id: REGIONS[args.id]}, client, not args.no_capitals,
+                         args.geobin, args.batch)
     else:
         log.info(f"Скачивание контуров {len(REGIONS)} регионов...")
-        log.info("⚠️  Это займёт ~30-60 мин из-за лимитов Overpass API")
-        for i, (rid, info) in enumerate(sorted(REGIONS.items()), 1):
-            log.info(f"\n[{i}/{len(REGIONS)}] {info['name']}")
-            download_region(rid, info, not args.no_capitals)
+        download_regions(REGIONS, client, not args.no_capitals, args.geobin, args.batch)
 
     log.info("\n✅ Готово!")
 
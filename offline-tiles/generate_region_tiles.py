@@ -5,6 +5,9 @@
 
 Требования:
     pip install requests shapely tqdm
+    pip install numpy  # опционально: векторный перебор тайлов (нужен Shapely 2)
+    pip install aiohttp  # опционально: --engine async
+    pip install Pillow  # опционально: --pyramid, --recompress
 
 Использование:
     python generate_region_tiles.py --region boundaries/vladimir_oblast.geojson \
@@ -18,17 +21,27 @@
     # Буферная зона (в км) — захватить чуть больше контура:
     python generate_region_tiles.py --region boundaries/vladimir_oblast.geojson \
         --output vladimir_oblast.mbtiles --buffer 3 ...
+
+    # Много регионов за один проход (общие тайлы скачиваются один раз):
+    python generate_region_tiles.py --batch boundaries/ --output-dir tiles/
 """
 
+import io
 import os
 import sys
 import math
 import time
 import json
+import queue
 import sqlite3
+import hashlib
 import logging
+import threading
 import argparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import heapq
+import itertools
+import contextlib
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 try:
     import requests
@@ -39,19 +52,50 @@ except ImportError:
     sys.exit(1)
 
 try:
-    from shapely.geometry import shape, box, mapping
-    from shapely.ops import unary_union
+    from shapely.geometry import box, mapping
+    from shapely.prepared import prep
     from shapely import __version__ as shapely_version
 except ImportError:
     print("❌ Установите shapely: pip install shapely")
     sys.exit(1)
 
+try:
+    # Опционально: асинхронный движок загрузки (--engine async)
+    import asyncio
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    # Пиковая память процесса (нет на Windows)
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    # Опционально: сборка обзорных зумов из дочерних тайлов (--pyramid)
+    from PIL import Image
+except ImportError:
+    Image = None
+
 try:
     from tqdm import tqdm
 except ImportError:
     # Fallback: простой прогресс без tqdm
     tqdm = None
 
+try:
+    # Векторный перебор тайлов: NumPy + Shapely 2 (array-предикаты)
+    import numpy as np
+    import shapely
+    VECTORIZED = int(shapely_version.split(".")[0]) >= 2
+except ImportError:
+    np = None
+    VECTORIZED = False
+
+# Контуры: GeoJSON или компактный .geobin (boundary_store.py)
+from boundary_store import GEOBIN_EXT, GEOJSON_EXT, boundary_path, load_boundary  # noqa: E402
+
 # ─────────────────────────────────────────────────────────
 # Настройки по умолчанию
 # ─────────────────────────────────────────────────────────
@@ -68,7 +112,7 @@ logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s %(levelname)s: %(message)s",
     handlers=[
-        logging.FileHandler(LOGFILE, encoding="utf-8"),
+        logging.FileHandler(LOGFILE, encoding="utf-8", delay=True),  # файл — при первой записи
         logging.StreamHandler(sys.stdout),
     ],
 )
@@ -86,24 +130,18 @@ def km_to_degrees(km: float, latitude: float = 55.0) -> float:
     return km / (111.32 * math.cos(math.radians(latitude)))
 
 
-def load_region_polygon(geojson_path: str, buffer_km: float = 0):
-    """Загружает полигон региона из GeoJSON файла.
-    Поддерживает Feature, FeatureCollection, и голую Geometry."""
-    with open(geojson_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    # Извлекаем геометрию
-    if data.get("type") == "FeatureCollection":
-        geometries = [shape(feat["geometry"]) for feat in data["features"] if feat.get("geometry")]
-        polygon = unary_union(geometries)
-    elif data.get("type") == "Feature":
-        polygon = shape(data["geometry"])
-    else:
-        polygon = shape(data)
+def load_region_polygon(region_path: str, buffer_km: float = 0, timings: dict | None = None):
+    """Загружает полигон региона из GeoJSON (Feature, FeatureCollection,
+    голая Geometry) или из компактного .geobin (boundary_store.py).
+    timings — словарь, куда добавляется время этапов load и buffer (сек)."""
+    started = time.perf_counter()
+    polygon = load_boundary(region_path)
 
     if not polygon.is_valid:
         polygon = polygon.buffer(0)  # fix self-intersections
 
+    loaded = time.perf_counter()
+
     # Добавляем буферную зону
     if buffer_km > 0:
         centroid = polygon.centroid
@@ -111,7 +149,11 @@ def load_region_polygon(geojson_path: str, buffer_km: float = 0):
         polygon = polygon.buffer(buf_deg)
         log.info(f"Буферная зона: +{buffer_km} км (~{buf_deg:.4f}°)")
 
-    log.info(f"Полигон загружен: {geojson_path}")
+    if timings is not None:
+        timings["load"] = timings.get("load", 0.0) + loaded - started
+        timings["buffer"] = timings.get("buffer", 0.0) + time.perf_counter() - loaded
+
+    log.info(f"Полигон загружен: {region_path}")
     log.info(f"  Bounds: {polygon.bounds}")
     log.info(f"  Area: {polygon.area:.4f} кв.°")
 
@@ -128,6 +170,44 @@ def tile_bbox(z: int, x: int, y: int):
     return box(lon_min, lat_min, lon_max, lat_max)
 
 
+def tile_bounds_array(z: int, xs, ys):
+    """Векторный аналог tile_bbox: границы тайлов как массивы NumPy
+    (west, south, east, north) для пар xs[i], ys[i] одного зума."""
+    n = 1 << z
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    lon_min = xs / n * 360.0 - 180.0
+    lon_max = (xs + 1) / n * 360.0 - 180.0
+    lat_max = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * ys / n))))
+    lat_min = np.degrees(np.arctan(np.sinh(np.pi * (1.0 - 2.0 * (ys + 1) / n))))
+    return lon_min, lat_min, lon_max, lat_max
+
+
+VECTOR_CHUNK = 65536  # тайлов на один вызов array-предикатов Shapely
+
+
+def classify_tiles(polygon, z: int, xs, ys, with_contains: bool = True):
+    """Пакетная проверка тайлов против полигона (Shapely 2, полигон подготовлен
+    через shapely.prepare). Возвращает булевы массивы (hit, inside):
+    hit — тайл пересекает полигон, inside — тайл целиком внутри."""
+    xs = np.asarray(xs, dtype=np.int64)
+    ys = np.asarray(ys, dtype=np.int64)
+    hit = np.zeros(len(xs), dtype=bool)
+    inside = np.zeros(len(xs), dtype=bool)
+
+    for start in range(0, len(xs), VECTOR_CHUNK):
+        part = slice(start, start + VECTOR_CHUNK)
+        boxes = shapely.box(*tile_bounds_array(z, xs[part], ys[part]))
+        part_hit = shapely.intersects(polygon, boxes)
+        hit[part] = part_hit
+        if with_contains and part_hit.any():
+            part_inside = np.zeros(len(boxes), dtype=bool)
+            part_inside[part_hit] = shapely.contains(polygon, boxes[part_hit])
+            inside[part] = part_inside
+
+    return hit, inside
+
+
 def lon2tile(lon: float, z: int) -> int:
     return int((lon + 180.0) / 360.0 * (1 << z))
 
@@ -137,54 +217,278 @@ def lat2tile(lat: float, z: int) -> int:
     return int((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * (1 << z))
 
 
-def enumerate_tiles(polygon, min_zoom: int, max_zoom: int):
-    """Перечисляет все тайлы, пересекающиеся с полигоном региона."""
+def _bbox_tile_range(polygon, z: int):
+    """Диапазон тайлов прямоугольника bounds на зуме z: (x_min, x_max, y_min, y_max)."""
     west, south, east, north = polygon.bounds
-    tasks = []
+    x_min = max(0, lon2tile(west, z))
+    x_max = min((1 << z) - 1, lon2tile(east, z))
+    y_min = max(0, lat2tile(north, z))
+    y_max = min((1 << z) - 1, lat2tile(south, z))
+    return x_min, x_max, y_min, y_max
+
+
+def _bbox_tile_count(polygon, z: int) -> int:
+    """Число тайлов прямоугольника bounds на зуме z (для статистики экономии)."""
+    x_min, x_max, y_min, y_max = _bbox_tile_range(polygon, z)
+    return (x_max - x_min + 1) * (y_max - y_min + 1)
+
+
+def _plan_level(z: int, blocks: list, tiles: list, total_rect: int) -> dict:
+    """Элемент плана для одного зума."""
+    count = sum(1 << (2 * (z - cz)) for cz, _, _ in blocks) + len(tiles)
+    log.info(
+        f"  Zoom {z}: {count}/{total_rect} тайлов (экономия {100 - count*100//max(1,total_rect)}%), "
+        f"граничных {len(tiles)}"
+    )
+    return {"z": z, "blocks": blocks, "tiles": tiles, "count": count}
+
 
+def _plan_tiles_bbox(polygon, min_zoom: int, max_zoom: int) -> list[dict]:
+    """Полный обход прямоугольника bounds на каждом зуме (прежний режим)."""
     # Подготавливаем simplified-версию полигона для ускорения проверки на низких зумах
     # (на высоких зумах используем точный полигон)
     prepared_simple = polygon.simplify(0.01, preserve_topology=True)
 
+    plan = []
     for z in range(min_zoom, max_zoom + 1):
-        x_min = max(0, lon2tile(west, z))
-        x_max = min((1 << z) - 1, lon2tile(east, z))
-        y_min = max(0, lat2tile(north, z))
-        y_max = min((1 << z) - 1, lat2tile(south, z))
+        x_min, x_max, y_min, y_max = _bbox_tile_range(polygon, z)
 
         # На низких зумах (< 10) используем упрощённый полигон для скорости
         check_poly = prepared_simple if z < 10 else polygon
 
-        count = 0
+        tiles = []
         for x in range(x_min, x_max + 1):
             for y in range(y_min, y_max + 1):
                 tb = tile_bbox(z, x, y)
                 if check_poly.intersects(tb):
-                    tasks.append((z, x, y))
-                    count += 1
+                    tiles.append((x, y))
 
         total_rect = (x_max - x_min + 1) * (y_max - y_min + 1)
-        log.info(f"  Zoom {z}: {count}/{total_rect} тайлов (экономия {100 - count*100//max(1,total_rect)}%)")
+        plan.append(_plan_level(z, [], tiles, total_rect))
+
+    return plan
+
+
+def _plan_tiles_bbox_vectorized(polygon, min_zoom: int, max_zoom: int) -> list[dict]:
+    """Векторный вариант _plan_tiles_bbox: проверка целыми столбцами тайлов."""
+    prepared_simple = polygon.simplify(0.01, preserve_topology=True)
+    shapely.prepare(prepared_simple)
+    shapely.prepare(polygon)
 
-    return tasks
+    plan = []
+    for z in range(min_zoom, max_zoom + 1):
+        x_min, x_max, y_min, y_max = _bbox_tile_range(polygon, z)
+        check_poly = prepared_simple if z < 10 else polygon
+
+        ys = np.arange(y_min, y_max + 1, dtype=np.int64)
+        tiles = []
+        for x in range(x_min, x_max + 1):
+            hit, _ = classify_tiles(check_poly, z, np.full(len(ys), x), ys, with_contains=False)
+            tiles.extend((x, y) for y in ys[hit].tolist())
+
+        total_rect = (x_max - x_min + 1) * (y_max - y_min + 1)
+        plan.append(_plan_level(z, [], tiles, total_rect))
+
+    return plan
+
+
+def _plan_tiles_quadtree(polygon, min_zoom: int, max_zoom: int) -> list[dict]:
+    """Обход квадродерева сверху вниз (от z0).
+
+    В детей спускаемся только из тайлов, пересекающих полигон. Тайл, целиком
+    лежащий внутри полигона, запоминается как «покрытый»: все его потомки
+    попадают в выборку без проверок пересечения. Проверки нужны только вдоль
+    контура, поэтому стоимость растёт с периметром, а не с площадью bounds.
+    """
+    prepared = prep(polygon)
+    plan = []
+    covered = []          # (z, x, y) — тайлы целиком внутри полигона
+    frontier = [(0, 0)]   # тайлы текущего зума, пересекающие контур
+
+    for z in range(0, max_zoom + 1):
+        if z > 0:
+            candidates = [
+                (2 * x + dx, 2 * y + dy)
+                for x, y in frontier for dx in (0, 1) for dy in (0, 1)
+            ]
+        else:
+            candidates = frontier
+
+        frontier = []
+        for x, y in candidates:
+            tb = tile_bbox(z, x, y)
+            if not prepared.intersects(tb):
+                continue
+            if prepared.contains(tb):
+                covered.append((z, x, y))
+            else:
+                frontier.append((x, y))
+
+        if z >= min_zoom:
+            plan.append(_plan_level(z, list(covered), frontier, _bbox_tile_count(polygon, z)))
+
+    return plan
+
+
+# Порядок детей тайла (dx, dy) — тот же, что в скалярном обходе
+_CHILD_DX = np.array([0, 0, 1, 1], dtype=np.int64) if np is not None else None
+_CHILD_DY = np.array([0, 1, 0, 1], dtype=np.int64) if np is not None else None
+
+
+def _plan_tiles_quadtree_vectorized(polygon, min_zoom: int, max_zoom: int) -> list[dict]:
+    """Векторный вариант _plan_tiles_quadtree: все дети граничных тайлов
+    зума проверяются одним пакетом array-предикатов Shapely 2."""
+    shapely.prepare(polygon)
+    plan = []
+    covered = []
+    fx = np.zeros(1, dtype=np.int64)
+    fy = np.zeros(1, dtype=np.int64)
+
+    for z in range(0, max_zoom + 1):
+        if z > 0:
+            cx = (2 * fx[:, None] + _CHILD_DX).ravel()
+            cy = (2 * fy[:, None] + _CHILD_DY).ravel()
+        else:
+            cx, cy = fx, fy
+
+        hit, inside = classify_tiles(polygon, z, cx, cy)
+        covered.extend((z, x, y) for x, y in zip(cx[inside].tolist(), cy[inside].tolist()))
+        edge = hit & ~inside
+        fx, fy = cx[edge], cy[edge]
+
+        if z >= min_zoom:
+            frontier = list(zip(fx.tolist(), fy.tolist()))
+            plan.append(_plan_level(z, list(covered), frontier, _bbox_tile_count(polygon, z)))
+
+    return plan
+
+
+ENUMERATE_MODES = ("quadtree", "bbox")
+
+
+def plan_tiles(polygon, min_zoom: int, max_zoom: int, mode: str = "quadtree",
+               vectorized: bool | None = None) -> list[dict]:
+    """Строит компактный план перебора тайлов — по одному элементу на зум:
+    {"z", "blocks": [(cz, cx, cy)] целиком покрытых тайлов, "tiles": [(x, y)], "count"}.
+
+    Размер плана пропорционален периметру полигона (для mode="bbox" — числу тайлов),
+    сами (z, x, y) разворачиваются лениво в iter_tiles().
+
+    vectorized=None — векторный путь (NumPy + Shapely 2), если он доступен;
+    иначе скалярная проверка по одному тайлу.
+    """
+    if vectorized is None:
+        vectorized = VECTORIZED
+    elif vectorized and not VECTORIZED:
+        log.warning("NumPy/Shapely 2 недоступны — используем скалярный перебор тайлов")
+        vectorized = False
+
+    if mode == "bbox":
+        if vectorized:
+            return _plan_tiles_bbox_vectorized(polygon, min_zoom, max_zoom)
+        return _plan_tiles_bbox(polygon, min_zoom, max_zoom)
+    if vectorized:
+        return _plan_tiles_quadtree_vectorized(polygon, min_zoom, max_zoom)
+    return _plan_tiles_quadtree(polygon, min_zoom, max_zoom)
+
+
+def count_tiles(plan: list[dict]) -> int:
+    """Общее число тайлов в плане (без разворачивания)."""
+    return sum(level["count"] for level in plan)
+
+
+def _iter_level_ordered(level: dict):
+    """Тайлы уровня плана по возрастанию (x, y) — проход по столбцам.
+    В памяти только прямоугольники, пересекающие текущий столбец x
+    (блоки и граничные тайлы плана не перекрываются)."""
+    z = level["z"]
+    spans = []  # (x0, x1, y0, y1), правые границы не включены
+    for cz, cx, cy in level["blocks"]:
+        shift = z - cz
+        spans.append((cx << shift, (cx + 1) << shift, cy << shift, (cy + 1) << shift))
+    spans.extend((x, x + 1, y, y + 1) for x, y in level["tiles"])
+    spans.sort()
+
+    active = []
+    i = 0
+    x = None
+    while i < len(spans) or active:
+        x = spans[i][0] if not active else x + 1
+        active = [span for span in active if span[1] > x]
+        while i < len(spans) and spans[i][0] == x:
+            active.append(spans[i])
+            i += 1
+        active.sort(key=lambda span: span[2])
+        for _, _, y0, y1 in active:
+            for y in range(y0, y1):
+                yield (z, x, y)
+
+
+def iter_tiles(plan: list[dict], ordered: bool = False):
+    """Генератор (z, x, y) по плану: зум за зумом, покрытые блоки разворачиваются на лету.
+    ordered=True — внутри зума по возрастанию (x, y): потоки нескольких
+    пакетов можно слить без повторов (см. iter_jobs)."""
+    for level in plan:
+        if ordered:
+            yield from _iter_level_ordered(level)
+            continue
+        z = level["z"]
+        for cz, cx, cy in level["blocks"]:
+            shift = z - cz
+            side = 1 << shift
+            x0, y0 = cx << shift, cy << shift
+            for x in range(x0, x0 + side):
+                for y in range(y0, y0 + side):
+                    yield (z, x, y)
+        for x, y in level["tiles"]:
+            yield (z, x, y)
+
+
+def enumerate_tiles(polygon, min_zoom: int, max_zoom: int, mode: str = "quadtree"):
+    """Генератор всех тайлов (z, x, y), пересекающихся с полигоном региона.
+
+    mode="quadtree" — обход квадродерева (по умолчанию),
+    mode="bbox" — полный перебор прямоугольника bounds.
+    """
+    yield from iter_tiles(plan_tiles(polygon, min_zoom, max_zoom, mode))
 
 
 # ─────────────────────────────────────────────────────────
 # HTTP / Загрузка тайлов
 # ─────────────────────────────────────────────────────────
 
-def create_session():
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def create_session(pool_size: int = THREADS):
+    """HTTP-сессия с ретраями. Пул keep-alive соединений не меньше числа
+    потоков — иначе лишние потоки каждый раз открывают новое TCP-соединение."""
     session = requests.Session()
     retries = Retry(
         total=MAX_RETRIES, backoff_factor=0.5,
-        status_forcelist=(429, 500, 502, 503, 504),
+        status_forcelist=RETRY_STATUSES,
         allowed_methods=("GET",),
     )
-    session.mount("http://", HTTPAdapter(max_retries=retries))
-    session.mount("https://", HTTPAdapter(max_retries=retries))
+    for prefix in ("http://", "https://"):
+        session.mount(prefix, HTTPAdapter(
+            max_retries=retries, pool_connections=4, pool_maxsize=max(pool_size, 10),
+        ))
     return session
 
 
+def session_connection_stats(session) -> tuple[int, int]:
+    """(открыто соединений, выполнено запросов) по всем пулам urllib3 сессии."""
+    opened = requests_done = 0
+    for adapter in session.adapters.values():
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                opened += pool.num_connections
+                requests_done += pool.num_requests
+    return opened, requests_done
+
+
 def wait_for_tileserver(session, url: str, timeout: int = 60):
     start = time.time()
     while time.time() - start < timeout:
@@ -199,42 +503,577 @@ def wait_for_tileserver(session, url: str, timeout: int = 60):
     return False
 
 
-def download_tile_to_bytes(session, tileserver: str, style: str, z: int, x: int, y: int):
-    """Скачивает один тайл, возвращает (status, z, x, y, bytes|None)."""
+class ConcurrencyController:
+    """AIMD-регулятор числа одновременных запросов (--adaptive).
+
+    Пока tileserver отвечает быстро и без ошибок, лимит растёт на 1 за
+    каждые «лимит» успешных тайлов (аддитивно). При перегрузке — ERR,
+    ответ 429 (в том числе в ретраях) или сглаженная задержка выше
+    LATENCY_FACTOR × базовой — лимит умножается на DECREASE, не чаще раза
+    за период сглаженной задержки. Базовая задержка — минимум сглаженной,
+    медленно «отпускаемый» вверх: тяжёлые обзорные зумы не считаются
+    перегрузкой навсегда. Лимит всегда в [min_limit, max_limit].
+
+    record() вызывается из потоков загрузки или event loop, limit читает
+    _windowed.
+    """
+
+    LATENCY_FACTOR = 2.0
+    DECREASE = 0.75
+    EWMA_ALPHA = 0.1
+    BASE_RELAX = 1.002
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._lock = threading.Lock()
+        self._ewma = None
+        self._base = None
+        self._last_decrease = 0.0
+        self.completed = 0
+        self.errors = 0
+        self.throttled = 0
+        self.decreases = 0
+        self.peak = int(self._limit)
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def latency(self) -> float:
+        return self._ewma or 0.0
+
+    def record(self, result: tuple, latency: float, throttled: bool = False):
+        """Учитывает завершённый запрос: результат download_tile_to_bytes,
+        задержку (сек) и были ли ответы 429."""
+        status = result[0]
+        with self._lock:
+            self.completed += 1
+            if status == "ERR":
+                self.errors += 1
+            if throttled:
+                self.throttled += 1
+
+            self._ewma = latency if self._ewma is None else (
+                self._ewma + self.EWMA_ALPHA * (latency - self._ewma)
+            )
+            self._base = self._ewma if self._base is None else min(self._ewma, self._base * self.BASE_RELAX)
+
+            congested = (
+                status == "ERR" or throttled
+                or self._ewma > self._base * self.LATENCY_FACTOR
+            )
+            now = time.monotonic()
+            if congested:
+                if now - self._last_decrease > max(self._ewma, 0.5):
+                    self._limit = max(self.min_limit, self._limit * self.DECREASE)
+                    self._last_decrease = now
+                    self.decreases += 1
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+                self.peak = max(self.peak, int(self._limit))
+
+
+def _was_throttled(resp) -> bool:
+    """Были ли среди ретраев urllib3 ответы 429."""
+    retries = getattr(resp.raw, "retries", None)
+    return any(h.status == 429 for h in getattr(retries, "history", ()) or ())
+
+
+def download_tile_to_bytes(session, tileserver: str, style: str, z: int, x: int, y: int,
+                           monitor=None):
+    """Скачивает один тайл, возвращает (status, z, x, y, bytes|None).
+    monitor (RunMetrics или ConcurrencyController) получает результат,
+    задержку и были ли 429: monitor.record(result, latency, throttled)."""
     url = f"{tileserver}/styles/{style}/{z}/{x}/{y}.png"
+    start = time.monotonic()
+    throttled = False
     try:
         resp = session.get(url, timeout=TIMEOUT)
+        throttled = _was_throttled(resp) or resp.status_code == 429
         if resp.status_code == 404:
-            return ("MISSING", z, x, y, None)
-        resp.raise_for_status()
-        return ("OK", z, x, y, resp.content)
+            result = ("MISSING", z, x, y, None)
+        else:
+            resp.raise_for_status()
+            result = ("OK", z, x, y, resp.content)
     except Exception as e:
-        return ("ERR", z, x, y, str(e))
+        throttled = throttled or "429" in str(e)
+        result = ("ERR", z, x, y, str(e))
+    if monitor is not None:
+        monitor.record(result, time.monotonic() - start, throttled)
+    return result
+
+
+def _windowed(submit, tiles, window: int, cache=None, controller=None):
+    """Держит в работе не более window задач submit(z, x, y) → Future.
+
+    Генератор результатов в порядке завершения. Новые тайлы берутся из
+    итератора по мере освобождения окна (итератор читается в вызывающем
+    потоке), а готовый результат не хранится после выдачи — память не
+    зависит от размера пакета. С cache (TileCache) тайлы из кэша не уходят
+    на tileserver, а скачанные сохраняются в кэш — всё в вызывающем потоке.
+    С controller (ConcurrencyController) окно равно его текущему лимиту.
+    """
+    if cache is not None:
+        submit = cache.wrap(submit)
+    tiles = iter(tiles)
+    pending = set()
+    while True:
+        if controller is not None:
+            window = controller.limit
+        for z, x, y in itertools.islice(tiles, max(0, window - len(pending))):
+            pending.add(submit(z, x, y))
+        if not pending:
+            break
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = future.result()
+            if cache is not None and not getattr(future, "from_cache", False):
+                cache.put(*result)
+            yield result
+        del done
+
+
+def fetch_tiles(session, tileserver: str, style: str, tiles, threads: int, window: int,
+                cache=None, controller=None, monitor=None):
+    """Скачивает тайлы пулом потоков, держа в работе не более window запросов
+    (с controller — не более его лимита, потоков — controller.max_limit).
+    monitor — см. download_tile_to_bytes (по умолчанию controller).
+    Генератор результатов download_tile_to_bytes."""
+    if controller is not None:
+        threads = controller.max_limit
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        yield from _windowed(
+            lambda z, x, y: executor.submit(
+                download_tile_to_bytes, session, tileserver, style, z, x, y, monitor or controller
+            ),
+            tiles, max(window, threads), cache, controller,
+        )
+
+
+class AsyncTileFetcher:
+    """Асинхронный движок загрузки (aiohttp) для --engine async.
+
+    Event loop работает в отдельном потоке; число одновременных запросов
+    ограничено concurrency и не связано с числом потоков ОС. Пул keep-alive
+    соединений к tileserver равен concurrency. Ретраи — как в create_session:
+    MAX_RETRIES попыток с экспоненциальной паузой на 429/5xx и сетевых ошибках.
+    """
+
+    def __init__(self, tileserver: str, style: str, concurrency: int, controller=None,
+                 monitor=None):
+        self.tileserver = tileserver
+        self.style = style
+        self.controller = controller
+        self.monitor = monitor or controller
+        self.concurrency = controller.max_limit if controller is not None else concurrency
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="tiles-async", daemon=True)
+        self.session = None
+        self.semaphore = None
+
+    def __enter__(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._open(), self.loop).result()
+        return self
+
+    def __exit__(self, *exc):
+        asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def _open(self):
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._on_create)
+        trace.on_connection_reuseconn.append(self._on_reuse)
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency, limit_per_host=self.concurrency,
+            keepalive_timeout=60,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector, trace_configs=[trace],
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=TIMEOUT, sock_read=TIMEOUT),
+        )
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def _on_create(self, session, ctx, params):
+        self.connections_created += 1
+
+    async def _on_reuse(self, session, ctx, params):
+        self.connections_reused += 1
+
+    async def download(self, z: int, x: int, y: int):
+        """Асинхронный аналог download_tile_to_bytes: (status, z, x, y, bytes|None)."""
+        url = f"{self.tileserver}/styles/{self.style}/{z}/{x}/{y}.png"
+        async with self.semaphore:
+            start = time.monotonic()
+            result, throttled = await self._download(url, z, x, y)
+        if self.monitor is not None:
+            self.monitor.record(result, time.monotonic() - start, throttled)
+        return result
+
+    async def _download(self, url: str, z: int, x: int, y: int):
+        """Запрос с ретраями: (результат, были ли ответы 429)."""
+        error = None
+        throttled = False
+        for attempt in range(MAX_RETRIES + 1):
+            if attempt:
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+            try:
+                async with self.session.get(url) as resp:
+                    if resp.status == 404:
+                        return ("MISSING", z, x, y, None), throttled
+                    if resp.status in RETRY_STATUSES:
+                        throttled = throttled or resp.status == 429
+                        error = f"HTTP {resp.status}"
+                        continue
+                    if resp.status >= 400:
+                        # Прочие 4xx/5xx — как в потоковом движке: ошибка без ретраев
+                        return ("ERR", z, x, y, f"HTTP {resp.status}: {resp.reason}"), throttled
+                    return ("OK", z, x, y, await resp.read()), throttled
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+        return ("ERR", z, x, y, error), throttled
+
+    def submit(self, z: int, x: int, y: int):
+        """Ставит загрузку тайла в event loop, возвращает concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(self.download(z, x, y), self.loop)
+
+    def fetch(self, tiles, window: int, cache=None):
+        """Генератор результатов с ограниченным окном (см. _windowed)."""
+        yield from _windowed(self.submit, tiles, max(window, self.concurrency), cache, self.controller)
+
+
+ENGINES = ("threads", "async")
+
+
+# ─────────────────────────────────────────────────────────
+# Кэш тайлов на диске
+# ─────────────────────────────────────────────────────────
+
+TILE_CACHE_MB = 4096
+
+
+class TileCache:
+    """Постоянный кэш отрендеренных тайлов между запусками (--tile-cache DIR).
+
+    Ключ — (tileserver, стиль, z, x, y), содержимое хранится по SHA-1 в
+    blobs/ab/abcdef….png: одинаковые тайлы (вода, лес) лежат на диске один
+    раз. Индекс — index.sqlite, ответы 404 тоже кэшируются. Размер
+    ограничен max_mb, при переполнении вытесняются давно не читанные
+    записи (LRU). Отпечаток /styles.json и style.json стиля сохраняется в
+    индексе: если стиль изменился, кэш этого стиля сбрасывается (bind).
+
+    Все методы вызываются из одного потока (см. _windowed).
+    """
+
+    TOUCH_BATCH = 1000
+    COMMIT_EVERY = 500
+
+    def __init__(self, path: str, max_mb: int = TILE_CACHE_MB):
+        self.path = path
+        self.max_bytes = max_mb * 1024 * 1024
+        os.makedirs(os.path.join(path, "blobs"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, "index.sqlite"))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS scopes (
+                scope TEXT PRIMARY KEY, tileserver TEXT, style TEXT,
+                fingerprint TEXT, updated REAL
+            );
+            CREATE TABLE IF NOT EXISTS blobs (hash TEXT PRIMARY KEY, size INTEGER, refs INTEGER);
+            CREATE TABLE IF NOT EXISTS entries (
+                scope TEXT, z INTEGER, x INTEGER, y INTEGER,
+                status TEXT, hash TEXT, atime REAL,
+                PRIMARY KEY (scope, z, x, y)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime);
+        """)
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+        self.scope = None
+        self.hits = self.misses = self.stored = self.evicted = 0
+        self._touched = []
+        self._writes = 0
+
+    # ── привязка к стилю ──
+
+    def bind(self, session, tileserver: str, style: str) -> bool:
+        """Выбирает область кэша для tileserver + стиля и сверяет отпечаток
+        стиля. Возвращает True, если стиль изменился и кэш сброшен."""
+        digest = hashlib.sha1()
+        for url in (f"{tileserver}/styles.json", f"{tileserver}/styles/{style}/style.json"):
+            try:
+                r = session.get(url, timeout=TIMEOUT)
+                digest.update(str(r.status_code).encode())
+                digest.update(r.content)
+            except Exception as e:
+                log.warning(f"Кэш тайлов: не удалось получить {url}: {e}")
+        fingerprint = digest.hexdigest()
+
+        self.scope = hashlib.sha1(f"{tileserver}|{style}".encode()).hexdigest()[:16]
+        row = self.db.execute(
+            "SELECT fingerprint FROM scopes WHERE scope=?", (self.scope,)
+        ).fetchone()
+        invalidated = row is not None and row[0] != fingerprint
+        if invalidated:
+            dropped = self._purge_scope(self.scope)
+            log.info(f"Кэш тайлов: стиль {style} изменился — сброшено {dropped} записей")
+        self.db.execute(
+            "INSERT OR REPLACE INTO scopes VALUES (?, ?, ?, ?, ?)",
+            (self.scope, tileserver, style, fingerprint, time.time()),
+        )
+        self.db.commit()
+        return invalidated
+
+    # ── чтение / запись ──
+
+    def _blob_path(self, h: str) -> str:
+        return os.path.join(self.path, "blobs", h[:2], f"{h}.png")
+
+    def get(self, z: int, x: int, y: int):
+        """(status, bytes|None) из кэша или None, если тайла нет."""
+        row = self.db.execute(
+            "SELECT status, hash FROM entries WHERE scope=? AND z=? AND x=? AND y=?",
+            (self.scope, z, x, y),
+        ).fetchone()
+        data = None
+        if row is not None and row[0] == "OK":
+            try:
+                with open(self._blob_path(row[1]), "rb") as f:
+                    data = f.read()
+            except OSError:
+                self._drop_entry(z, x, y, row[1])
+                row = None
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._touched.append((time.time(), self.scope, z, x, y))
+        if len(self._touched) >= self.TOUCH_BATCH:
+            self._flush_touched()
+        return row[0], data
+
+    def put(self, status: str, z: int, x: int, y: int, data):
+        """Сохраняет результат загрузки. Ошибки (ERR) не кэшируются."""
+        if status not in ("OK", "MISSING"):
+            return
+        h = None
+        if status == "OK":
+            h = hashlib.sha1(data).hexdigest()
+            row = self.db.execute("SELECT refs FROM blobs WHERE hash=?", (h,)).fetchone()
+            if row is None:
+                path = self._blob_path(h)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+                self.db.execute("INSERT INTO blobs VALUES (?, ?, 1)", (h, len(data)))
+                self.size += len(data)
+            else:
+                self.db.execute("UPDATE blobs SET refs = refs + 1 WHERE hash=?", (h,))
+
+        old = self.db.execute(
+            "SELECT hash FROM entries WHERE scope=? AND z=? AND x=? AND y=?",
+            (self.scope, z, x, y),
+        ).fetchone()
+        if old is not None:
+            self._drop_entry(z, x, y, old[0])
+        self.db.execute(
+            "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.scope, z, x, y, status, h, time.time()),
+        )
+        self.stored += 1
+        self._writes += 1
+        if self.size > self.max_bytes:
+            self.evict()
+        if self._writes >= self.COMMIT_EVERY:
+            self.db.commit()
+            self._writes = 0
+
+    def wrap(self, submit):
+        """submit(z, x, y) → Future, который для тайлов из кэша сразу готов
+        (future.from_cache = True) и не обращается к tileserver."""
+        def cached_submit(z, x, y):
+            hit = self.get(z, x, y)
+            if hit is None:
+                return submit(z, x, y)
+            future = Future()
+            future.from_cache = True
+            future.set_result((hit[0], z, x, y, hit[1]))
+            return future
+        return cached_submit
+
+    # ── вытеснение ──
+
+    def _unref(self, h):
+        if h is None:
+            return
+        self.db.execute("UPDATE blobs SET refs = refs - 1 WHERE hash=?", (h,))
+        row = self.db.execute("SELECT size FROM blobs WHERE hash=? AND refs <= 0", (h,)).fetchone()
+        if row is not None:
+            self.db.execute("DELETE FROM blobs WHERE hash=?", (h,))
+            self.size -= row[0]
+            try:
+                os.remove(self._blob_path(h))
+            except OSError:
+                pass
+
+    def _drop_entry(self, z: int, x: int, y: int, h, scope=None):
+        self.db.execute(
+            "DELETE FROM entries WHERE scope=? AND z=? AND x=? AND y=?",
+            (scope or self.scope, z, x, y),
+        )
+        self._unref(h)
+
+    def _purge_scope(self, scope: str) -> int:
+        rows = self.db.execute(
+            "SELECT z, x, y, hash FROM entries WHERE scope=?", (scope,)
+        ).fetchall()
+        for z, x, y, h in rows:
+            self._drop_entry(z, x, y, h, scope)
+        return len(rows)
+
+    def evict(self):
+        """Удаляет давно не читанные записи, пока кэш не станет ≤ 90% лимита."""
+        self._flush_touched()
+        target = self.max_bytes * 0.9
+        while self.size > target:
+            rows = self.db.execute(
+                "SELECT scope, z, x, y, hash FROM entries ORDER BY atime LIMIT 1000"
+            ).fetchall()
+            if not rows:
+                break
+            for scope, z, x, y, h in rows:
+                self._drop_entry(z, x, y, h, scope)
+                self.evicted += 1
+                if self.size <= target:
+                    break
+        self.db.commit()
+
+    def _flush_touched(self):
+        if self._touched:
+            self.db.executemany(
+                "UPDATE entries SET atime=? WHERE scope=? AND z=? AND x=? AND y=?",
+                self._touched,
+            )
+            self._touched.clear()
+
+    def close(self):
+        self._flush_touched()
+        self.db.commit()
+        self.db.close()
+
+    def report(self) -> str:
+        lookups = self.hits + self.misses
+        return (
+            f"Кэш тайлов: попаданий {self.hits} из {lookups} "
+            f"({self.hits * 100 // max(1, lookups)}%), сохранено {self.stored}, "
+            f"вытеснено {self.evicted}, на диске {self.size / (1024 * 1024):.1f} "
+            f"из {self.max_bytes // (1024 * 1024)} МБ"
+        )
 
 
 # ─────────────────────────────────────────────────────────
 # MBTiles упаковка
 # ─────────────────────────────────────────────────────────
 
-def create_mbtiles(output_path: str, name: str, polygon, min_zoom: int, max_zoom: int):
-    """Создаёт пустой MBTiles с заполненными метаданными."""
-    if os.path.exists(output_path):
-        os.remove(output_path)
+def mbtiles_is_dedup(db) -> bool:
+    """True, если MBTiles в дедуплицированной схеме (images + map + view tiles)."""
+    row = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'map'").fetchone()
+    return row is not None
 
-    db = sqlite3.connect(output_path)
-    db.execute("CREATE TABLE metadata (name TEXT, value TEXT)")
-    db.execute("""CREATE TABLE tiles (
+
+def _create_flat_schema(db):
+    """Классическая схема MBTiles: одна таблица tiles."""
+    db.execute("""CREATE TABLE IF NOT EXISTS tiles (
         zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
         tile_data BLOB
     )""")
-    db.execute("CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)")
+
+
+def _create_dedup_schema(db):
+    """Дедуплицированная схема MBTiles: уникальные изображения в images
+    (ключ — хэш содержимого), ссылки z/x/y → хэш в map. View tiles
+    сохраняет привычный интерфейс для читателей (backend/src/routes/tileRoutes.js)."""
+    db.execute("CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB)")
+    db.execute("""CREATE TABLE IF NOT EXISTS map (
+        zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+        tile_id TEXT
+    )""")
+    db.execute("""CREATE VIEW IF NOT EXISTS tiles AS
+        SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+               map.tile_row AS tile_row, images.tile_data AS tile_data
+        FROM map JOIN images ON images.tile_id = map.tile_id""")
+
+
+def create_mbtiles_indexes(db):
+    """Уникальный индекс по (z, x, y) — строится один раз после массовой загрузки."""
+    if mbtiles_is_dedup(db):
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS map_index ON map (zoom_level, tile_column, tile_row)")
+    else:
+        db.execute("CREATE UNIQUE INDEX IF NOT EXISTS tile_index ON tiles (zoom_level, tile_column, tile_row)")
+
+
+def create_mbtiles(output_path: str, name: str, polygon, min_zoom: int, max_zoom: int,
+                   resume: bool = False, dedup: bool = False, defer_index: bool = False,
+                   tile_format: str = "png"):
+    """Создаёт пустой MBTiles с заполненными метаданными.
+
+    resume=True — существующий файл не удаляется: схема дополняется
+    недостающими таблицами, метаданные перезаписываются, тайлы сохраняются.
+    dedup=True — дедуплицированная схема (images + map), см. _create_dedup_schema.
+    При resume схема определяется существующим файлом.
+    defer_index=True — уникальный индекс тайлов не создаётся (см. finalize_mbtiles).
+    tile_format — формат тайлов для метаданных (png / webp, см. --recompress).
+    """
+    if not resume:
+        # -wal / -shm от упавшего прошлого запуска SQLite применил бы к новому файлу
+        for path in (output_path, output_path + "-wal", output_path + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    db = sqlite3.connect(output_path)
+    db.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT)")
+
+    existing = db.execute(
+        "SELECT type FROM sqlite_master WHERE name = 'tiles'"
+    ).fetchone()
+    if existing:
+        file_dedup = existing[0] == "view"
+        if file_dedup != dedup:
+            log.warning(
+                f"Схема {output_path} — {'дедуплицированная' if file_dedup else 'плоская'}, "
+                f"продолжаем в ней"
+            )
+        dedup = file_dedup
+
+    if dedup:
+        _create_dedup_schema(db)
+    else:
+        _create_flat_schema(db)
+    if not defer_index:
+        create_mbtiles_indexes(db)
+
+    # Тайлы, не скачанные в прошлых запусках (ERR — повторить, MISSING — 404 у tileserver)
+    db.execute("""CREATE TABLE IF NOT EXISTS failed_tiles (
+        zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+        status TEXT, error TEXT, attempts INTEGER,
+        PRIMARY KEY (zoom_level, tile_column, tile_row)
+    )""")
 
     west, south, east, north = polygon.bounds
     centroid = polygon.centroid
     center_zoom = (min_zoom + max_zoom) // 2
 
     meta = {
-        "format": "png",
+        "format": tile_format,
         "name": name,
         "description": f"Растровые тайлы: {name}",
         "bounds": f"{west:.6f},{south:.6f},{east:.6f},{north:.6f}",
@@ -245,6 +1084,7 @@ def create_mbtiles(output_path: str, name: str, polygon, min_zoom: int, max_zoom
         "version": "1",
         "clip_type": "polygon",  # маркер: нарезано по полигону
     }
+    db.execute("DELETE FROM metadata")
     for k, v in meta.items():
         db.execute("INSERT INTO metadata VALUES (?, ?)", (k, v))
 
@@ -252,23 +1092,1076 @@ def create_mbtiles(output_path: str, name: str, polygon, min_zoom: int, max_zoom
     return db
 
 
-def insert_tile(db, z: int, x: int, y: int, data: bytes):
-    """Вставляет тайл в MBTiles (y конвертируется в TMS)."""
-    tms_y = (1 << z) - 1 - y
-    db.execute(
-        "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
-        (z, x, tms_y, data),
+def insert_tiles(db, rows, dedup: bool = False) -> tuple[int, int]:
+    """Пакетная вставка тайлов [(z, x, y, bytes)] через executemany
+    (y конвертируется в TMS).
+
+    Возвращает (изображений записано, байт записано): в плоской схеме —
+    все тайлы, в дедуплицированной — только изображения, которых ещё не было.
+    """
+    if not dedup:
+        db.executemany(
+            "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+            [(z, x, (1 << z) - 1 - y, data) for z, x, y, data in rows],
+        )
+        return len(rows), sum(len(row[3]) for row in rows)
+
+    images, links = {}, []
+    for z, x, y, data in rows:
+        tile_id = hashlib.md5(data).hexdigest()
+        images[tile_id] = data
+        links.append((z, x, (1 << z) - 1 - y, tile_id))
+
+    ids = list(images)
+    for start in range(0, len(ids), 500):
+        chunk = ids[start:start + 500]
+        placeholders = ",".join("?" * len(chunk))
+        for (tile_id,) in db.execute(
+            f"SELECT tile_id FROM images WHERE tile_id IN ({placeholders})", chunk
+        ):
+            del images[tile_id]
+
+    db.executemany("INSERT INTO images VALUES (?, ?)", images.items())
+    db.executemany("INSERT OR REPLACE INTO map VALUES (?, ?, ?, ?)", links)
+    return len(images), sum(len(data) for data in images.values())
+
+
+def insert_tile(db, z: int, x: int, y: int, data: bytes, dedup: bool = False) -> bool:
+    """Вставляет тайл в MBTiles (y конвертируется в TMS).
+
+    Возвращает True, если байты тайла записаны в файл, и False, если в
+    дедуплицированной схеме такое изображение уже было.
+    """
+    return insert_tiles(db, [(z, x, y, data)], dedup=dedup)[0] > 0
+
+
+def drop_orphan_images(db) -> int:
+    """Удаляет изображения, на которые больше не ссылается map (после перезаписи тайлов)."""
+    cur = db.execute("DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map)")
+    return cur.rowcount
+
+
+def record_failures(db, rows):
+    """Запоминает тайлы [(z, x, y, status, error)], которые не удалось скачать,
+    в таблице failed_tiles."""
+    db.executemany(
+        """INSERT INTO failed_tiles VALUES (?, ?, ?, ?, ?, 1)
+           ON CONFLICT (zoom_level, tile_column, tile_row) DO UPDATE SET
+               status = excluded.status, error = excluded.error,
+               attempts = attempts + 1""",
+        [(z, x, (1 << z) - 1 - y, status, error) for z, x, y, status, error in rows],
     )
 
 
+def record_failure(db, z: int, x: int, y: int, status: str, error: str | None):
+    """Запоминает тайл, который не удалось скачать, в таблице failed_tiles."""
+    record_failures(db, [(z, x, y, status, error)])
+
+
+def finalize_mbtiles(db, vacuum: bool = True):
+    """Завершение массовой загрузки: индекс тайлов, ANALYZE и (опционально) VACUUM.
+    Файл возвращается в режим журнала DELETE — один файл без -wal/-shm,
+    который бэкенд открывает только на чтение."""
+    create_mbtiles_indexes(db)
+    db.commit()
+    db.execute("ANALYZE")
+    db.commit()
+    db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db.execute("PRAGMA journal_mode=DELETE")
+    if vacuum:
+        db.execute("VACUUM")
+
+
+class MBTilesWriter(threading.Thread):
+    """Отдельный поток записи в MBTiles.
+
+    Принимает тайлы и ошибки через очередь и пишет их пакетами по batch_size
+    (executemany + один commit на пакет) через собственное соединение
+    с настройками массовой загрузки: WAL, synchronous=OFF, большой кэш.
+    Основной поток только кладёт результаты в очередь и не ждёт диска.
+    """
+
+    def __init__(self, path: str, dedup: bool = False, batch_size: int = 500,
+                 cache_mb: int = 256):
+        super().__init__(name="mbtiles-writer", daemon=True)
+        self.path = path
+        self.dedup = dedup
+        self.batch_size = batch_size
+        self.cache_mb = cache_mb
+        self.queue = queue.Queue(maxsize=batch_size * 8)
+        self.error = None
+        self.tiles_written = 0
+        self.images_written = 0
+        self.bytes_written = 0
+        self.commits = 0
+        self.write_seconds = 0.0
+        self.commit_seconds = 0.0
+
+    def put_tile(self, z: int, x: int, y: int, data: bytes):
+        self._put(("tile", (z, x, y, data)))
+
+    def put_failure(self, z: int, x: int, y: int, status: str, error: str | None):
+        self._put(("fail", (z, x, y, status, error)))
+
+    def flush(self):
+        """Ждёт, пока всё поставленное в очередь будет записано и закоммичено."""
+        done = threading.Event()
+        self._put(("flush", done))
+        while not done.wait(0.5):
+            self._check()
+
+    def close(self):
+        """Дописывает очередь и закрывает соединение потока записи."""
+        self._put(("stop", None))
+        self.join()
+        self._check()
+
+    def _put(self, item):
+        self._check()
+        self.queue.put(item)
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError(f"Ошибка записи в {self.path}: {self.error}") from self.error
+
+    def _write(self, db, tiles: list, failures: list):
+        started = time.perf_counter()
+        if tiles:
+            images, nbytes = insert_tiles(db, tiles, dedup=self.dedup)
+            self.tiles_written += len(tiles)
+            self.images_written += images
+            self.bytes_written += nbytes
+        if failures:
+            record_failures(db, failures)
+        committing = time.perf_counter()
+        db.commit()
+        self.commits += 1
+        self.commit_seconds += time.perf_counter() - committing
+        self.write_seconds += time.perf_counter() - started
+
+    def run(self):
+        db = None
+        try:
+            db = sqlite3.connect(self.path)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=OFF")
+            db.execute(f"PRAGMA cache_size=-{self.cache_mb * 1024}")
+            db.execute("PRAGMA temp_store=MEMORY")
+
+            tiles, failures = [], []
+            while True:
+                try:
+                    kind, payload = self.queue.get(timeout=1.0)
+                except queue.Empty:
+                    kind, payload = "idle", None
+
+                if kind == "tile":
+                    tiles.append(payload)
+                elif kind == "fail":
+                    failures.append(payload)
+
+                if kind in ("flush", "stop", "idle") or len(tiles) + len(failures) >= self.batch_size:
+                    if tiles or failures:
+                        self._write(db, tiles, failures)
+                        tiles, failures = [], []
+                    if kind == "flush":
+                        payload.set()
+                    elif kind == "stop":
+                        break
+        except Exception as e:
+            self.error = e
+            # Разблокируем производителя, ждущего места в очереди
+            while True:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item[0] == "flush":
+                    item[1].set()
+        finally:
+            if db is not None:
+                db.close()
+
+
+def _tile_table(db) -> str:
+    """Таблица с координатами тайлов: tiles (плоская схема) или map (дедуплицированная)."""
+    return "map" if mbtiles_is_dedup(db) else "tiles"
+
+
+def clear_recovered_failures(db) -> int:
+    """Удаляет из failed_tiles тайлы, которые уже есть в tiles. Возвращает их число."""
+    cur = db.execute(
+        f"""DELETE FROM failed_tiles WHERE EXISTS (
+               SELECT 1 FROM {_tile_table(db)} t WHERE t.zoom_level = failed_tiles.zoom_level
+                   AND t.tile_column = failed_tiles.tile_column
+                   AND t.tile_row = failed_tiles.tile_row)"""
+    )
+    return cur.rowcount
+
+
+def done_tiles(db, z: int) -> set:
+    """Множество (x, y) зума z, которые повторно качать не нужно:
+    уже сохранённые тайлы и тайлы, на которые tileserver ответил 404."""
+    top = (1 << z) - 1
+    done = {(x, top - row) for x, row in db.execute(
+        f"SELECT tile_column, tile_row FROM {_tile_table(db)} WHERE zoom_level = ?", (z,)
+    )}
+    done.update((x, top - row) for x, row in db.execute(
+        "SELECT tile_column, tile_row FROM failed_tiles WHERE zoom_level = ? AND status = 'MISSING'", (z,)
+    ))
+    return done
+
+
+def stored_tiles(db, z: int) -> set:
+    """Множество (x, y) зума z, сохранённых в MBTiles (без 404 и ошибок)."""
+    top = (1 << z) - 1
+    return {(x, top - row) for x, row in db.execute(
+        f"SELECT tile_column, tile_row FROM {_tile_table(db)} WHERE zoom_level = ?", (z,)
+    )}
+
+
+def count_done_tiles(db, min_zoom: int, max_zoom: int) -> int:
+    """Сколько тайлов диапазона зумов уже обработано (см. done_tiles)."""
+    stored = db.execute(
+        f"SELECT COUNT(*) FROM {_tile_table(db)} WHERE zoom_level BETWEEN ? AND ?",
+        (min_zoom, max_zoom),
+    ).fetchone()[0]
+    missing = db.execute(
+        "SELECT COUNT(*) FROM failed_tiles WHERE zoom_level BETWEEN ? AND ? AND status = 'MISSING'",
+        (min_zoom, max_zoom),
+    ).fetchone()[0]
+    return stored + missing
+
+
+def skip_done_tiles(db, tiles):
+    """Фильтр для --resume: пропускает тайлы, уже обработанные в прошлых запусках.
+    Множество готовых тайлов держится в памяти только для текущего зума."""
+    current_z, done = None, set()
+    for z, x, y in tiles:
+        if z != current_z:
+            current_z, done = z, done_tiles(db, z)
+        if (x, y) not in done:
+            yield (z, x, y)
+
+
+def failed_tiles(db) -> list:
+    """Тайлы со статусом ERR из прошлых запусков (для --retry-failed)."""
+    return [
+        (z, x, (1 << z) - 1 - row)
+        for z, x, row in db.execute(
+            "SELECT zoom_level, tile_column, tile_row FROM failed_tiles "
+            "WHERE status = 'ERR' ORDER BY zoom_level, tile_column, tile_row"
+        )
+    ]
+
+
+# ─────────────────────────────────────────────────────────
+# Метрики и отчёт о запуске
+# ─────────────────────────────────────────────────────────
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # сек
+BYTES_BUCKETS = (1024, 4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288)
+
+
+def peak_rss_mb() -> float | None:
+    """Пиковый RSS процесса, МБ (None, если модуля resource нет)."""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux — КБ, macOS — байты
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами (как у Prometheus, le — включительно)."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Оценка квантиля по верхней границе корзины."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> dict:
+        return {
+            "buckets": list(self.buckets), "counts": self.counts,
+            "sum": self.sum, "count": self.count,
+            "p50": self.quantile(0.5), "p95": self.quantile(0.95),
+        }
+
+
+class RunMetrics:
+    """Метрики запуска: время этапов, гистограммы задержки и размера тайлов
+    по зумам, пиковая память.
+
+    Этапы: load (чтение GeoJSON), buffer (буферная зона), enumerate
+    (перебор тайлов), fetch (загрузка и раскладка по пакетам, стена),
+    write / commit (поток записи SQLite), finalize (индекс, ANALYZE, VACUUM).
+    Этап, вложенный в другой (finalize пакета, закрытого во время fetch),
+    из внешнего вычитается — стена не считается дважды.
+    Сумма задержек запросов — latency.sum: если она близка к fetch ×
+    параллельность, упираемся в tileserver; если велики write/commit —
+    в SQLite; если enumerate/buffer — в Shapely.
+
+    record() — монитор для download_tile_to_bytes / AsyncTileFetcher
+    (вызывается из потоков загрузки), передаёт данные и controller.
+    """
+
+    def __init__(self, controller=None):
+        self.controller = controller
+        self.stages = {}
+        self._nested = []   # время вложенных этапов — по одному на открытый этап
+        self.latency = {}
+        self.sizes = {}
+        self.throttled = 0
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._stream = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.add_stage(name, elapsed - self._nested.pop())
+            if self._nested:
+                self._nested[-1] += elapsed
+
+    def add_stage(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def record(self, result: tuple, latency: float, throttled: bool = False):
+        status, z = result[0], result[1]
+        with self._lock:
+            if z not in self.latency:
+                self.latency[z] = Histogram(LATENCY_BUCKETS)
+                self.sizes[z] = Histogram(BYTES_BUCKETS)
+            self.latency[z].observe(latency)
+            if status == "OK" and result[4]:
+                self.sizes[z].observe(len(result[4]))
+            if throttled:
+                self.throttled += 1
+        if self.controller is not None:
+            self.controller.record(result, latency, throttled)
+
+    # ── поток JSON Lines ──
+
+    def open_stream(self, path: str):
+        self._stream = open(path, "a", encoding="utf-8")
+
+    def emit(self, event: str, **fields):
+        """Строка JSON Lines в --metrics-jsonl (если задан)."""
+        if self._stream is None:
+            return
+        line = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"), "event": event,
+            "elapsed": round(time.time() - self.started, 3),
+            "rss_mb": peak_rss_mb(),
+        }
+        line.update(fields)
+        self._stream.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self._stream.flush()
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close()
+            self._stream = None
+
+    # ── итоговый отчёт ──
+
+    def report(self, **extra) -> dict:
+        total_latency = Histogram(LATENCY_BUCKETS)
+        for hist in self.latency.values():
+            for i, n in enumerate(hist.counts):
+                total_latency.counts[i] += n
+            total_latency.sum += hist.sum
+            total_latency.count += hist.count
+        data = {
+            "elapsed": round(time.time() - self.started, 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": {k: round(v, 3) for k, v in self.stages.items()},
+            "latency": total_latency.to_dict(),
+            "latency_by_zoom": {str(z): h.to_dict() for z, h in sorted(self.latency.items())},
+            "bytes_by_zoom": {str(z): h.to_dict() for z, h in sorted(self.sizes.items())},
+            "throttled": self.throttled,
+        }
+        data.update(extra)
+        return data
+
+    def summary(self) -> str:
+        names = {
+            "load": "загрузка", "buffer": "буфер", "enumerate": "перебор", "fetch": "сеть",
+            "write": "запись", "commit": "commit", "finalize": "финализация",
+        }
+        parts = [f"{names.get(k, k)} {v:.1f}" for k, v in self.stages.items()]
+        request_seconds = sum(h.sum for h in self.latency.values())
+        return f"Этапы, сек: {', '.join(parts)}; сумма задержек запросов {request_seconds:.1f}"
+
+
+def write_json_report(path: str, data: dict):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def write_prometheus(path: str, data: dict):
+    """Метрики в формате textfile-коллектора node_exporter (атомарная запись)."""
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append(f"# HELP offline_tiles_{name} {help_text}")
+        lines.append(f"# TYPE offline_tiles_{name} {kind}")
+
+    def histogram(name, by_zoom):
+        for z, h in by_zoom.items():
+            cumulative = 0
+            for bound, n in zip(h["buckets"] + ["+Inf"], h["counts"]):
+                cumulative += n
+                lines.append(f'offline_tiles_{name}_bucket{{zoom="{z}",le="{bound}"}} {cumulative}')
+            lines.append(f'offline_tiles_{name}_sum{{zoom="{z}"}} {h["sum"]}')
+            lines.append(f'offline_tiles_{name}_count{{zoom="{z}"}} {h["count"]}')
+
+    metric("stage_seconds", "gauge", "Время этапа генерации, сек")
+    for stage, seconds in data["stages"].items():
+        lines.append(f'offline_tiles_stage_seconds{{stage="{stage}"}} {seconds}')
+    metric("tiles", "gauge", "Тайлов по статусу")
+    for status, n in data.get("tiles", {}).items():
+        lines.append(f'offline_tiles_tiles{{status="{status}"}} {n}')
+    metric("tile_latency_seconds", "histogram", "Задержка запроса тайла")
+    histogram("tile_latency_seconds", data["latency_by_zoom"])
+    metric("tile_bytes", "histogram", "Размер тайла от tileserver, байт")
+    histogram("tile_bytes", data["bytes_by_zoom"])
+    metric("run_seconds", "gauge", "Длительность запуска, сек")
+    lines.append(f"offline_tiles_run_seconds {data['elapsed']}")
+    if data["peak_rss_mb"] is not None:
+        metric("peak_rss_bytes", "gauge", "Пиковый RSS процесса")
+        lines.append(f"offline_tiles_peak_rss_bytes {int(data['peak_rss_mb'] * 1024 * 1024)}")
+
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(path + ".tmp", path)
+
+
+# ─────────────────────────────────────────────────────────
+# Пирамида: обзорные зумы из дочерних тайлов
+# ─────────────────────────────────────────────────────────
+
+# Дети тайла (x, y) в порядке вставки в мозаику 2×2: (dx, dy)
+PYRAMID_CHILDREN = ((0, 0), (1, 0), (0, 1), (1, 1))
+
+
+def parse_anchor_zooms(value: str) -> set[int]:
+    """'12,8' → {12, 8}."""
+    return {int(z) for z in value.split(",") if z.strip()}
+
+
+def read_child_tiles(db, z: int, x: int, y: int) -> list:
+    """Четыре дочерних тайла (z+1) из MBTiles в порядке PYRAMID_CHILDREN —
+    одним запросом (выполняется в основном потоке перед отправкой в пул)."""
+    top = (1 << (z + 1)) - 1
+    rows = {(col, row): data for col, row, data in db.execute(
+        "SELECT tile_column, tile_row, tile_data FROM tiles "
+        "WHERE zoom_level=? AND tile_column IN (?, ?) AND tile_row IN (?, ?)",
+        (z + 1, 2 * x, 2 * x + 1, top - 2 * y, top - 2 * y - 1),
+    )}
+    return [rows[(2 * x + dx, top - 2 * y - dy)] for dx, dy in PYRAMID_CHILDREN]
+
+
+def build_parent_tile(z: int, x: int, y: int, children: list):
+    """Собирает тайл z из четырёх детей: мозаика 512×512 → 256×256 (LANCZOS).
+    Выполняется в пуле процессов; результат как у download_tile_to_bytes."""
+    try:
+        images = [Image.open(io.BytesIO(data)) for data in children]
+        mode = "RGBA" if any(im.mode in ("RGBA", "LA", "P") for im in images) else "RGB"
+        size = images[0].width
+        mosaic = Image.new(mode, (size * 2, size * 2))
+        for (dx, dy), im in zip(PYRAMID_CHILDREN, images):
+            mosaic.paste(im.convert(mode), (dx * size, dy * size))
+        out = io.BytesIO()
+        mosaic.resize((size, size), Image.LANCZOS).save(out, "PNG")
+        return ("OK", z, x, y, out.getvalue())
+    except Exception as e:
+        return ("ERR", z, x, y, f"pyramid: {e}")
+
+
+def pyramid_anchor(target: dict, z: int, anchors: set) -> bool:
+    """Зум скачивается с tileserver: верхний зум пакета или явный якорь."""
+    return z == target["max_zoom"] or z in anchors
+
+
+def split_pyramid_level(target: dict, z: int, server: list):
+    """Тайлы зума z, которые можно собрать из уже записанных детей (генератор).
+    Тайлы, у которых хотя бы одного ребёнка нет (вне полигона, 404, ERR),
+    добавляются в server — их рендерит tileserver."""
+    target["writer"].flush()
+    children = stored_tiles(target["db"], z + 1)
+    for tile in target_zoom_tiles(target, z):
+        _, x, y = tile
+        if all((2 * x + dx, 2 * y + dy) in children for dx, dy in PYRAMID_CHILDREN):
+            yield tile
+        else:
+            server.append(tile)
+
+
+# ─────────────────────────────────────────────────────────
+# Постобработка: перекодирование тайлов
+# ─────────────────────────────────────────────────────────
+
+RECOMPRESS_MODES = ("none", "png", "palette", "webp")
+PALETTE_STEPS = (256, 128, 64, 32)  # число цветов палитры при превышении --max-tile-kb
+WEBP_MIN_QUALITY = 40
+
+
+def recompress_format(mode: str) -> str:
+    """Значение format в метаданных MBTiles для режима --recompress."""
+    return "webp" if mode == "webp" else "png"
+
+
+def _encode(im, mode: str, quality: int = 80, colors: int = 256) -> bytes:
+    out = io.BytesIO()
+    if mode == "webp":
+        im.save(out, "WEBP", quality=quality, method=4)
+    elif mode == "palette":
+        alpha = im.mode in ("RGBA", "LA") or "transparency" in im.info
+        im = im.convert("RGBA" if alpha else "RGB")
+        im.quantize(colors, method=Image.Quantize.FASTOCTREE).save(out, "PNG", optimize=True)
+    else:
+        im.save(out, "PNG", optimize=True)
+    return out.getvalue()
+
+
+def recompress_tile(z: int, x: int, y: int, data: bytes, mode: str,
+                    quality: int = 80, max_bytes: int = 0):
+    """Перекодирует PNG тайла (выполняется в пуле процессов).
+
+    png — без потерь (optimize), palette — палитра до 256 цветов, webp —
+    WebP с quality. max_bytes > 0 — бюджет размера: WebP понижает качество
+    с шагом 10 (не ниже WEBP_MIN_QUALITY), палитра — число цветов
+    (PALETTE_STEPS). Для png/palette исходник остаётся, если он меньше.
+    Результат — (status, z, x, y, bytes, исходный размер).
+    """
+    try:
+        im = Image.open(io.BytesIO(data))
+        im.load()
+        if mode == "webp":
+            steps = [dict(quality=q) for q in range(quality, WEBP_MIN_QUALITY - 1, -10)] or [dict(quality=quality)]
+        elif mode == "palette":
+            steps = [dict(colors=c) for c in PALETTE_STEPS]
+        else:
+            steps = [{}]
+
+        out = None
+        for params in steps:
+            out = _encode(im, mode, **params)
+            if not max_bytes or len(out) <= max_bytes:
+                break
+        if mode != "webp" and len(out) >= len(data):
+            out = data
+        return ("OK", z, x, y, out, len(data))
+    except Exception as e:
+        return ("ERR", z, x, y, f"recompress: {e}", len(data))
+
+
+def recompress_results(results, pool, mode: str, quality: int, max_bytes: int,
+                       window: int, savings: dict):
+    """Пропускает результаты загрузки через recompress_tile в пуле процессов.
+
+    Генератор: тайлы OK уходят в пул (не больше window одновременно),
+    MISSING/ERR проходят сразу. savings[z] = [байт до, байт после, тайлов
+    сверх бюджета].
+    """
+    pending = set()
+
+    def finished(futures):
+        for future in futures:
+            result = future.result()
+            z, data = result[1], result[4]
+            if result[0] == "OK":
+                entry = savings.setdefault(z, [0, 0, 0])
+                entry[0] += result[5]
+                entry[1] += len(data)
+                if max_bytes and len(data) > max_bytes:
+                    entry[2] += 1
+            yield result
+
+    try:
+        for result in results:
+            status, z, x, y, data = result[:5]
+            if status != "OK" or not data:
+                yield result
+                continue
+            pending.add(pool.submit(recompress_tile, z, x, y, data, mode, quality, max_bytes))
+            result = data = None
+            if len(pending) >= window:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
+    finally:
+        results.close()
+        for future in pending:
+            future.cancel()
+
+
+def log_recompress_savings(mode: str, savings: dict):
+    """Экономия перекодирования по зумам."""
+    if not savings:
+        return
+    total_in = sum(v[0] for v in savings.values())
+    total_out = sum(v[1] for v in savings.values())
+    log.info(
+        f"   Перекодирование ({mode}): {total_in / (1024 * 1024):.1f} → "
+        f"{total_out / (1024 * 1024):.1f} МБ ({round(total_out * 100 / max(1, total_in)) - 100:+d}%)"
+    )
+    for z in sorted(savings):
+        before, after, over = savings[z]
+        over_note = f", сверх бюджета {over}" if over else ""
+        log.info(
+            f"     z{z}: {before / 1024:.0f} → {after / 1024:.0f} КБ "
+            f"({round(after * 100 / max(1, before)) - 100:+d}%){over_note}"
+        )
+
+
+# ─────────────────────────────────────────────────────────
+# Пакеты (один MBTiles = один target)
+# ─────────────────────────────────────────────────────────
+
+CAPITAL_ZOOMS = (8, 16)  # зумы столиц по умолчанию (*_capital.geojson), как в HOWTO
+
+
+def parse_zoom_range(value: str) -> tuple[int, int]:
+    """'8-16' → (8, 16)."""
+    lo, _, hi = value.partition("-")
+    return int(lo), int(hi or lo)
+
+
+def collect_batch_targets(args) -> list[dict]:
+    """Пакеты для --batch: файлы контуров (или все *.geojson / *.geobin каталогов;
+    из пары с одним именем берётся boundary_path — .geobin, если он не старше),
+    зумы — по умолчанию --min-zoom/--max-zoom, для *_capital — --capital-zooms,
+    точечно — --zooms id=min-max."""
+    files = []
+    for path in args.batch:
+        if os.path.isdir(path):
+            stems = sorted({
+                os.path.splitext(f)[0] for f in os.listdir(path)
+                if f.endswith((GEOJSON_EXT, GEOBIN_EXT))
+            })
+            files.extend(boundary_path(path, stem) for stem in stems)
+        else:
+            files.append(path)
+
+    overrides = {}
+    for item in args.zooms or []:
+        rid, _, zooms = item.partition("=")
+        overrides[rid] = parse_zoom_range(zooms)
+    capital_zooms = parse_zoom_range(args.capital_zooms)
+
+    targets = []
+    for path in files:
+        rid = os.path.splitext(os.path.basename(path))[0]
+        if rid in overrides:
+            min_zoom, max_zoom = overrides[rid]
+        elif rid.endswith("_capital"):
+            min_zoom, max_zoom = capital_zooms
+        else:
+            min_zoom, max_zoom = args.min_zoom, args.max_zoom
+        targets.append({
+            "name": rid, "region": path,
+            "output": os.path.join(args.output_dir, f"{rid}.mbtiles"),
+            "min_zoom": min_zoom, "max_zoom": max_zoom,
+        })
+    return targets
+
+
+def prepare_target(target: dict, args, metrics: RunMetrics):
+    """Полигон и план перебора тайлов пакета."""
+    polygon = load_region_polygon(target["region"], buffer_km=args.buffer, timings=metrics.stages)
+    vector_note = "векторно" if VECTORIZED and not args.no_vectorize else "скалярно"
+    log.info(f"Подсчёт тайлов в полигоне ({args.enumerate}, {vector_note})...")
+    with metrics.stage("enumerate"):
+        plan = plan_tiles(polygon, target["min_zoom"], target["max_zoom"], mode=args.enumerate,
+                          vectorized=False if args.no_vectorize else None)
+    target.update(polygon=polygon, plan=plan, total=count_tiles(plan))
+    log.info(f"Всего тайлов для загрузки: {target['total']}")
+
+
+def open_target(target: dict, args, cache_mb: int):
+    """Создаёт (или при --resume открывает) MBTiles пакета и запускает поток записи."""
+    resume = (args.resume or args.retry_failed) and os.path.exists(target["output"])
+    db = create_mbtiles(target["output"], target["name"], target["polygon"],
+                        target["min_zoom"], target["max_zoom"],
+                        resume=resume, dedup=args.dedup, defer_index=not args.pyramid,
+                        tile_format=recompress_format(args.recompress))
+    dedup = mbtiles_is_dedup(db)
+    writer = MBTilesWriter(target["output"], dedup=dedup, batch_size=args.batch_size, cache_mb=cache_mb)
+    writer.start()
+    target.update(
+        db=db, writer=writer, resume=resume, dedup=dedup, closed=False, bytes=0,
+        stats={"OK": 0, "MISSING": 0, "ERR": 0, "SKIP": 0},
+    )
+
+    if args.retry_failed:
+        retry = failed_tiles(db) if resume else []
+        target["retry"] = retry
+        target["todo"] = len(retry)
+        log.info(f"{target['name']}: повтор тайлов с ошибками: {len(retry)}")
+    elif resume:
+        done = count_done_tiles(db, target["min_zoom"], target["max_zoom"])
+        target["todo"] = max(0, target["total"] - done)
+        log.info(f"{target['name']}: продолжение, уже обработано {done}, осталось ~{target['todo']}")
+    else:
+        target["todo"] = target["total"]
+
+
+def target_zoom_tiles(target: dict, z: int):
+    """Тайлы пакета на зуме z, которые нужно скачать в этом запуске,
+    по возрастанию (x, y) — см. iter_jobs."""
+    if "retry" in target:
+        return iter(sorted(tile for tile in target["retry"] if tile[0] == z))
+    levels = [level for level in target["plan"] if level["z"] == z]
+    if target["resume"]:
+        return skip_done_tiles(target["db"], iter_tiles(levels, ordered=True))
+    return iter_tiles(levels, ordered=True)
+
+
+def _merge_zoom_tiles(streams: list[tuple[int, object]], counts: list[int]):
+    """Сливает упорядоченные потоки тайлов пакетов [(индекс, поток)] одного
+    зума: (тайл, [индексы пакетов]) без повторов. counts[0] — сколько тайлов
+    выдали потоки (с повторами)."""
+    def tagged(idx, tiles):
+        last = None
+        for tile in tiles:
+            if last is not None and tile <= last:
+                raise ValueError(f"Тайлы пакета {idx} не упорядочены: {tile} после {last}")
+            last = tile
+            counts[0] += 1
+            yield tile, idx
+
+    tile, idxs = None, []
+    for next_tile, idx in heapq.merge(*(tagged(i, tiles) for i, tiles in streams)):
+        if next_tile != tile:
+            if idxs:
+                yield tile, idxs
+            tile, idxs = next_tile, []
+        idxs.append(idx)
+    if idxs:
+        yield tile, idxs
+
+
+def iter_jobs(targets: list[dict], owners: dict, pending: dict, zooms=None,
+              tiles_for=target_zoom_tiles):
+    """Генератор уникальных тайлов всех пакетов, зум за зумом.
+
+    Тайл, нужный нескольким пакетам (перекрытие буферов соседей, регион
+    и его столица), выдаётся один раз; owners[(z, x, y)] — индексы пакетов,
+    в которые его нужно записать (запись удаляет consume по результату,
+    так что в owners — только тайлы в работе). pending[z] — сколько
+    выданных тайлов зума ещё не вернулось (см. run_targets). Для одного
+    пакета owners не заполняется. zooms и tiles_for(target, z) задают зумы
+    и тайлы (по умолчанию — все зумы пакетов и target_zoom_tiles);
+    потоки tiles_for должны идти по возрастанию (x, y) — пакеты сливаются
+    лениво, без списка тайлов зума в памяти.
+    """
+    if zooms is None:
+        zooms = sorted({z for t in targets for z in range(t["min_zoom"], t["max_zoom"] + 1)})
+    single = len(targets) == 1
+
+    for z in zooms:
+        members = [i for i, t in enumerate(targets) if t["min_zoom"] <= z <= t["max_zoom"]]
+        pending.setdefault(z, 0)
+        if single:
+            for tile in tiles_for(targets[0], z):
+                pending[z] += 1
+                yield tile
+            continue
+
+        requested = [0]
+        unique = 0
+        for tile, idxs in _merge_zoom_tiles([(i, tiles_for(targets[i], z)) for i in members], requested):
+            if len(idxs) > 1 or idxs[0] != 0:
+                owners[tile] = idxs
+            unique += 1
+            pending[z] += 1
+            yield tile
+        if requested[0]:
+            log.info(
+                f"  Zoom {z}: {unique} уникальных тайлов для {len(members)} пакетов "
+                f"(без объединения {requested[0]}, экономия {100 - unique*100//requested[0]}%)"
+            )
+
+
+def target_complete(target: dict, pending: dict) -> bool:
+    """Все тайлы пакета выданы и вернулись: генератор ушёл дальше его max_zoom,
+    а по его зумам не осталось запросов в работе."""
+    if max(pending) <= target["max_zoom"]:
+        return False
+    return all(not pending.get(z) for z in range(target["min_zoom"], target["max_zoom"] + 1))
+
+
+def close_target(target: dict, args, metrics: RunMetrics):
+    """Дописывает очередь пакета, строит индекс, ANALYZE / VACUUM, печатает итог."""
+    if target["closed"]:
+        return
+    target["closed"] = True
+    writer, db = target["writer"], target["db"]
+    writer.close()
+    metrics.add_stage("write", writer.write_seconds - writer.commit_seconds)
+    metrics.add_stage("commit", writer.commit_seconds)
+    log.info(
+        f"{target['name']}: запись {writer.tiles_written} тайлов, {writer.commits} commit, "
+        f"{writer.write_seconds:.1f} сек в SQLite"
+    )
+    log.info("Финализация MBTiles: индекс, ANALYZE" + ("" if args.no_vacuum else ", VACUUM") + "...")
+    with metrics.stage("finalize"):
+        recovered = clear_recovered_failures(db)
+        if target["dedup"] and target["resume"]:
+            drop_orphan_images(db)
+        db.commit()
+        finalize_mbtiles(db, vacuum=not args.no_vacuum)
+        db.close()
+    if recovered:
+        log.info(f"Восстановлено тайлов из failed_tiles: {recovered}")
+
+    stats = target["stats"]
+    final_size = os.path.getsize(target["output"]) / (1024 * 1024)
+    target["size_mb"] = round(final_size, 3)
+    log.info(f"✅ Готово: {target['output']}")
+    log.info(f"   Размер: {final_size:.1f} МБ")
+    derived = f", СОБРАНО={stats['DERIVED']}" if stats.get("DERIVED") else ""
+    log.info(f"   Тайлов: OK={stats['OK']}, MISSING={stats['MISSING']}, ERR={stats['ERR']}{derived}")
+    if target["dedup"] and writer.tiles_written:
+        unique = writer.images_written
+        log.info(
+            f"   Дедупликация: {writer.tiles_written} тайлов → {unique} уникальных "
+            f"(×{writer.tiles_written / max(1, unique):.2f}), "
+            f"записано {writer.bytes_written / (1024 * 1024):.1f} "
+            f"из {target['bytes'] / (1024 * 1024):.1f} МБ"
+        )
+
+
+def run_targets(targets: list[dict], args, session, metrics: RunMetrics, cache=None) -> dict:
+    """Скачивает тайлы всех пакетов одним потоком запросов и раскладывает
+    каждый результат во все MBTiles, которым он нужен. Возвращает общую статистику.
+    cache — TileCache или None. С --pyramid зумы идут сверху вниз: якорные
+    скачиваются, остальные собираются из детей (run_pyramid)."""
+    cache_mb = max(8, args.cache_mb // len(targets))
+    for target in targets:
+        open_target(target, args, cache_mb)
+
+    total = sum(t["todo"] for t in targets)
+    stats = {"OK": 0, "MISSING": 0, "ERR": 0, "SKIP": 0, "DERIVED": 0}
+    start_time = time.time()
+    bar = tqdm(total=total, desc="tiles", unit="tile") if tqdm else None
+    done = 0
+
+    controller = None
+    if args.adaptive:
+        initial = args.concurrency if args.engine == "async" else args.threads
+        controller = ConcurrencyController(initial, args.min_concurrency, args.max_concurrency)
+        log.info(
+            f"Адаптивная конкурентность: старт {controller.limit}, "
+            f"границы {controller.min_limit}–{controller.max_limit}"
+        )
+
+    metrics.controller = controller
+
+    async_fetcher = None
+    if args.engine == "async":
+        async_fetcher = AsyncTileFetcher(
+            args.tileserver, args.style, args.concurrency, controller, metrics
+        ).__enter__()
+
+    recompress_pool = None
+    savings = {}
+    if args.recompress != "none":
+        workers = args.recompress_workers or os.cpu_count() or 1
+        recompress_window = workers * 4
+        recompress_pool = ProcessPoolExecutor(max_workers=workers)
+        log.info(f"Перекодирование тайлов: {args.recompress}, {workers} процессов")
+
+    def fetch(jobs):
+        if async_fetcher is not None:
+            return async_fetcher.fetch(jobs, args.window or args.concurrency * 2, cache)
+        window = args.window or args.threads * 4
+        return fetch_tiles(
+            session, args.tileserver, args.style, jobs, args.threads, window, cache, controller,
+            metrics,
+        )
+
+    def consume(results, owners: dict, pending=None, default=(0,), derived=False):
+        """Раскладывает результаты по пакетам; pending — для раннего закрытия."""
+        nonlocal done
+        if recompress_pool is not None:
+            results = recompress_results(
+                results, recompress_pool, args.recompress, args.webp_quality,
+                args.max_tile_kb * 1024, recompress_window, savings,
+            )
+        try:
+            for result in results:
+                status, z, x, y = result[:4]
+                # Собранные пирамидой тайлы — отдельно: OK / MISSING / ERR — ответы tileserver
+                key = "DERIVED" if derived and status == "OK" else status
+                stats[key] += 1
+
+                for idx in owners.pop((z, x, y), None) or default:
+                    target = targets[idx]
+                    target["stats"][key] = target["stats"].get(key, 0) + 1
+                    if status == "OK" and result[4]:
+                        target["bytes"] += len(result[4])
+                        target["writer"].put_tile(z, x, y, result[4])
+                    elif status != "OK":
+                        target["writer"].put_failure(z, x, y, status, result[4])
+
+                # Отпускаем PNG сразу после передачи в поток записи — не копим результаты
+                result = None
+
+                # Пакеты, все зумы которых уже скачаны, закрываем сразу (индекс, VACUUM)
+                if pending is not None:
+                    pending[z] -= 1
+                    if pending[z] == 0 and len(targets) > 1:
+                        for target in targets:
+                            if not target["closed"] and target_complete(target, pending):
+                                close_target(target, args, metrics)
+
+                done += 1
+                if bar is not None:
+                    bar.update(1)
+                if done % 500 == 0 or done == total:
+                    elapsed = time.time() - start_time
+                    rate = done / elapsed if elapsed > 0 else 0
+                    adaptive = (
+                        f" | параллельно {controller.limit}, задержка {controller.latency * 1000:.0f} мс"
+                        if controller is not None else ""
+                    )
+                    pyramid = f" СОБРАНО:{stats['DERIVED']}" if args.pyramid else ""
+                    log.info(
+                        f"Прогресс: {done}/{total} ({rate:.0f} тайлов/сек) — "
+                        f"OK:{stats['OK']} MISS:{stats['MISSING']} ERR:{stats['ERR']}{pyramid}{adaptive}"
+                    )
+                    metrics.emit(
+                        "progress", done=done, total=total, rate=round(rate, 1),
+                        tiles={k: stats[k] for k in ("OK", "MISSING", "ERR", "DERIVED")},
+                        concurrency=controller.limit if controller is not None else None,
+                    )
+        finally:
+            results.close()
+
+    interrupted = False
+    try:
+        with metrics.stage("fetch"):
+            if args.pyramid:
+                run_pyramid(targets, args, fetch, consume)
+            else:
+                owners, pending = {}, {}
+                consume(fetch(iter_jobs(targets, owners, pending)), owners, pending)
+    except KeyboardInterrupt:
+        interrupted = True
+        log.warning("⏹️  Прервано пользователем — сохраняем скачанное")
+    finally:
+        if bar is not None:
+            bar.close()
+        if async_fetcher is not None:
+            async_fetcher.__exit__(None, None, None)
+        if recompress_pool is not None:
+            recompress_pool.shutdown(cancel_futures=True)
+
+    if async_fetcher is not None:
+        opened, reused = async_fetcher.connections_created, async_fetcher.connections_reused
+        requests_done = opened + reused
+    else:
+        opened, requests_done = session_connection_stats(session)
+        reused = max(0, requests_done - opened)
+
+    log.info("=" * 60)
+    for target in targets:
+        close_target(target, args, metrics)
+
+    stats.update(
+        interrupted=interrupted, elapsed=time.time() - start_time,
+        opened=opened, reused=reused, requests=requests_done, controller=controller,
+        savings=savings,
+    )
+    return stats
+
+
+def run_pyramid(targets: list[dict], args, fetch, consume):
+    """--pyramid: зумы от верхнего к нижнему. На якорных зумах пакета тайлы
+    скачиваются; на остальных тайл собирается из четырёх уже записанных
+    детей в пуле процессов, а с tileserver берутся только тайлы, у которых
+    детей нет (край полигона, 404, ошибки)."""
+    anchors = parse_anchor_zooms(args.anchor_zooms) if args.anchor_zooms else set()
+    zooms = sorted({z for t in targets for z in range(t["min_zoom"], t["max_zoom"] + 1)}, reverse=True)
+    workers = args.pyramid_workers or os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for z in zooms:
+            for idx, target in enumerate(targets):
+                target["pyramid_server"] = None
+                if not target["min_zoom"] <= z <= target["max_zoom"] or pyramid_anchor(target, z, anchors):
+                    continue
+                server = target["pyramid_server"] = []
+                db = target["db"]
+                consume(
+                    _windowed(
+                        lambda tz, x, y: pool.submit(
+                            build_parent_tile, tz, x, y, read_child_tiles(db, tz, x, y)
+                        ),
+                        split_pyramid_level(target, z, server), workers * 4,
+                    ),
+                    {}, default=(idx,), derived=True,
+                )
+
+            owners = {}
+            consume(
+                fetch(iter_jobs(
+                    targets, owners, {}, zooms=[z],
+                    tiles_for=lambda t, tz: (
+                        target_zoom_tiles(t, tz) if t["pyramid_server"] is None else t["pyramid_server"]
+                    ),
+                )),
+                owners,
+            )
+
+
 # ─────────────────────────────────────────────────────────
 # Main
 # ─────────────────────────────────────────────────────────
 
 def parse_args():
     p = argparse.ArgumentParser(description="Генерация растровых тайлов по полигону региона")
-    p.add_argument("--region", required=True, help="GeoJSON файл с контуром региона")
-    p.add_argument("--output", required=True, help="Выходной .mbtiles файл")
+    p.add_argument("--region", help="Файл с контуром региона: GeoJSON или .geobin (boundary_store.py)")
+    p.add_argument("--output", help="Выходной .mbtiles файл")
+    p.add_argument("--batch", nargs="+", metavar="PATH",
+                   help="Пакетный режим: несколько GeoJSON / .geobin (или каталогов, например boundaries/); "
+                        "общие тайлы скачиваются один раз")
+    p.add_argument("--output-dir", default=".", help="Каталог для MBTiles в пакетном режиме")
+    p.add_argument("--capital-zooms", default=f"{CAPITAL_ZOOMS[0]}-{CAPITAL_ZOOMS[1]}",
+                   help="Зумы для *_capital.geojson в пакетном режиме (по умолчанию 8-16)")
+    p.add_argument("--zooms", nargs="*", metavar="ID=MIN-MAX",
+                   help="Зумы отдельных регионов в пакетном режиме, например moscow_city=4-14")
     p.add_argument("--name", default="Region", help="Название региона для метаданных")
     p.add_argument("--min-zoom", type=int, default=4, help="Минимальный zoom (по умолчанию 4)")
     p.add_argument("--max-zoom", type=int, default=12, help="Максимальный zoom (по умолчанию 12)")
@@ -277,103 +2170,189 @@ def parse_args():
     p.add_argument("--tileserver", default=TILESERVER_URL, help="URL tileserver-gl")
     p.add_argument("--style", default=STYLE, help="Имя стиля tileserver-gl")
     p.add_argument("--batch-size", type=int, default=500, help="Размер пакета для commit")
+    p.add_argument("--cache-mb", type=int, default=256, help="Кэш SQLite потока записи, МБ (по умолчанию 256)")
+    p.add_argument("--tile-cache", metavar="DIR",
+                   help="Каталог постоянного кэша тайлов между запусками (по умолчанию выключен)")
+    p.add_argument("--tile-cache-mb", type=int, default=TILE_CACHE_MB,
+                   help=f"Лимит кэша тайлов, МБ (по умолчанию {TILE_CACHE_MB})")
+    p.add_argument("--no-vacuum", action="store_true", help="Не выполнять VACUUM в конце (быстрее для больших пакетов)")
+    p.add_argument("--engine", choices=ENGINES, default="threads",
+                   help="Движок загрузки: threads — пул потоков, async — aiohttp (pip install aiohttp)")
+    p.add_argument("--concurrency", type=int, default=200,
+                   help="Одновременных запросов для --engine async (по умолчанию 200)")
+    p.add_argument("--adaptive", action="store_true",
+                   help="Подбирать число одновременных запросов (AIMD) по задержке, ошибкам и 429")
+    p.add_argument("--min-concurrency", type=int, default=4,
+                   help="Нижняя граница для --adaptive (по умолчанию 4)")
+    p.add_argument("--max-concurrency", type=int, default=64,
+                   help="Верхняя граница для --adaptive (по умолчанию 64)")
+    p.add_argument("--window", type=int, default=0,
+                   help="Максимум тайлов в работе одновременно (по умолчанию threads × 4, для async — concurrency × 2)")
+    p.add_argument("--pyramid", action="store_true",
+                   help="Скачивать только верхний зум (и --anchor-zooms), нижние собирать из дочерних тайлов (Pillow)")
+    p.add_argument("--anchor-zooms", metavar="Z,Z",
+                   help="Дополнительные зумы, которые в --pyramid скачиваются с tileserver, например 8")
+    p.add_argument("--pyramid-workers", type=int, default=0,
+                   help="Процессов для сборки тайлов в --pyramid (по умолчанию — число ядер)")
+    p.add_argument("--recompress", choices=RECOMPRESS_MODES, default="none",
+                   help="Перекодирование перед записью: png — без потерь, palette — палитра, webp — WebP")
+    p.add_argument("--webp-quality", type=int, default=80, help="Качество WebP (по умолчанию 80)")
+    p.add_argument("--max-tile-kb", type=int, default=0,
+                   help="Бюджет размера тайла, КБ: при превышении понижается качество/палитра")
+    p.add_argument("--recompress-workers", type=int, default=0,
+                   help="Процессов для перекодирования (по умолчанию — число ядер)")
+    p.add_argument("--metrics-jsonl", metavar="PATH",
+                   help="Поток метрик JSON Lines (строка на каждую запись прогресса)")
+    p.add_argument("--report", metavar="PATH",
+                   help="Итоговый JSON-отчёт: этапы, гистограммы задержки и размера по зумам, память")
+    p.add_argument("--prometheus", metavar="PATH",
+                   help="Итоговые метрики в textfile для node_exporter (*.prom)")
+    p.add_argument("--enumerate", choices=ENUMERATE_MODES, default="quadtree",
+                   help="Перебор тайлов: quadtree — обход квадродерева, bbox — полный прямоугольник")
+    p.add_argument("--no-vectorize", action="store_true",
+                   help="Скалярная проверка тайлов (без NumPy/Shapely 2)")
+    p.add_argument("--dedup", action="store_true",
+                   help="Дедуплицированная схема MBTiles: одинаковые тайлы хранятся один раз")
+    p.add_argument("--resume", action="store_true",
+                   help="Дописать существующий MBTiles: качать только отсутствующие тайлы")
+    p.add_argument("--retry-failed", action="store_true",
+                   help="Повторить только тайлы с ошибками из прошлых запусков (подразумевает --resume)")
     return p.parse_args()
 
 
 def main():
     args = parse_args()
 
+    if args.batch:
+        targets = collect_batch_targets(args)
+        os.makedirs(args.output_dir, exist_ok=True)
+    elif args.region and args.output:
+        targets = [{
+            "name": args.name, "region": args.region, "output": args.output,
+            "min_zoom": args.min_zoom, "max_zoom": args.max_zoom,
+        }]
+    else:
+        log.error("Укажите --region и --output (или --batch)")
+        sys.exit(1)
+
     log.info("=" * 60)
-    log.info(f"Генерация тайлов: {args.name}")
-    log.info(f"  Регион: {args.region}")
-    log.info(f"  Выход:  {args.output}")
-    log.info(f"  Zoom:   {args.min_zoom}–{args.max_zoom}")
+    if args.batch:
+        log.info(f"Пакетная генерация: {len(targets)} MBTiles → {args.output_dir}")
+    else:
+        log.info(f"Генерация тайлов: {args.name}")
+        log.info(f"  Регион: {args.region}")
+        log.info(f"  Выход:  {args.output}")
+        log.info(f"  Zoom:   {args.min_zoom}–{args.max_zoom}")
     log.info(f"  Буфер:  {args.buffer} км")
-    log.info(f"  Потоки: {args.threads}")
+    if args.engine == "async":
+        log.info(f"  Движок: async, {args.concurrency} одновременных запросов")
+    else:
+        log.info(f"  Потоки: {args.threads}")
     log.info("=" * 60)
 
-    # 1. Загружаем полигон
-    polygon = load_region_polygon(args.region, buffer_km=args.buffer)
+    if args.engine == "async" and aiohttp is None:
+        log.error("Для --engine async установите aiohttp: pip install aiohttp")
+        sys.exit(1)
+    if (args.pyramid or args.recompress != "none") and Image is None:
+        log.error("Для --pyramid и --recompress установите Pillow: pip install Pillow")
+        sys.exit(1)
+
+    metrics = RunMetrics()
+    if args.metrics_jsonl:
+        metrics.open_stream(args.metrics_jsonl)
+        metrics.emit("start", targets=[t["name"] for t in targets], engine=args.engine)
 
-    # 2. Перечисляем тайлы, попадающие в полигон
-    log.info("Подсчёт тайлов в полигоне...")
-    tasks = enumerate_tiles(polygon, args.min_zoom, args.max_zoom)
-    log.info(f"Всего тайлов для загрузки: {len(tasks)}")
+    # 1–2. Загружаем полигоны и перечисляем тайлы, попадающие в них
+    for target in targets:
+        if args.batch:
+            log.info(f"── {target['name']} (z{target['min_zoom']}–{target['max_zoom']})")
+        prepare_target(target, args, metrics)
 
-    if not tasks:
+    if not sum(t["total"] for t in targets):
         log.error("Нет тайлов для загрузки. Проверьте GeoJSON и zoom-уровни.")
         sys.exit(1)
 
     # 3. Проверяем tileserver
-    session = create_session()
+    session = create_session(max(args.threads, args.max_concurrency if args.adaptive else 0))
     if not wait_for_tileserver(session, args.tileserver):
         log.error(f"Tileserver {args.tileserver} недоступен!")
         sys.exit(2)
 
-    # 4. Создаём MBTiles
-    db = create_mbtiles(args.output, args.name, polygon, args.min_zoom, args.max_zoom)
-
-    # 5. Загружаем тайлы параллельно
-    stats = {"OK": 0, "MISSING": 0, "ERR": 0, "SKIP": 0}
-    batch_count = 0
-    start_time = time.time()
-
-    def process_batch():
-        nonlocal batch_count
-        db.commit()
-        batch_count = 0
-
-    iterator_fn = tqdm if tqdm else lambda x, **kw: x
-
-    with ThreadPoolExecutor(max_workers=args.threads) as executor:
-        futures = {
-            executor.submit(
-                download_tile_to_bytes, session, args.tileserver, args.style, z, x, y
-            ): (z, x, y)
-            for z, x, y in tasks
-        }
+    cache = None
+    if args.tile_cache:
+        cache = TileCache(args.tile_cache, args.tile_cache_mb)
+        cache.bind(session, args.tileserver, args.style)
+        log.info(f"Кэш тайлов: {args.tile_cache} ({cache.size / (1024 * 1024):.1f} МБ)")
 
-        for i, future in enumerate(
-            iterator_fn(as_completed(futures), total=len(tasks), desc="tiles", unit="tile"), 1
-        ):
-            result = future.result()
-            status = result[0]
-            stats[status] = stats.get(status, 0) + 1
-
-            if status == "OK" and result[4]:
-                z, x, y = result[1], result[2], result[3]
-                insert_tile(db, z, x, y, result[4])
-                batch_count += 1
-
-                if batch_count >= args.batch_size:
-                    process_batch()
-
-            if i % 500 == 0 or i == len(tasks):
-                elapsed = time.time() - start_time
-                rate = i / elapsed if elapsed > 0 else 0
-                log.info(
-                    f"Прогресс: {i}/{len(tasks)} ({rate:.0f} тайлов/сек) — "
-                    f"OK:{stats['OK']} MISS:{stats['MISSING']} ERR:{stats['ERR']}"
-                )
-
-    # Финальный commit
-    db.commit()
+    # 4–5. Создаём MBTiles и загружаем тайлы параллельно
+    try:
+        stats = run_targets(targets, args, session, metrics, cache)
+    finally:
+        if cache is not None:
+            cache.close()
 
     # 6. Итоги
-    elapsed = time.time() - start_time
-    final_size = os.path.getsize(args.output) / (1024 * 1024)
-
+    elapsed = stats["elapsed"]
     log.info("=" * 60)
-    log.info(f"✅ Готово: {args.output}")
-    log.info(f"   Размер: {final_size:.1f} МБ")
-    log.info(f"   Тайлов: OK={stats['OK']}, MISSING={stats['MISSING']}, ERR={stats['ERR']}")
+    # Только ответы tileserver: собранные пирамидой тайлы (DERIVED) не в счёт
+    requested = sum(t["stats"]["OK"] + t["stats"]["MISSING"] + t["stats"]["ERR"] for t in targets)
+    if args.batch and requested:
+        fetched = stats["OK"] + stats["MISSING"] + stats["ERR"]
+        log.info(
+            f"   Запросов к tileserver: {fetched} вместо {requested} "
+            f"(экономия {100 - fetched*100//max(1,requested)}%)"
+        )
+    log_recompress_savings(args.recompress, stats["savings"])
+    if stats["DERIVED"]:
+        log.info(
+            f"   Пирамида: собрано локально {stats['DERIVED']} тайлов, "
+            f"с tileserver {stats['OK'] + stats['MISSING'] + stats['ERR']}"
+        )
+    log.info(
+        f"   Соединения: открыто {stats['opened']}, переиспользовано {stats['reused']} "
+        f"({stats['reused'] * 100 // max(1, stats['requests'])}% запросов по keep-alive)"
+    )
+    controller = stats["controller"]
+    if controller is not None:
+        log.info(
+            f"   Конкурентность: итог {controller.limit}, максимум {controller.peak}, "
+            f"снижений {controller.decreases} (429: {controller.throttled}, ERR: {controller.errors})"
+        )
+    if cache is not None:
+        log.info(f"   {cache.report()}")
+    log.info(f"   {metrics.summary()}")
+    rss = peak_rss_mb()
+    if rss is not None:
+        log.info(f"   Пиковая память: {rss:.0f} МБ")
     log.info(f"   Время: {elapsed:.0f} сек ({elapsed/60:.1f} мин)")
     log.info("=" * 60)
 
-    db.close()
-
-    if stats["ERR"] > 0:
-        log.warning(f"⚠️  {stats['ERR']} тайлов с ошибками. Перезапустите для повторной загрузки.")
+    report = metrics.report(
+        interrupted=stats["interrupted"],
+        tiles={k: stats[k] for k in ("OK", "MISSING", "ERR", "DERIVED")},
+        connections={"opened": stats["opened"], "reused": stats["reused"]},
+        cache={"hits": cache.hits, "misses": cache.misses} if cache is not None else None,
+        targets=[
+            {"name": t["name"], "output": t["output"], "min_zoom": t["min_zoom"],
+             "max_zoom": t["max_zoom"], "tiles": t["stats"], "size_mb": t.get("size_mb")}
+            for t in targets
+        ],
+    )
+    metrics.emit("done", tiles=report["tiles"], stages=report["stages"])
+    metrics.close()
+    if args.report:
+        write_json_report(args.report, report)
+        log.info(f"Отчёт: {args.report}")
+    if args.prometheus:
+        write_prometheus(args.prometheus, report)
+
+    if stats["interrupted"]:
+        log.warning("⚠️  Генерация не завершена. Продолжите с --resume.")
+    elif stats["ERR"] > 0:
+        log.warning(
+            f"⚠️  {stats['ERR']} тайлов с ошибками записаны в failed_tiles. "
+            f"Повторите только их: --retry-failed"
+        )
 
 
 if __name__ == "__main__":
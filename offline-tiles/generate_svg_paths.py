@@ -4,37 +4,63 @@
 
 Требования:
     pip install requests shapely
+    pip install numpy  # опционально: векторная проекция (нужен Shapely 2)
 
 Использование:
     python generate_svg_paths.py                # скачать все + сгенерировать .ts
     python generate_svg_paths.py --only-convert # только конвертировать уже скачанные
     python generate_svg_paths.py --id moscow_city  # один регион
+    python generate_svg_paths.py --batch        # скачивать группами relation одним запросом
+    python generate_svg_paths.py --only-convert --workers 8  # конвертация в 8 процессов
+    python generate_svg_paths.py --sweep 0.002 0.005 0.01 0.02  # подбор tolerance
+    python generate_svg_paths.py --only-convert --topology  # общие границы — один раз
+    python generate_svg_paths.py --only-convert --encoding relative  # компактные path
+    python generate_svg_paths.py --only-convert --lod 0.002 0.001  # + детальные уровни для приближения
+    python generate_svg_paths.py --only-convert --full  # заново все регионы (без манифеста)
+
+Повторный запуск конвертирует только регионы, чей контур изменился
+(манифест boundaries/.paths_manifest.json), и перезаписывает .ts только
+при изменении содержимого.
 
 Результат:
     frontend/src/data/russiaRegionsPaths.ts
+    frontend/src/data/russiaRegionsPaths.lods.ts  (индекс уровней; без --lod — пустой)
+    frontend/src/data/russiaRegionsPaths.lod<N>.ts  (с --lod)
 """
 
 import os
 import sys
 import json
+import hashlib
 import time
 import math
 import argparse
 import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 try:
-    import requests
+    from shapely.geometry import mapping, MultiPolygon, Polygon
+    from shapely.ops import transform as shapely_transform
 except ImportError:
-    print("❌  pip install requests")
+    print("❌  pip install shapely")
     sys.exit(1)
 
 try:
-    from shapely.geometry import shape, mapping, MultiPolygon, Polygon
-    from shapely.ops import unary_union, polygonize, transform as shapely_transform
-    from shapely.geometry import LineString
+    # Опционально: проекция колец целиком массивами NumPy (Shapely 2)
+    import numpy as np
+    import shapely
+    from shapely import __version__ as _shapely_version
+    VECTORIZED = int(_shapely_version.split(".")[0]) >= 2
 except ImportError:
-    print("❌  pip install shapely")
-    sys.exit(1)
+    np = None
+    VECTORIZED = False
+
+# Контуры: GeoJSON или компактный .geobin (boundary_store.py)
+from boundary_store import boundary_path, load_boundary, shape_geojson  # noqa: E402
+# Overpass: параллельные запросы по всем эндпоинтам с лимитами (overpass_client.py)
+from overpass_client import (  # noqa: E402
+    OVERPASS_ENDPOINTS, SLOTS, OverpassClient, fetch_relation, fetch_relations,
+)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s  %(levelname)s  %(message)s")
 log = logging.getLogger(__name__)
@@ -42,21 +68,11 @@ log = logging.getLogger(__name__)
 # ─── Пути ────────────────────────────────────────────────────────────
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 BOUNDARY_DIR = os.path.join(SCRIPT_DIR, "boundaries")
+# Индекс охватов и центроидов по файлам (mtime/размер/SHA-1) — см. region_bounds
+BOUNDS_INDEX = os.path.join(BOUNDARY_DIR, ".bounds_index.json")
 PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
 OUTPUT_TS = os.path.join(PROJECT_ROOT, "frontend", "src", "data", "russiaRegionsPaths.ts")
 
-OVERPASS_URL = "https://overpass-api.de/api/interpreter"
-
-# Альтернативные эндпоинты Overpass (fallback)
-OVERPASS_ENDPOINTS = [
-    "https://overpass-api.de/api/interpreter",
-    "https://lz4.overpass-api.de/api/interpreter",
-    "https://z.overpass-api.de/api/interpreter",
-]
-
-MAX_RETRIES = 3
-RETRY_DELAY = 15  # секунд
-
 # ─── SVG‑проекция: Albers Equal‑Area Conic для России ─────────────────
 # Стандартные параллели и параметры подобраны для атласной карты РФ.
 # Зеркало projectToSvg из russiaRegionsGeo.ts — менять синхронно!
@@ -76,6 +92,8 @@ _rho0 = math.sqrt(abs(_C - 2 * _n * math.sin(_PHI0))) / _n
 # Границы «сырых» координат Albers для территории РФ (расчётные)
 # Определяются при первом запуске convert_all и используются для масштабирования
 _albers_bounds: dict | None = None
+# (scale, cx, cy) для текущих _albers_bounds — считаются один раз (_projection_constants)
+_projection: tuple[float, float, float] | None = None
 
 
 def _albers_raw(lon_deg: float, lat_deg: float) -> tuple[float, float]:
@@ -90,25 +108,26 @@ def _albers_raw(lon_deg: float, lat_deg: float) -> tuple[float, float]:
 
 
 def _compute_albers_bounds():
-    """Вычисляет охват карты по имеющимся GeoJSON‑файлам."""
-    global _albers_bounds
+    """Вычисляет охват карты по имеющимся GeoJSON‑файлам.
+    Охваты регионов берутся из индекса (region_bounds) — без разбора файлов."""
+    global _albers_bounds, _projection
+    _projection = None
     xs, ys = [], []
+    index = _load_index()
+    dirty = False
     for rid in REGIONS:
-        fpath = os.path.join(BOUNDARY_DIR, f"{rid}.geojson")
-        if not os.path.exists(fpath):
+        if not os.path.exists(boundary_path(BOUNDARY_DIR, rid)):
             continue
-        with open(fpath, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        geom_raw = data.get("geometry") or (data["features"][0]["geometry"] if data.get("type") == "FeatureCollection" else data)
-        geom = shape(geom_raw)
-        # Нормализация антимеридиана (Чукотка и т.п.)
-        geom = _normalize_antimeridian(geom)
-        bounds = geom.bounds  # (minx, miny, maxx, maxy) = (minlon, minlat, maxlon, maxlat)
+        # (minx, miny, maxx, maxy) = (minlon, minlat, maxlon, maxlat) после нормализации антимеридиана
+        bounds, changed = region_bounds(rid, index)
+        dirty = dirty or changed
         for lon in [bounds[0], bounds[2]]:
             for lat in [bounds[1], bounds[3]]:
                 ax, ay = _albers_raw(lon, lat)
                 xs.append(ax)
                 ys.append(ay)
+    if dirty:
+        _save_index(index)
     if not xs:
         # Фоллбэк: крайние точки России
         for lon, lat in [(18, 41), (18, 71), (180, 41), (180, 71), (100, 56)]:
@@ -128,25 +147,68 @@ def _compute_albers_bounds():
              f"y=[{_albers_bounds['ymin']:.4f}, {_albers_bounds['ymax']:.4f}]")
 
 
+def _projection_constants() -> tuple[float, float, float]:
+    """(scale, cx, cy) вписывания Albers в SVG — по _albers_bounds, один раз."""
+    global _projection
+    if _albers_bounds is None:
+        _compute_albers_bounds()
+    if _projection is None:
+        b = _albers_bounds
+        x_range = b["xmax"] - b["xmin"]
+        y_range = b["ymax"] - b["ymin"]
+        # Вписываем с сохранением пропорций
+        scale = min(SVG_W / x_range, SVG_H / y_range)
+        cx = (b["xmin"] + b["xmax"]) / 2
+        cy = (b["ymin"] + b["ymax"]) / 2
+        _projection = (scale, cx, cy)
+    return _projection
+
+
 def project(lon: float, lat: float) -> tuple[float, float]:
     """Проекция [lon, lat] → [x, y] для SVG viewBox 0 0 {SVG_W} {SVG_H}.
     Используется Albers Equal-Area Conic (атласная проекция РФ)."""
-    global _albers_bounds
-    if _albers_bounds is None:
-        _compute_albers_bounds()
+    scale, cx, cy = _projection_constants()
     ax, ay = _albers_raw(lon, lat)
-    b = _albers_bounds
-    x_range = b["xmax"] - b["xmin"]
-    y_range = b["ymax"] - b["ymin"]
-    # Вписываем с сохранением пропорций
-    scale = min(SVG_W / x_range, SVG_H / y_range)
-    cx = (b["xmin"] + b["xmax"]) / 2
-    cy = (b["ymin"] + b["ymax"]) / 2
     x = SVG_W / 2 + (ax - cx) * scale
     y = SVG_H / 2 - (ay - cy) * scale  # Y flipped: north = top
     return round(x, 1), round(y, 1)
 
 
+# Доля десятой, ближе которой к середине (…x5) округление NumPy перепроверяется
+# скалярным project(): math и NumPy могут расходиться в последнем бите.
+_ROUND_GUARD = 1e-6
+
+
+def project_coords(coords) -> list[tuple[float, float]]:
+    """Проекция кольца координат [(lon, lat), …] → [(x, y), …].
+
+    С NumPy — массивами, константы проекции считаются один раз. Результат
+    побитово совпадает с project() (и projectToSvg): точки, у которых
+    значение до округления почти ровно посередине между десятыми,
+    пересчитываются скалярно.
+    """
+    if np is None:
+        return [project(lon, lat) for lon, lat in coords]
+    arr = np.asarray(coords, dtype=float)
+    if not len(arr):
+        return []
+    lon, lat = arr[:, 0], arr[:, 1]
+    scale, cx, cy = _projection_constants()
+
+    theta = _n * (np.radians(lon) - _LAM0)
+    rho = np.sqrt(np.abs(_C - 2 * _n * np.sin(np.radians(lat)))) / _n
+    x = SVG_W / 2 + (rho * np.sin(theta) - cx) * scale
+    y = SVG_H / 2 - ((_rho0 - rho * np.cos(theta)) - cy) * scale
+
+    rx, ry = np.round(x, 1), np.round(y, 1)
+    tx, ty = x * 10, y * 10
+    near = (np.abs(tx - np.floor(tx) - 0.5) < _ROUND_GUARD) | (np.abs(ty - np.floor(ty) - 0.5) < _ROUND_GUARD)
+    points = list(zip(rx.tolist(), ry.tolist()))
+    for i in np.flatnonzero(near).tolist():
+        points[i] = project(float(lon[i]), float(lat[i]))
+    return points
+
+
 # ─── Каталог субъектов РФ (OSM relation id) ──────────────────────────
 REGIONS = {
     "adygea":               {"name": "Республика Адыгея",                "osm_id": 253256},
@@ -246,70 +308,33 @@ SIMPLIFY_TOLERANCE = 0.02
 # 1. Скачивание из OSM
 # ═════════════════════════════════════════════════════════════════════
 
-def fetch_boundary(osm_id: int, name: str) -> dict | None:
-    """Скачивает контур региона из Overpass API → GeoJSON dict (с ретраями)."""
-    query = f"[out:json][timeout:180];relation({osm_id});out geom;"
+def fetch_boundary(osm_id: int, name: str, client: OverpassClient) -> dict | None:
+    """Скачивает контур региона из Overpass API → GeoJSON dict
+    (ретраи и лимиты эндпоинтов — в client, потоковый разбор — parse_relations)."""
     log.info(f"  Overpass → {name}  (relation/{osm_id}) …")
 
-    data = None
-    for attempt in range(MAX_RETRIES):
-        # Ротация эндпоинтов
-        url = OVERPASS_ENDPOINTS[attempt % len(OVERPASS_ENDPOINTS)]
-        try:
-            resp = requests.post(url, data={"data": query}, timeout=240)
-            resp.raise_for_status()
-            data = resp.json()
-            break
-        except Exception as e:
-            log.warning(f"  ⚠️  Попытка {attempt+1}/{MAX_RETRIES} ({url.split('//')[1].split('/')[0]}): {e}")
-            if attempt < MAX_RETRIES - 1:
-                wait = RETRY_DELAY * (attempt + 1)
-                log.info(f"  ⏳  Ждём {wait} сек перед повтором...")
-                time.sleep(wait)
-
-    if data is None:
-        log.error(f"  ❌  Все {MAX_RETRIES} попыток неудачны для {name}")
+    try:
+        relation = fetch_relation(client, osm_id, timeout=180)
+    except Exception as e:
+        log.error(f"  ❌  {name}: {e}")
         return None
 
-    elements = data.get("elements", [])
-    if not elements:
+    if relation is None:
         log.warning(f"  ⚠️  Пустой ответ для relation/{osm_id}")
         return None
 
-    relation = elements[0]
-    members = relation.get("members", [])
+    return relation_feature(relation, osm_id, name)
 
-    outer_rings = []
-    for m in members:
-        if m.get("role") == "outer" and m.get("type") == "way":
-            geom = m.get("geometry", [])
-            if geom:
-                ring = [[pt["lon"], pt["lat"]] for pt in geom]
-                outer_rings.append(ring)
 
-    if not outer_rings:
+def relation_feature(relation: dict, osm_id: int, name: str) -> dict | None:
+    """Relation из parse_relations (полигон собран при разборе ответа)
+    → GeoJSON Feature."""
+    if not relation["ways"]:
         log.warning(f"  ⚠️  Нет outer ways для {name}")
         return None
 
-    try:
-        lines = [LineString(r) for r in outer_rings]
-        polys = list(polygonize(lines))
-        if not polys:
-            polys = []
-            for ring in outer_rings:
-                if len(ring) >= 4:
-                    if ring[0] != ring[-1]:
-                        ring.append(ring[0])
-                    try:
-                        p = Polygon(ring)
-                        polys.append(p.buffer(0) if not p.is_valid else p)
-                    except Exception:
-                        pass
-        merged = unary_union(polys) if polys else None
-        if merged is None or merged.is_empty:
-            return None
-    except Exception as e:
-        log.error(f"  ❌  Ошибка сборки: {e}")
+    merged = relation["geometry"]
+    if merged is None:
         return None
 
     feature = {
@@ -320,30 +345,57 @@ def fetch_boundary(osm_id: int, name: str) -> dict | None:
     return feature
 
 
-def download_all(only_ids: list[str] | None = None):
-    """Скачивает GeoJSON‑файлы в boundaries/."""
+def download_all(only_ids: list[str] | None = None, client: OverpassClient | None = None,
+                 batch: bool = False):
+    """Скачивает GeoJSON‑файлы в boundaries/ — параллельно, в пределах
+    слотов и лимитов эндпоинтов Overpass (client); batch — группами relation
+    в одном запросе (fetch_relations)."""
     os.makedirs(BOUNDARY_DIR, exist_ok=True)
+    client = client or OverpassClient()
     targets = {k: v for k, v in REGIONS.items() if only_ids is None or k in only_ids}
-    total = len(targets)
+    todo = []
+    for rid, info in sorted(targets.items()):
+        if os.path.exists(os.path.join(BOUNDARY_DIR, f"{rid}.geojson")):
+            log.info(f"  ⏭️  {info['name']} — уже есть")
+        else:
+            todo.append(rid)
 
-    for i, (rid, info) in enumerate(sorted(targets.items()), 1):
+    def save(rid: str, feature: dict | None) -> bool:
+        info = targets[rid]
+        if not feature:
+            log.error(f"  ❌  Не удалось скачать {info['name']}")
+            return False
         fpath = os.path.join(BOUNDARY_DIR, f"{rid}.geojson")
-        if os.path.exists(fpath):
-            log.info(f"[{i}/{total}] ⏭️  {info['name']} — уже есть")
-            continue
+        with open(fpath, "w", encoding="utf-8") as f:
+            json.dump(feature, f, ensure_ascii=False)
+        kb = os.path.getsize(fpath) / 1024
+        log.info(f"  ✅  {fpath}  ({kb:.0f} КБ)")
+        return True
 
-        log.info(f"[{i}/{total}] {info['name']}")
-        feature = fetch_boundary(info["osm_id"], info["name"])
-        if feature:
-            with open(fpath, "w", encoding="utf-8") as f:
-                json.dump(feature, f, ensure_ascii=False)
-            kb = os.path.getsize(fpath) / 1024
-            log.info(f"  ✅  {fpath}  ({kb:.0f} КБ)")
-        else:
-            log.error(f"  ❌  Не удалось скачать {info['name']}")
+    def download(rid: str) -> bool:
+        info = targets[rid]
+        return save(rid, fetch_boundary(info["osm_id"], info["name"], client))
 
-        # Пауза между запросами к Overpass
-        time.sleep(5)
+    if not todo:
+        return
+    if batch:
+        by_osm = {}
+        for rid in todo:
+            by_osm.setdefault(targets[rid]["osm_id"], []).append(rid)
+        done = 0
+        for osm_id, relation in fetch_relations(client, list(by_osm)):
+            for rid in by_osm[osm_id]:
+                name = targets[rid]["name"]
+                ok = save(rid, relation_feature(relation, osm_id, name) if relation else None)
+                done += 1
+                log.info(f"[{done}/{len(todo)}] {'✅' if ok else '❌'} {name}")
+    else:
+        with ThreadPoolExecutor(max_workers=client.concurrency) as pool:
+            futures = {pool.submit(download, rid): rid for rid in todo}
+            for i, future in enumerate(as_completed(futures), 1):
+                ok = future.result()
+                log.info(f"[{i}/{len(todo)}] {'✅' if ok else '❌'} {targets[futures[future]]['name']}")
+    log.info(f"  Overpass: {client.report()}")
 
 
 # ═════════════════════════════════════════════════════════════════════
@@ -357,6 +409,13 @@ def _normalize_antimeridian(geom):
     bounds = geom.bounds  # (minlon, minlat, maxlon, maxlat)
     if bounds[0] < -150 and bounds[2] > 150:
         # Пересекает антимеридиан — сдвигаем все отрицательные lon на +360°
+        if VECTORIZED:
+            def _shift_coords(coords):
+                coords = coords.copy()
+                coords[coords[:, 0] < 0, 0] += 360
+                return coords
+            return shapely.transform(geom, _shift_coords)
+
         def _shift_lon(x, y, z=None):
             new_x = [xi + 360 if xi < 0 else xi for xi in x]
             return (new_x, y, z) if z is not None else (new_x, y)
@@ -364,13 +423,77 @@ def _normalize_antimeridian(geom):
     return geom
 
 
+# Геометрии регионов, разобранные в этом процессе: rid → нормализованная геометрия
+_geometries: dict = {}
+
+
+def load_region(rid: str):
+    """Геометрия региона из boundaries/ (нормализованная по антимеридиану).
+    Файл разбирается один раз за запуск, дальше — из памяти."""
+    geom = _geometries.get(rid)
+    if geom is None:
+        geom = load_boundary(boundary_path(BOUNDARY_DIR, rid))
+        # Нормализация антимеридиана (Чукотка и т.п.)
+        geom = _geometries[rid] = _normalize_antimeridian(geom)
+    return geom
+
+
+def _load_index() -> dict:
+    try:
+        with open(BOUNDS_INDEX, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_index(index: dict):
+    tmp = BOUNDS_INDEX + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp, BOUNDS_INDEX)
+
+
+def _file_sha1(fpath: str) -> str:
+    digest = hashlib.sha1()
+    with open(fpath, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def region_bounds(rid: str, index: dict) -> tuple[list, bool]:
+    """(bounds, индекс изменён) — охват нормализованной геометрии региона.
+
+    Запись индекса действительна, если совпали mtime и размер файла, либо
+    размер и SHA-1 (файл «тронули», например git checkout). Иначе файл
+    разбирается (load_region) и запись обновляется.
+    """
+    fpath = boundary_path(BOUNDARY_DIR, rid)
+    st = os.stat(fpath)
+    entry = index.get(rid)
+    if entry and entry["size"] == st.st_size:
+        if entry["mtime"] == st.st_mtime:
+            return entry["bounds"], False
+        if entry["sha1"] == _file_sha1(fpath):
+            entry["mtime"] = st.st_mtime
+            return entry["bounds"], True
+
+    geom = load_region(rid)
+    index[rid] = {
+        "mtime": st.st_mtime, "size": st.st_size, "sha1": _file_sha1(fpath),
+        "bounds": list(geom.bounds),
+    }
+    return index[rid]["bounds"], True
+
+
 def geojson_to_svg_path(geojson_geom: dict, tolerance: float) -> str:
     """Конвертирует GeoJSON geometry → SVG path string (d=…)."""
-    geom = shape(geojson_geom)
-
     # Нормализация антимеридиана (Чукотка и т.п.)
-    geom = _normalize_antimeridian(geom)
+    return geometry_to_svg_path(_normalize_antimeridian(shape_geojson(geojson_geom)), tolerance)
 
+
+def geometry_to_svg_path(geom, tolerance: float) -> str:
+    """Нормализованная геометрия (load_region) → SVG path string (d=…)."""
     # Упрощаем
     geom = geom.simplify(tolerance, preserve_topology=True)
 
@@ -382,79 +505,474 @@ def geojson_to_svg_path(geojson_geom: dict, tolerance: float) -> str:
 
     for poly in geom.geoms:
         # Внешнее кольцо
-        ring = list(poly.exterior.coords)
+        ring = poly.exterior.coords
         if len(ring) < 3:
             continue
-        pts = [project(lon, lat) for lon, lat in ring]
-        svg_pts = " ".join(f"{x},{y}" for x, y in pts)
-        parts.append(f"M {svg_pts} Z")
+        parts.append(svg_ring(project_coords(ring)))
 
         # Внутренние кольца (дырки — озёра и т.п.)
         for interior in poly.interiors:
-            iring = list(interior.coords)
+            iring = interior.coords
             if len(iring) < 3:
                 continue
-            ipts = [project(lon, lat) for lon, lat in iring]
-            svg_ipts = " ".join(f"{x},{y}" for x, y in ipts)
-            parts.append(f"M {svg_ipts} Z")
+            parts.append(svg_ring(project_coords(iring)))
 
     return " ".join(parts)
 
 
+def svg_ring(pts: list[tuple[float, float]]) -> str:
+    """Спроецированное кольцо → подпуть «M x,y x,y … Z»."""
+    svg_pts = " ".join(f"{x},{y}" for x, y in pts)
+    return f"M {svg_pts} Z"
+
+
 def compute_centroid_svg(geojson_geom: dict) -> tuple[float, float]:
     """Вычисляет центроид полигона в SVG-координатах."""
-    geom = shape(geojson_geom)
     # Нормализация антимеридиана (Чукотка и т.п.)
-    geom = _normalize_antimeridian(geom)
-    c = geom.centroid
-    return project(c.x, c.y)
+    return centroid_svg(_normalize_antimeridian(shape_geojson(geojson_geom)))
 
 
-def convert_all(tolerance: float = SIMPLIFY_TOLERANCE) -> dict[str, dict]:
-    """Конвертирует все скачанные GeoJSON → dict region_id → {path, cx, cy}."""
-    # Сначала вычисляем охват всех регионов для масштабирования Albers
-    log.info("  Вычисляю охват карты (Albers bounds)…")
-    _compute_albers_bounds()
+def centroid_svg(geom) -> tuple[float, float]:
+    """Центроид нормализованной геометрии в SVG-координатах."""
+    c = geom.centroid
+    return project(c.x, c.y)
 
-    result = {}
 
+# ─── Топология: общие границы регионов (--topology) ──────────────────
+#
+# Соседние регионы в OSM делят одни и те же точки границы, но при
+# упрощении по отдельности каждая общая граница упрощается дважды
+# и по-разному: между соседями появляются щели и наложения. Здесь кольца
+# всех регионов режутся на дуги (как в TopoJSON) по точкам стыка трёх
+# и более регионов; общая дуга упрощается и проецируется один раз
+# и переиспользуется обоими соседями.
+#
+# Выигрыш — в стыках, не в размере: при 0.02 дырок в объединении
+# регионов 4 вместо 702, площадь наложений −23%, а path почти те же
+# (278 → 277 КБ; при 0.005 — 889 → 887 КБ).
+
+def _polygons(geom) -> list:
+    return list(geom.geoms) if isinstance(geom, MultiPolygon) else [geom]
+
+
+def _ring_coords(ring):
+    """Координаты кольца без замыкающей точки и без повторов подряд."""
+    coords = shapely.get_coordinates(ring)[:-1]
+    if len(coords) > 1:
+        coords = coords[np.r_[True, np.any(coords[1:] != coords[:-1], axis=1)]]
+        if len(coords) > 1 and (coords[0] == coords[-1]).all():
+            coords = coords[:-1]
+    return coords
+
+
+def build_topology(geoms: dict) -> tuple[list, dict[str, list]]:
+    """Режет кольца регионов на дуги (NumPy + Shapely 2). Возвращает (arcs, shapes):
+    arcs — массивы точек (lon, lat) [(n, 2)], каждая дуга один раз;
+    shapes — rid → полигоны → кольца → ссылки на дуги: i — дуга как есть,
+    ~i — дуга в обратном порядке (как в TopoJSON)."""
+    layout = []  # (rid, № кольца в полигоне, начало, конец) в общем массиве точек
+    chunks, size = [], 0
+    for rid, geom in geoms.items():
+        for poly in _polygons(geom):
+            for r, ring in enumerate([poly.exterior, *poly.interiors]):
+                coords = _ring_coords(ring)
+                if len(coords) < 3:
+                    # Вырожденное кольцо; без внешнего кольца пропускаем и дырки
+                    if r == 0:
+                        break
+                    continue
+                layout.append((rid, r, size, size + len(coords)))
+                chunks.append(coords)
+                size += len(coords)
+
+    # Одинаковые точки разных колец → один id (пара float64 как complex128: сравнение точное)
+    allc = np.ascontiguousarray(np.concatenate(chunks)).view(np.complex128).ravel()
+    unique, ids = np.unique(allc, return_inverse=True)
+    ids = ids.ravel()
+    points = unique.view(np.float64).reshape(-1, 2)
+
+    # Соседи каждой точки в её кольце (кольца замкнуты)
+    starts = np.array([item[2] for item in layout])
+    ends = np.array([item[3] for item in layout])
+    prev = np.empty_like(ids)
+    prev[1:] = ids[:-1]
+    prev[starts] = ids[ends - 1]
+    nxt = np.empty_like(ids)
+    nxt[:-1] = ids[1:]
+    nxt[ends - 1] = ids[starts]
+
+    # Стык — точка, которая встречается с разными парами соседей:
+    # здесь общая граница регионов расходится или сходится
+    key = np.minimum(prev, nxt).astype(np.int64) * len(unique) + np.maximum(prev, nxt)
+    key_min = np.full(len(unique), np.iinfo(np.int64).max)
+    key_max = np.full(len(unique), -1, dtype=np.int64)
+    np.minimum.at(key_min, ids, key)
+    np.maximum.at(key_max, ids, key)
+    is_junction = (key_min != key_max)[ids]
+
+    arcs: list = []
+    index: dict = {}
+
+    def arc_ref(arc) -> int:
+        ref = index.get(arc.tobytes())
+        if ref is not None:
+            return ref
+        ref = index.get(arc[::-1].tobytes())
+        if ref is not None:
+            return ~ref
+        index[arc.tobytes()] = len(arcs)
+        arcs.append(points[arc])
+        return len(arcs) - 1
+
+    shapes: dict[str, list] = {rid: [] for rid in geoms}
+    for rid, r, a, b in layout:
+        ring = ids[a:b]
+        cuts = np.flatnonzero(is_junction[a:b])
+        if not len(cuts):
+            # Кольцо без стыков (остров, анклав) — одна замкнутая дуга с канонического
+            # начала (наименьшая точка), чтобы совпасть с таким же кольцом соседа
+            ring = np.roll(ring, -int(ring.argmin()))
+            refs = [arc_ref(np.r_[ring, ring[:1]])]
+        else:
+            ring = np.roll(ring, -int(cuts[0]))
+            bounds = (cuts - cuts[0]).tolist() + [len(ring)]
+            refs = [arc_ref(ring[i:j + 1] if j < len(ring) else np.r_[ring[i:], ring[:1]])
+                    for i, j in zip(bounds, bounds[1:])]
+        if r == 0:
+            shapes[rid].append([])
+        shapes[rid][-1].append(refs)
+    return arcs, shapes
+
+
+def simplify_arcs(arcs: list, tolerance: float) -> list[list[tuple[float, float]]]:
+    """Упрощает все дуги одним вызовом и проецирует. Концы дуг (стыки)
+    сохраняются, preserve_topology не даёт дугам пересечь друг друга."""
+    counts = [len(arc) for arc in arcs]
+    lines = shapely.linestrings(np.concatenate(arcs), indices=np.repeat(np.arange(len(arcs)), counts))
+    simplified = shapely.get_parts(
+        shapely.simplify(shapely.multilinestrings(lines), tolerance, preserve_topology=True)
+    )
+    pts = project_coords(shapely.get_coordinates(simplified))
+    offsets = [0] + np.cumsum(shapely.get_num_coordinates(simplified)).tolist()
+    return [pts[i:j] for i, j in zip(offsets, offsets[1:])]
+
+
+def topology_paths(shapes: dict[str, list], projected: list) -> dict[str, str]:
+    """rid → SVG path из упрощённых спроецированных дуг."""
+    paths = {}
+    for rid, polygons in shapes.items():
+        parts = []
+        for polygon in polygons:
+            for n, refs in enumerate(polygon):
+                pts: list = []
+                for ref in refs:
+                    arc = projected[ref] if ref >= 0 else projected[~ref][::-1]
+                    pts.extend(arc[1:] if pts else arc)
+                if len(pts) < 4:
+                    # Кольцо выродилось в отрезок; без внешнего кольца нет и дырок
+                    if n == 0:
+                        break
+                    continue
+                parts.append(svg_ring(pts))
+        paths[rid] = " ".join(parts)
+    return paths
+
+
+# Топология разбирается один раз за запуск (--sweep переиспользует её)
+_topology: dict = {}
+
+
+def convert_topology(rids: list[str], tolerance: float) -> dict[str, dict]:
+    """Как convert_region для всех rids сразу, но общие границы соседей
+    упрощаются один раз (build_topology). Выполняется в главном процессе."""
+    key = tuple(rids)
+    if key not in _topology:
+        started = time.time()
+        geoms = {rid: load_region(rid) for rid in rids}
+        arcs, shapes = build_topology(geoms)
+        refs = [ref for polygons in shapes.values() for polygon in polygons for ring in polygon for ref in ring]
+        log.info(f"  Топология: {len(arcs)} дуг, повторно использовано — {len(refs) - len(arcs)}, "
+                 f"точек {sum(len(a) for a in arcs)} ({time.time() - started:.1f} с)")
+        _topology[key] = (geoms, arcs, shapes)
+    geoms, arcs, shapes = _topology[key]
+
+    paths = topology_paths(shapes, simplify_arcs(arcs, tolerance))
+    converted = {}
+    for rid in rids:
+        cx, cy = centroid_svg(geoms[rid])
+        converted[rid] = {"path": paths[rid], "cx": cx, "cy": cy}
+    return converted
+
+
+def _init_worker(bounds: dict):
+    """Инициализация процесса пула: охват Albers считается один раз в главном процессе."""
+    global _albers_bounds, _projection
+    _albers_bounds = bounds
+    _projection = None
+
+
+def convert_region(rid: str, tolerance: float) -> dict:
+    """Конвертирует один регион → {path, cx, cy} (выполняется и в пуле процессов)."""
+    return convert_region_levels(rid, [tolerance])[tolerance]
+
+
+def convert_region_levels(rid: str, tolerances: list[float]) -> dict[float, dict]:
+    """Один регион сразу на нескольких уровнях детализации → tolerance → {path, cx, cy}.
+    Геометрия разбирается один раз и общая для всех уровней и центроида;
+    проецируются только точки, оставшиеся после упрощения."""
+    geom = load_region(rid)
+    cx, cy = centroid_svg(geom)
+    return {tol: {"path": geometry_to_svg_path(geom, tol), "cx": cx, "cy": cy} for tol in tolerances}
+
+
+def _available_regions() -> list[str]:
+    rids = []
     for rid in sorted(REGIONS.keys()):
-        fpath = os.path.join(BOUNDARY_DIR, f"{rid}.geojson")
-        if not os.path.exists(fpath):
+        fpath = boundary_path(BOUNDARY_DIR, rid)
+        if os.path.exists(fpath):
+            rids.append(rid)
+        else:
             log.warning(f"  ⚠️  Нет файла {fpath}, пропускаем {rid}")
-            continue
-
-        with open(fpath, "r", encoding="utf-8") as f:
-            data = json.load(f)
+    return rids
+
+
+def convert_all(tolerance: float = SIMPLIFY_TOLERANCE, workers: int = 1,
+                pool: ProcessPoolExecutor | None = None, topology: bool = False) -> dict[str, dict]:
+    """Конвертирует все скачанные GeoJSON → dict region_id → {path, cx, cy}.
+
+    workers > 1 (или готовый pool) — регионы конвертируются параллельно
+    в процессах; охват Albers передаётся процессам при старте. Результат
+    не зависит от числа процессов: ключи в порядке id регионов.
+    topology — общие границы соседей упрощаются один раз (convert_topology,
+    в главном процессе; workers и pool не используются).
+    """
+    return convert_levels([tolerance], workers, pool, topology)[tolerance]
+
+
+def convert_levels(tolerances: list[float], workers: int = 1, pool: ProcessPoolExecutor | None = None,
+                   topology: bool = False, rids: list[str] | None = None,
+                   bounds: dict | None = None) -> dict[float, dict[str, dict]]:
+    """Как convert_all, но сразу для нескольких tolerance (уровней детализации):
+    tolerance → region_id → {path, cx, cy}. Каждый регион разбирается один раз.
+    rids — только эти регионы (по умолчанию все скачанные).
+    bounds — уже вычисленный охват Albers (_compute_albers_bounds); без него
+    охват считается здесь."""
+    global _albers_bounds, _projection
+    if bounds is not None:
+        if bounds is not _albers_bounds:
+            _albers_bounds, _projection = bounds, None
+    # Сначала вычисляем охват всех регионов для масштабирования Albers
+    elif _albers_bounds is None or pool is None:
+        log.info("  Вычисляю охват карты (Albers bounds)…")
+        _compute_albers_bounds()
 
-        # GeoJSON может быть Feature или FeatureCollection
-        if data.get("type") == "FeatureCollection":
-            geom = data["features"][0]["geometry"]
-        elif data.get("type") == "Feature":
-            geom = data["geometry"]
-        else:
-            geom = data
+    if rids is None:
+        rids = _available_regions()
+    converted: dict[str, dict[float, dict]] = {}
+
+    def done(rid, levels):
+        converted[rid] = levels
+        item = levels[tolerances[0]]
+        sizes = "/".join(f"{len(levels[tol]['path']):>6}" for tol in tolerances)
+        log.info(f"  ✅  {rid:30s}  path={sizes} chars   "
+                 f"center=({item['cx']:.1f}, {item['cy']:.1f})")
+
+    if topology:
+        by_level = {tol: convert_topology(rids, tol) for tol in tolerances}
+        for rid in rids:
+            done(rid, {tol: by_level[tol][rid] for tol in tolerances})
+    elif pool is None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(_albers_bounds,)) as own_pool:
+            return convert_levels(tolerances, pool=own_pool, rids=rids)
+    elif pool is None:
+        for rid in rids:
+            done(rid, convert_region_levels(rid, tolerances))
+    else:
+        # Крупные регионы (Якутия, Красноярский край) — первыми, чтобы не ждать их в конце
+        by_size = sorted(rids, key=lambda r: -os.path.getsize(boundary_path(BOUNDARY_DIR, r)))
+        futures = {pool.submit(convert_region_levels, rid, tolerances): rid for rid in by_size}
+        for future in as_completed(futures):
+            done(futures[future], future.result())
+
+    return {tol: {rid: converted[rid][tol] for rid in rids} for tol in tolerances}
+
+
+# ─── Инкрементальная конвертация (манифест) ─────────────────────────
+#
+# Манифест хранит для каждого региона SHA-1 исходного файла (из индекса
+# охватов) и готовые path/центроиды по каждой tolerance, а для всего
+# файла — охват Albers и режим топологии. Повторный запуск конвертирует
+# только регионы с изменившимся контуром; при смене охвата карты (он
+# общий для всех) или версии конвертера — все. С --topology path региона
+# зависит от соседей, поэтому любое изменение пересчитывает все регионы.
+
+PATHS_MANIFEST = os.path.join(BOUNDARY_DIR, ".paths_manifest.json")
+# Увеличить при изменении того, как строятся path (упрощение, проекция, формат)
+MANIFEST_VERSION = 1
+
+
+def _load_manifest() -> dict:
+    try:
+        with open(PATHS_MANIFEST, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-        svg_path = geojson_to_svg_path(geom, tolerance)
-        cx, cy = compute_centroid_svg(geom)
 
-        result[rid] = {
-            "path": svg_path,
-            "cx": cx,
-            "cy": cy,
-        }
+def _save_manifest(manifest: dict):
+    tmp = PATHS_MANIFEST + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp, PATHS_MANIFEST)
 
-        log.info(f"  ✅  {rid:30s}  path={len(svg_path):>6} chars   center=({cx:.1f}, {cy:.1f})")
 
-    return result
+def convert_incremental(tolerances: list[float], workers: int = 1, topology: bool = False,
+                        full: bool = False) -> dict[float, dict[str, dict]]:
+    """convert_levels с кэшем в манифесте: конвертируются только изменённые
+    регионы (или все, если full), остальные берутся из манифеста."""
+    log.info("  Вычисляю охват карты (Albers bounds)…")
+    _compute_albers_bounds()
+    rids = _available_regions()
+    index = _load_index()
+
+    manifest = _load_manifest()
+    header = {"version": MANIFEST_VERSION, "bounds": _albers_bounds, "topology": topology}
+    cached_regions = {}
+    if not full and all(manifest.get(k) == v for k, v in header.items()):
+        cached_regions = manifest.get("regions", {})
+
+    cached: dict[str, dict] = {}
+    for rid in rids:
+        entry = cached_regions.get(rid)
+        if entry and entry["sha1"] == index[rid]["sha1"] and all(str(tol) in entry["levels"] for tol in tolerances):
+            cached[rid] = entry
+    stale = [rid for rid in rids if rid not in cached]
+    if topology and stale:
+        stale = rids
+    log.info(f"  Манифест: из кэша {len(rids) - len(stale)}, конвертировать {len(stale)}")
+
+    if stale:
+        fresh = convert_levels(tolerances, workers, topology=topology, rids=stale, bounds=_albers_bounds)
+        for rid in stale:
+            cached[rid] = {
+                "sha1": index[rid]["sha1"],
+                "levels": {str(tol): fresh[tol][rid] for tol in tolerances},
+            }
+        _save_manifest({**header, "regions": {rid: cached[rid] for rid in rids}})
+
+    # Копии: encode_paths меняет path на месте
+    return {tol: {rid: dict(cached[rid]["levels"][str(tol)]) for rid in rids} for tol in tolerances}
+
+
+def tolerance_sweep(tolerances: list[float], workers: int, topology: bool = False):
+    """Размер path-строк при разных --tolerance (TS не пишется).
+    Пул процессов (или топология) и охват Albers общие для всех прогонов."""
+    _compute_albers_bounds()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(_albers_bounds,)) as pool:
+        rows = []
+        for tol in tolerances:
+            started = time.time()
+            level = log.level
+            log.setLevel(logging.WARNING)
+            try:
+                paths = convert_all(tol, pool=pool, topology=topology)
+            finally:
+                log.setLevel(level)
+            chars = sum(len(p["path"]) for p in paths.values())
+            points = sum(p["path"].count(",") for p in paths.values())
+            relative = sum(len(encode_path(p["path"], "relative")) for p in paths.values())
+            rows.append((tol, chars, relative, points, time.time() - started))
+
+    print(f"\n{'tolerance':>10} {'КБ path':>10} {'relative':>10} {'точек':>10} {'сек':>6}")
+    for tol, chars, relative, points, seconds in rows:
+        print(f"{tol:>10g} {chars / 1024:>10.0f} {relative / 1024:>10.0f} {points:>10} {seconds:>6.1f}")
 
 
 # ═════════════════════════════════════════════════════════════════════
 # 3. Генерация TypeScript‑файла
 # ═════════════════════════════════════════════════════════════════════
 
-def generate_ts(paths: dict[str, dict], tolerance: float = SIMPLIFY_TOLERANCE):
-    """Генерирует russiaRegionsPaths.ts."""
+# ─── Кодирование path (--encoding) ──────────────────────────────────
+#
+# absolute — как есть: «M x,y x,y … Z», точки с одним знаком после запятой.
+# relative — тот же контур компактнее: первая точка кольца абсолютная,
+# остальные — относительные смещения (lineto «l»), повторы точек после
+# округления проекции выброшены, лишние нули и разделители опущены.
+# Смещения считаются в целых десятых, поэтому ошибка не накапливается:
+# браузер восстанавливает ровно те же координаты.
+
+PATH_ENCODINGS = ("absolute", "relative")
+
+
+def _tenths(v: int) -> str:
+    """Целые десятые → кратчайшее число SVG: 30 → «3», 4 → «.4», -12 → «-1.2»."""
+    sign = "-" if v < 0 else ""
+    whole, frac = divmod(abs(v), 10)
+    if not frac:
+        return f"{sign}{whole}"
+    return f"{sign}{whole or ''}.{frac}"
+
+
+def _svg_numbers(values: list[int]) -> str:
+    """Числа подряд; разделитель не нужен перед «-» и перед «.», если в
+    предыдущем числе уже есть точка (грамматика path SVG)."""
+    out: list[str] = []
+    prev = ""
+    for v in values:
+        num = _tenths(v)
+        if out and not (num[0] == "-" or (num[0] == "." and "." in prev)):
+            out.append(",")
+        out.append(num)
+        prev = num
+    return "".join(out)
+
+
+def encode_path(d: str, encoding: str) -> str:
+    """Абсолютный path (svg_ring) → path в кодировке encoding."""
+    if encoding == "absolute":
+        return d
+    parts: list[str] = []
+    ring: list[tuple[int, int]] = []
+    for token in d.split():
+        if token == "M":
+            ring = []
+        elif token == "Z":
+            # Замыкающие точки, равные первой, рисует сама команда z
+            while len(ring) > 1 and ring[-1] == ring[0]:
+                ring.pop()
+            if len(ring) < 3:
+                continue
+            x0, y0 = ring[0]
+            deltas: list[int] = []
+            for (ax, ay), (bx, by) in zip(ring, ring[1:]):
+                deltas += [bx - ax, by - ay]
+            parts.append(f"M{_svg_numbers([x0, y0])}l{_svg_numbers(deltas)}z")
+        else:
+            x, y = token.split(",")
+            pt = (round(float(x) * 10), round(float(y) * 10))
+            if not ring or ring[-1] != pt:
+                ring.append(pt)
+    return "".join(parts)
+
+
+def encode_paths(paths: dict[str, dict], encoding: str, label: str = ""):
+    """Перекодирует path всех регионов на месте и пишет в лог экономию
+    относительно absolute (label — пометка в логе, например уровень LOD)."""
+    if encoding == "absolute":
+        return
+    before = sum(len(p["path"]) for p in paths.values())
+    for item in paths.values():
+        item["path"] = encode_path(item["path"], encoding)
+    after = sum(len(p["path"]) for p in paths.values())
+    log.info(f"  Кодирование {encoding}{label}: path {before / 1024:.0f} КБ → {after / 1024:.0f} КБ "
+             f"({(after - before) / max(before, 1) * 100:+.0f}%)")
+
+
+def generate_ts(paths: dict[str, dict], tolerance: float = SIMPLIFY_TOLERANCE, topology: bool = False,
+                encoding: str = "absolute"):
+    """Генерирует russiaRegionsPaths.ts (path уже в кодировке encoding)."""
     b = _albers_bounds
     lines: list[str] = []
     lines.append("/**")
@@ -463,6 +981,10 @@ def generate_ts(paths: dict[str, dict], tolerance: float = SIMPLIFY_TOLERANCE):
     lines.append(f" * Проекция: Albers Equal-Area Conic (φ1=52° φ2=64° λ0=100° φ0=56°)")
     lines.append(f" * Регионов: {len(paths)}")
     lines.append(f" * Упрощение: {tolerance}° (≈ {tolerance * 111:.0f} км)")
+    if topology:
+        lines.append(" * Топология: общие границы соседей упрощены один раз (--topology)")
+    if encoding != "absolute":
+        lines.append(f" * Кодирование path: {encoding} (--encoding)")
     lines.append(" *")
     lines.append(" * Перегенерация:  cd offline-tiles && python generate_svg_paths.py")
     lines.append(" */")
@@ -492,22 +1014,147 @@ def generate_ts(paths: dict[str, dict], tolerance: float = SIMPLIFY_TOLERANCE):
     for rid in sorted(paths.keys()):
         p = paths[rid]
         # Длинные path-строки оборачиваем
-        d_escaped = p["path"].replace("\\", "\\\\").replace("'", "\\'")
         lines.append(f"  '{rid}': {{")
-        lines.append(f"    d: '{d_escaped}',")
+        lines.append(f"    d: '{_ts_string(p['path'])}',")
         lines.append(f"    cx: {p['cx']}, cy: {p['cy']},")
         lines.append(f"  }},")
 
     lines.append("};")
     lines.append("")
+    _write_ts(OUTPUT_TS, lines, len(paths))
+
+
+def _ts_string(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("'", "\\'")
+
 
-    os.makedirs(os.path.dirname(OUTPUT_TS), exist_ok=True)
-    with open(OUTPUT_TS, "w", encoding="utf-8") as f:
-        f.write("\n".join(lines))
+def _write_ts(path: str, lines: list[str], regions: int):
+    """Пишет TS, только если содержимое изменилось: нетронутый файл
+    не сбрасывает кэш сборки фронтенда."""
+    content = "\n".join(lines)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            unchanged = f.read() == content
+    except OSError:
+        unchanged = False
+    if unchanged:
+        log.info(f"\n⏭️  Без изменений: {path}")
+        return
 
-    size_kb = os.path.getsize(OUTPUT_TS) / 1024
-    log.info(f"\n✅  Сгенерирован {OUTPUT_TS}")
-    log.info(f"   Размер: {size_kb:.0f} КБ,  регионов: {len(paths)}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+    size_kb = os.path.getsize(path) / 1024
+    log.info(f"\n✅  Сгенерирован {path}")
+    log.info(f"   Размер: {size_kb:.0f} КБ,  регионов: {regions}")
+
+
+# ─── Уровни детализации (--lod) ─────────────────────────────────────
+#
+# Основной russiaRegionsPaths.ts рисуется сразу; уровни детальнее его
+# (--lod с tolerance меньше --tolerance) — отдельные модули
+# russiaRegionsPaths.lod<N>.ts (только d-строки; центроиды и ALBERS_BOUNDS —
+# в основном файле), N = 0 — самый грубый из них. Индекс
+# russiaRegionsPaths.lods.ts (пишется всегда, без --lod — пустой; модули
+# уровней, которых в нём больше нет, удаляются) загружает
+# их через import(): сборщик выносит уровни в отдельные чанки, RussiaMapSvg
+# подгружает уровень, когда приближение делает его ошибку ≈ ошибке
+# основного файла на исходном масштабе (tolerance ≥ BASE_TOLERANCE / zoom).
+
+def lod_ts_path(level: int) -> str:
+    return os.path.splitext(OUTPUT_TS)[0] + f".lod{level}.ts"
+
+
+LOD_INDEX_TS = os.path.splitext(OUTPUT_TS)[0] + ".lods.ts"
+
+
+def lod_levels(tolerance: float, lods: list[float] | None) -> list[float]:
+    """Уровни --lod, которые стоит писать: детальнее основного файла,
+    от грубого к детальному. Остальные (грубее или равные) — с предупреждением."""
+    levels = sorted({tol for tol in lods or [] if tol < tolerance}, reverse=True)
+    skipped = sorted({tol for tol in lods or [] if tol >= tolerance})
+    if skipped:
+        log.warning(f"⚠️  --lod {' '.join(map(str, skipped))}: не детальнее основного файла "
+                    f"({tolerance}°) — пропущены")
+    return levels
+
+
+def generate_lod_ts(levels: dict[float, dict[str, dict]], tolerance: float, regions: int,
+                    encoding: str = "absolute", topology: bool = False):
+    """Пишет модули уровней детализации (от грубого к детальному) и их индекс;
+    tolerance — основного файла, regions — число регионов в нём."""
+    base = os.path.basename(os.path.splitext(OUTPUT_TS)[0])
+    order = sorted(levels, reverse=True)
+    for level, tol in enumerate(order):
+        paths = levels[tol]
+        lines = [
+            "/**",
+            f" * SVG-path контуры субъектов РФ — уровень детализации {level} из {len(order)} (0 — грубый).",
+            f" * Упрощение: {tol}° (≈ {tol * 111:.1f} км)",
+        ]
+        if topology:
+            lines.append(" * Топология: общие границы соседей упрощены один раз (--topology)")
+        if encoding != "absolute":
+            lines.append(f" * Кодирование path: {encoding} (--encoding)")
+        lines += [
+            f" * Загружается лениво через {base}.lods.ts; центроиды и проекция — в {base}.ts.",
+            " *",
+            " * Перегенерация:  cd offline-tiles && python generate_svg_paths.py --lod …",
+            " */",
+            "",
+            f"export const TOLERANCE = {tol};",
+            "",
+            "/** region id → SVG path d-attribute */",
+            "export const REGION_D: Record<string, string> = {",
+        ]
+        for rid in sorted(paths):
+            lines.append(f"  '{rid}': '{_ts_string(paths[rid]['path'])}',")
+        lines += ["};", ""]
+        _write_ts(lod_ts_path(level), lines, len(paths))
+
+    lines = [
+        "/**",
+        f" * Уровни детализации SVG-path контуров (к {base}.ts).",
+        " * Модули уровней загружаются лениво (import()) — в сборке это отдельные чанки.",
+        " * Без --lod список пуст: рисуется только основной файл.",
+        " *",
+        " * Перегенерация:  cd offline-tiles && python generate_svg_paths.py --lod …",
+        " */",
+        "",
+        f"/** Порог упрощения {base}.ts, градусы */",
+        f"export const BASE_TOLERANCE = {tolerance};",
+        "",
+        "export interface RegionPathLod {",
+        "  /** Порог упрощения, градусы */",
+        "  tolerance: number;",
+        "  /** region id → SVG path d-attribute */",
+        "  load: () => Promise<Record<string, string>>;",
+        "}",
+        "",
+        "/** Детальнее основного файла, от грубого к детальному */",
+    ]
+    if order:
+        lines.append("export const REGION_PATH_LODS: RegionPathLod[] = [")
+        for level, tol in enumerate(order):
+            lines.append(f"  {{ tolerance: {tol}, load: () => import('./{base}.lod{level}').then((m) => m.REGION_D) }},")
+        lines += ["];", ""]
+    else:
+        lines += ["export const REGION_PATH_LODS: RegionPathLod[] = [];", ""]
+    _write_ts(LOD_INDEX_TS, lines, regions)
+    remove_stale_lod_ts(len(order))
+
+
+def remove_stale_lod_ts(count: int):
+    """Удаляет модули уровней .lod<N>.ts с N ≥ count — от прошлых запусков
+    с большим числом --lod (индекс на них уже не ссылается)."""
+    directory = os.path.dirname(OUTPUT_TS)
+    prefix = os.path.basename(os.path.splitext(OUTPUT_TS)[0]) + ".lod"
+    for name in sorted(os.listdir(directory)):
+        level = name[len(prefix):-len(".ts")]
+        if name.startswith(prefix) and name.endswith(".ts") and level.isdigit() and int(level) >= count:
+            os.remove(os.path.join(directory, name))
+            log.info(f"  Удалён устаревший уровень детализации: {name}")
 
 
 # ═════════════════════════════════════════════════════════════════════
@@ -522,13 +1169,39 @@ def main():
                         help="Только конвертировать уже скачанные GeoJSON (не качать)")
     parser.add_argument("--id", nargs="*",
                         help="ID конкретного региона (можно несколько)")
+    parser.add_argument("--overpass-slots", type=int, default=SLOTS,
+                        help=f"Одновременных запросов на эндпоинт Overpass (по умолчанию {SLOTS})")
+    parser.add_argument("--overpass-endpoint", action="append", metavar="URL",
+                        help="Эндпоинт Overpass (можно несколько; по умолчанию — "
+                             f"{len(OVERPASS_ENDPOINTS)} публичных)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Скачивать группами relation в одном запросе Overpass "
+                             "(размер группы подстраивается под объём ответа)")
     parser.add_argument("--tolerance", type=float, default=SIMPLIFY_TOLERANCE,
                         help=f"Порог упрощения в градусах (default: {SIMPLIFY_TOLERANCE})")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Процессов для конвертации (по умолчанию 1 — без пула, 0 — число ядер)")
+    parser.add_argument("--sweep", type=float, nargs="+", metavar="TOL",
+                        help="Только сравнить размер path при нескольких tolerance (TS не пишется)")
+    parser.add_argument("--topology", action="store_true",
+                        help="Общие границы соседних регионов упрощать один раз — без щелей "
+                             "и наложений между соседями; размер path почти не меняется "
+                             "(нужны NumPy и Shapely 2)")
+    parser.add_argument("--encoding", choices=PATH_ENCODINGS, default="absolute",
+                        help="Запись path: absolute — «M x,y x,y … Z» (по умолчанию), "
+                             "relative — относительные смещения без повторов точек (меньше TS)")
+    parser.add_argument("--lod", type=float, nargs="+", metavar="TOL",
+                        help="Дополнительно уровни детальнее --tolerance (например 0.002 0.001): "
+                             "модули russiaRegionsPaths.lod<N>.ts, карта подгружает их при приближении")
+    parser.add_argument("--full", action="store_true",
+                        help="Конвертировать все регионы заново, не используя манифест "
+                             "(boundaries/.paths_manifest.json)")
     parser.add_argument("--list", action="store_true",
                         help="Показать список регионов")
     args = parser.parse_args()
 
     tolerance = args.tolerance
+    workers = args.workers or os.cpu_count() or 1
 
     if args.list:
         print(f"\n{'ID':<30} {'Название':<40} {'OSM ID'}")
@@ -538,15 +1211,27 @@ def main():
         print(f"\nВсего: {len(REGIONS)} регионов")
         return
 
+    if args.topology and not VECTORIZED:
+        log.error("Для --topology установите NumPy и Shapely 2: pip install numpy \"shapely>=2\"")
+        sys.exit(1)
+
+    if args.sweep:
+        tolerance_sweep(args.sweep, workers, args.topology)
+        return
+
     # Шаг 1: скачиваем (если нужно)
     if not args.only_convert:
         log.info("═══ Шаг 1: Скачивание контуров из OSM Overpass ═══")
-        log.info("⚠️  Это может занять ~30-60 мин из-за лимитов API")
-        download_all(args.id)
+        client = OverpassClient(args.overpass_endpoint, slots=args.overpass_slots)
+        download_all(args.id, client, args.batch)
 
     # Шаг 2: конвертируем
     log.info("\n═══ Шаг 2: Конвертация GeoJSON → SVG paths ═══")
-    paths = convert_all(tolerance)
+    lods = lod_levels(tolerance, args.lod)
+    # Основной файл и все уровни LOD — за один разбор каждого региона
+    tolerances = [tolerance] + lods
+    levels = convert_incremental(tolerances, workers, args.topology, full=args.full)
+    paths = levels[tolerance]
 
     if not paths:
         log.error("❌  Нет данных для конвертации. Сначала скачайте границы.")
@@ -554,7 +1239,11 @@ def main():
 
     # Шаг 3: генерируем TS
     log.info("\n═══ Шаг 3: Генерация TypeScript ═══")
-    generate_ts(paths, tolerance)
+    for tol, level_paths in levels.items():
+        encode_paths(level_paths, args.encoding, f" ({tol}°)" if len(levels) > 1 else "")
+    generate_ts(paths, tolerance, args.topology, args.encoding)
+    # Индекс уровней — всегда: его импортирует RussiaMapSvg
+    generate_lod_ts({tol: levels[tol] for tol in lods}, tolerance, len(paths), args.encoding, args.topology)
 
     log.info("\n🎉  Готово!")
 
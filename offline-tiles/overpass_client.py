@@ -0,0 +1,549 @@
+"""
+Клиент Overpass API для скриптов offline-tiles: несколько запросов
+одновременно по всем эндпоинтам вместо фиксированных пауз.
+
+У каждого эндпоинта — свои слоты (одновременных запросов с одного IP)
+и token bucket: запрос забирает токен, токены восстанавливаются с
+заданной скоростью. Запрос уходит на эндпоинт, где есть и свободный
+слот, и токен; если таких нет — ждёт ближайшего. Пауза (backoff со
+случайным разбросом) — только после 429 / 504: эндпоинт «остывает»,
+остальные продолжают работать. Время ожидания по возможности берётся
+из /api/status сервера («Slot available after … in N seconds»).
+
+Пакетный режим (fetch_relations): несколько relation одним запросом
+`relation(id:…);out geom;`, ответ делится по id. Размер группы подстраивается
+под объём ответа (BATCH_BYTES на запрос); группа, не успевшая за таймаут
+(runtime error, 504, HTTP-таймаут клиента), без повторов делится пополам —
+крупные регионы (Якутия) уходят по одному и только тогда повторяются.
+
+Контуры (fetch_relation / fetch_relations) запрашиваются в [out:json]:
+ответ потоком пишется во временный файл и разбирается по одному member way —
+way сразу становится LineString, полигон relation собирается по мере разбора
+(RelationBuilder). В памяти — точки одного way, а не весь ответ в dict.
+Remark «runtime error» (сервер оборвал ответ по таймауту) повторяется с паузой
+эндпоинта, как 429 / 504; пакет вместо повтора делится пополам.
+
+Использование:
+    client = OverpassClient()
+    data = client.query("[out:json];relation(72197);out geom;")
+
+    # Параллельно: потоков — client.concurrency, лимиты соблюдает client
+    with ThreadPoolExecutor(client.concurrency) as pool:
+        ...
+
+    # Пакетами
+    for osm_id, relation in fetch_relations(client, [72197, 72223, …]):
+        ...   # relation = {"id", "tags", "ways", "geometry": полигон | None} | None
+"""
+
+import io
+import re
+import sys
+import json
+import time
+import random
+import logging
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    import requests
+    from urllib3.exceptions import ReadTimeoutError
+except ImportError:
+    print("❌  pip install requests")
+    sys.exit(1)
+
+try:
+    from shapely.geometry import LineString, Polygon
+    from shapely.ops import polygonize, unary_union
+except ImportError:
+    print("❌  pip install shapely")
+    sys.exit(1)
+
+log = logging.getLogger(__name__)
+
+OVERPASS_ENDPOINTS = [
+    "https://overpass-api.de/api/interpreter",
+    "https://lz4.overpass-api.de/api/interpreter",
+    "https://z.overpass-api.de/api/interpreter",
+]
+
+SLOTS = 2             # одновременных запросов на эндпоинт (лимит overpass-api.de на IP)
+RATE = 0.5            # токенов в секунду на эндпоинт (новый запрос не чаще раза в 2 с)
+MAX_RETRIES = 5       # попыток на запрос (по всем эндпоинтам)
+BACKOFF = 15          # базовая пауза эндпоинта после 429 / 504, сек
+BACKOFF_MAX = 300     # потолок паузы, сек
+
+THROTTLED = (429, 504)
+STREAM_CHUNK = 1024**2        # блок записи ответа во временный файл, байт
+
+# Пакетный режим (fetch_relations)
+BATCH_GROUP = 8               # relation в первом запросе (пока объём ответа неизвестен)
+BATCH_MAX = 40                # потолок группы
+BATCH_BYTES = 24 * 1024**2    # целевой объём ответа на запрос
+BATCH_TIMEOUT = 300           # [timeout:…] пакетного запроса, сек
+
+# HTTP-таймаут запроса, сек: дольше серверного [timeout:…], иначе клиент
+# бросает запрос, который сервер ещё успел бы выполнить
+TIMEOUT = BATCH_TIMEOUT + 30
+
+
+class OverpassError(Exception):
+    """Запрос не выполнен ни на одном эндпоинте за MAX_RETRIES попыток."""
+
+
+class OverpassTimeout(OverpassError):
+    """Сервер не успел: HTTP 504 или истёк HTTP-таймаут клиента."""
+
+
+class OverpassRemark(OverpassTimeout):
+    """Сервер прервал запрос (remark «runtime error»: таймаут, память)."""
+
+
+class Endpoint:
+    """Эндпоинт: слоты, token bucket и пауза после 429 / 504.
+    Состояние меняется только под общим lock клиента."""
+
+    def __init__(self, url: str, slots: int, rate: float):
+        self.url = url
+        self.host = url.split("//")[-1].split("/")[0]
+        self.slots = slots
+        self.rate = rate
+        self.tokens = float(slots)
+        self.stamp = time.monotonic()
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.requests = 0
+        self.throttled = 0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.slots, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def ready_in(self, now: float) -> float:
+        """Через сколько секунд эндпоинт примет запрос (0 — сейчас);
+        inf — все слоты заняты, ждём освобождения."""
+        if self.in_flight >= self.slots:
+            return float("inf")
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+        self.in_flight += 1
+        self.requests += 1
+
+
+def _is_timeout(e: Exception) -> bool:
+    """Истёк HTTP-таймаут: до заголовков (Timeout) или при чтении тела
+    (requests оборачивает ReadTimeoutError в ConnectionError)."""
+    if isinstance(e, requests.Timeout):
+        return True
+    return isinstance(e, requests.ConnectionError) and any(
+        isinstance(arg, ReadTimeoutError) for arg in e.args)
+
+
+def _slot_wait(status_text: str) -> float | None:
+    """Секунды до свободного слота из ответа /api/status (None — не понять)."""
+    if re.search(r"^\s*[1-9]\d* slots? available now", status_text, re.M):
+        return 0.0
+    waits = [int(s) for s in re.findall(r"Slot available after: .*?in (\d+) seconds", status_text)]
+    return min(waits) if waits else None
+
+
+class OverpassClient:
+    """Планировщик запросов к Overpass по нескольким эндпоинтам (потокобезопасный)."""
+
+    def __init__(self, endpoints: list[str] | None = None, slots: int = SLOTS, rate: float = RATE,
+                 max_retries: int = MAX_RETRIES, timeout: float = TIMEOUT):
+        self.endpoints = [Endpoint(url, slots, rate) for url in endpoints or OVERPASS_ENDPOINTS]
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self._cond = threading.Condition()
+
+    @property
+    def concurrency(self) -> int:
+        """Сколько запросов имеет смысл держать в работе одновременно."""
+        return sum(ep.slots for ep in self.endpoints)
+
+    # ─── Слоты ─────────────────────────────────────────────────────────
+
+    def _acquire(self, avoid: Endpoint | None = None) -> Endpoint:
+        """Ждёт эндпоинт со свободным слотом и токеном. avoid — эндпоинт,
+        на котором запрос только что не прошёл: берётся, только если он
+        готов раньше остальных."""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                waits = [(ep.ready_in(now), ep is avoid, ep.in_flight, i)
+                         for i, ep in enumerate(self.endpoints)]
+                wait, _, _, i = min(waits)
+                if wait <= 0:
+                    ep = self.endpoints[i]
+                    ep.take(now)
+                    return ep
+                # inf — все слоты заняты: проснёмся по _release
+                self._cond.wait(None if wait == float("inf") else wait)
+
+    def _release(self, ep: Endpoint, throttled: bool = False, delay: float = 0.0):
+        with self._cond:
+            ep.in_flight -= 1
+            if throttled:
+                ep.failures += 1
+                ep.throttled += 1
+                ep.blocked_until = max(ep.blocked_until, time.monotonic() + delay)
+            else:
+                ep.failures = 0
+            self._cond.notify_all()
+
+    def _backoff(self, ep: Endpoint) -> float:
+        """Пауза эндпоинта после 429 / 504 / runtime error: подсказка /api/status или
+        экспоненциальный backoff со случайным разбросом (±50%)."""
+        try:
+            resp = requests.get(ep.url.replace("/interpreter", "/status"), timeout=10)
+            hint = _slot_wait(resp.text) if resp.ok else None
+        except requests.RequestException:
+            hint = None
+        if hint is not None:
+            return hint + random.uniform(0.5, 2.0)
+        delay = min(BACKOFF_MAX, BACKOFF * 2 ** ep.failures)
+        return delay * random.uniform(0.5, 1.5)
+
+    # ─── Запрос ────────────────────────────────────────────────────────
+
+    def query(self, query: str, parse=None, retry_timeouts: bool = True):
+        """Выполняет запрос Overpass QL. parse(resp) превращает ответ в результат
+        (по умолчанию resp.json()) и выполняется, пока слот занят. Отказ сервера
+        в теле ответа (OverpassRemark из parse) повторяется, как 429 / 504, —
+        с паузой эндпоинта. retry_timeouts=False — remark, 504 и таймаут клиента
+        сразу наверх как OverpassTimeout (пакет выгоднее поделить, чем повторять
+        целиком). Повторы — на любом готовом эндпоинте; OverpassError после
+        max_retries."""
+        parse = parse or (lambda resp: resp.json())
+        last_error = None
+        ep = None
+        for attempt in range(1, self.max_retries + 1):
+            ep = self._acquire(avoid=ep)
+            try:
+                resp = requests.post(ep.url, data={"data": query}, timeout=self.timeout, stream=True)
+                with resp:
+                    if resp.status_code in THROTTLED:
+                        delay = self._backoff(ep)
+                        if resp.status_code == 504 and not retry_timeouts:
+                            self._release(ep, throttled=True, delay=delay)
+                            raise OverpassTimeout(f"{ep.host}: HTTP 504")
+                        log.warning(f"  ⚠️  {ep.host}: HTTP {resp.status_code}, эндпоинт на паузе "
+                                    f"{delay:.0f} сек (попытка {attempt}/{self.max_retries})")
+                        self._release(ep, throttled=True, delay=delay)
+                        last_error = f"HTTP {resp.status_code}"
+                        continue
+                    resp.raise_for_status()
+                    result = parse(resp)
+            except OverpassRemark as e:
+                # Таймаут / память на сервере: HTTP 200, но ответ оборван
+                if not retry_timeouts:
+                    self._release(ep)
+                    raise
+                delay = self._backoff(ep)
+                log.warning(f"  ⚠️  {ep.host}: {e}, эндпоинт на паузе "
+                            f"{delay:.0f} сек (попытка {attempt}/{self.max_retries})")
+                self._release(ep, throttled=True, delay=delay)
+                last_error = e
+                continue
+            except OverpassTimeout:
+                # 504 без повтора — эндпоинт уже освобождён выше
+                raise
+            except requests.HTTPError as e:
+                # 4xx кроме 429 — ошибка в запросе, повтор не поможет
+                self._release(ep)
+                if e.response is not None and e.response.status_code < 500:
+                    raise OverpassError(f"{ep.host}: {e}") from e
+                log.warning(f"  ⚠️  {ep.host}: {e} (попытка {attempt}/{self.max_retries})")
+                last_error = e
+                continue
+            except Exception as e:
+                # Обрыв, таймаут, битый ответ — сразу на другой эндпоинт, без паузы
+                self._release(ep)
+                if not retry_timeouts and _is_timeout(e):
+                    raise OverpassTimeout(f"{ep.host}: {e}") from e
+                log.warning(f"  ⚠️  {ep.host}: {e} (попытка {attempt}/{self.max_retries})")
+                last_error = e
+                continue
+            self._release(ep)
+            return result
+        raise OverpassError(f"все {self.max_retries} попыток неудачны: {last_error}")
+
+    def report(self) -> str:
+        """Сводка по эндпоинтам: запросов и отказов (429 / 504 / runtime error)."""
+        return ", ".join(f"{ep.host}: {ep.requests} запр., отказов: {ep.throttled}" for ep in self.endpoints)
+
+
+# ─── Пакетный режим ───────────────────────────────────────────────────
+
+def relations_query(osm_ids: list[int], timeout: int = BATCH_TIMEOUT) -> str:
+    """Запрос Overpass QL: контуры нескольких relation одним ответом."""
+    return f"[out:json][timeout:{timeout}];relation(id:{','.join(map(str, osm_ids))});out geom;"
+
+
+class RelationBuilder:
+    """Полигон relation, собираемый по мере разбора: каждый outer way сразу
+    становится LineString (координаты — в GEOS, 16 байт на точку), dict точек
+    выбрасываются. finish() — polygonize + unary_union, как раньше в скриптах."""
+
+    def __init__(self):
+        self.lines = []
+
+    def add_way(self, geometry: list):
+        coords = [(p["lon"], p["lat"]) for p in geometry if p]
+        if len(coords) >= 2:
+            self.lines.append(LineString(coords))
+
+    def finish(self, osm_id: int):
+        """Собранная геометрия или None (нет outer ways / не собралась)."""
+        if not self.lines:
+            return None
+        try:
+            polys = list(polygonize(self.lines))
+            if not polys:
+                # Fallback: каждое кольцо — отдельный полигон (Polygon замыкает кольцо сам)
+                for line in self.lines:
+                    if len(line.coords) >= 4:
+                        try:
+                            p = Polygon(line.coords)
+                            polys.append(p if p.is_valid else p.buffer(0))
+                        except Exception:
+                            pass
+            merged = unary_union(polys) if polys else None
+        except Exception as e:
+            log.error(f"  ❌ relation/{osm_id}: ошибка сборки полигона: {e}")
+            return None
+        finally:
+            self.lines = []
+        return None if merged is None or merged.is_empty else merged
+
+
+_SPACE = re.compile(r"\s*")
+
+
+class _JsonStream:
+    """Потоковое чтение JSON из текстового файла: значения забираются по
+    одному (JSONDecoder.raw_decode), в буфере — не больше одного значения
+    (member way с его точками) плюс блок чтения."""
+
+    def __init__(self, f, chunk: int | None = None):
+        self.f = f
+        self.chunk = chunk or STREAM_CHUNK
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        # Прочитанное выбрасываем; читаем не меньше текущего хвоста —
+        # длинное значение разбирается за O(размер), а не O(размер² / блок)
+        self.buf = self.buf[self.pos:]
+        self.pos = 0
+        data = self.f.read(max(self.chunk, len(self.buf)))
+        if not data:
+            self.eof = True
+            return False
+        self.buf += data
+        return True
+
+    def peek(self) -> str:
+        """Следующий значащий символ (не забирая его)."""
+        while True:
+            self.pos = _SPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("ответ Overpass оборван")
+
+    def take(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"ответ Overpass: ожидался «{char}», позиция {self.pos}")
+        self.pos += 1
+
+    def skip(self, char: str) -> bool:
+        """Забирает char, если он следующий."""
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof or not self._fill():
+                    raise
+                continue
+            # Число на границе блока могло прочитаться не целиком
+            if end == len(self.buf) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def items(self, open_char: str, close_char: str):
+        """Элементы массива / объекта: выдаёт управление перед каждым,
+        вызывающий забирает элемент сам."""
+        self.take(open_char)
+        if self.skip(close_char):
+            return
+        while True:
+            yield
+            if not self.skip(","):
+                self.take(close_char)
+                return
+
+    def keys(self):
+        """Ключи объекта; значение ключа забирает вызывающий."""
+        for _ in self.items("{", "}"):
+            key = self.value()
+            self.take(":")
+            yield key
+
+
+def _parse_element(stream: _JsonStream, builder: RelationBuilder) -> dict | None:
+    """Один элемент из "elements": members разбираются по одному —
+    outer way сразу уходит в builder. None — не relation."""
+    element = {"ways": 0}
+    for key in stream.keys():
+        if key == "members":
+            for _ in stream.items("[", "]"):
+                member = stream.value()
+                if member.get("type") == "way" and member.get("role") == "outer":
+                    builder.add_way(member.get("geometry") or [])
+                    element["ways"] += 1
+        else:
+            element[key] = stream.value()
+    if element.get("type") != "relation" or "id" not in element:
+        builder.lines.clear()
+        return None
+    osm_id = element["id"]
+    return {"id": osm_id, "tags": element.get("tags", {}), "ways": element["ways"],
+            "geometry": builder.finish(osm_id)}
+
+
+def parse_relations(source) -> dict:
+    """Разбирает JSON-ответ `out geom` (текстовый файл) по одному member way:
+    {osm_id: {"id", "tags", "ways": число outer ways, "geometry": полигон | None}}.
+    В памяти — точки одного way и уже собранные LineString / полигоны.
+    OverpassRemark — сервер оборвал ответ (remark «runtime error»)."""
+    stream = _JsonStream(source)
+    builder = RelationBuilder()
+    relations = {}
+    for key in stream.keys():
+        if key == "elements":
+            for _ in stream.items("[", "]"):
+                relation = _parse_element(stream, builder)
+                if relation is not None:
+                    relations[relation["id"]] = relation
+            continue
+        value = stream.value()
+        # Таймаут/нехватка памяти на сервере — HTTP 200 с обрезанным ответом
+        if key == "remark" and "runtime error" in str(value):
+            raise OverpassRemark(str(value).strip())
+    return relations
+
+
+def read_relations(resp) -> tuple[int, dict]:
+    """parse для client.query: ответ потоком во временный файл, затем
+    parse_relations. Возвращает (байт ответа, {osm_id: relation})."""
+    size = 0
+    with tempfile.TemporaryFile(prefix="overpass-", suffix=".json") as tmp:
+        for chunk in resp.iter_content(STREAM_CHUNK):
+            tmp.write(chunk)
+            size += len(chunk)
+        tmp.seek(0)
+        return size, parse_relations(io.TextIOWrapper(tmp, encoding="utf-8"))
+
+
+def fetch_relation(client: OverpassClient, osm_id: int, timeout: int = BATCH_TIMEOUT) -> dict | None:
+    """Один relation (out geom) — см. parse_relations; None — нет в ответе."""
+    _, relations = client.query(relations_query([osm_id], timeout), parse=read_relations)
+    return relations.get(osm_id)
+
+
+def _fetch_group(client: OverpassClient, osm_ids: list[int]) -> tuple[int, dict]:
+    """Один пакетный запрос → (байт ответа, {osm_id: relation}).
+    Таймаут группы (runtime error, 504, HTTP-таймаут) не повторяется —
+    fetch_relations делит её пополам; одиночный relation повторяется
+    с паузой, как в fetch_relation."""
+    return client.query(relations_query(osm_ids), parse=read_relations,
+                        retry_timeouts=len(osm_ids) == 1)
+
+
+class _GroupSize:
+    """Размер следующей группы: BATCH_BYTES / средний объём relation,
+    не больше limit. limit растёт вдвое после успеха, но не выше ceiling —
+    половины самой маленькой группы, упавшей по таймауту (таймаут стоит
+    сотни секунд, повторять его не стоит)."""
+
+    def __init__(self, group: int, max_bytes: int):
+        self.limit = group
+        self.ceiling = BATCH_MAX
+        self.max_bytes = max_bytes
+        self.per_relation = None   # байт на relation, скользящее среднее
+
+    def next(self) -> int:
+        if self.per_relation is None:
+            return self.limit
+        return max(1, min(self.limit, int(self.max_bytes // self.per_relation)))
+
+    def done(self, n: int, size: int):
+        avg = size / n
+        self.per_relation = avg if self.per_relation is None else (self.per_relation + avg) / 2
+        self.limit = min(self.ceiling, self.limit * 2)
+
+    def failed(self, n: int):
+        self.ceiling = max(1, min(self.ceiling, n // 2))
+        self.limit = min(self.limit, self.ceiling)
+
+
+def fetch_relations(client: OverpassClient, osm_ids: list[int], group: int = BATCH_GROUP,
+                    max_bytes: int = BATCH_BYTES):
+    """Скачивает relation группами (до client.concurrency запросов сразу).
+    Выдаёт (osm_id, relation) по мере готовности; relation = None — не скачан.
+    Группа, не выполненная сервером, делится пополам и повторяется."""
+    pending = deque(dict.fromkeys(osm_ids))
+    retry = deque()                 # половинки упавших групп — вне очереди
+    sizer = _GroupSize(group, max_bytes)
+    running = {}
+    with ThreadPoolExecutor(max_workers=client.concurrency) as pool:
+        while pending or retry or running:
+            while (pending or retry) and len(running) < client.concurrency:
+                if retry:
+                    ids = retry.popleft()
+                else:
+                    ids = [pending.popleft() for _ in range(min(sizer.next(), len(pending)))]
+                running[pool.submit(_fetch_group, client, ids)] = ids
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                ids = running.pop(future)
+                try:
+                    size, found = future.result()
+                except OverpassError as e:
+                    sizer.failed(len(ids))
+                    if len(ids) > 1:
+                        half = len(ids) // 2
+                        log.warning(f"  ⚠️  Группа из {len(ids)} relation не выполнена ({e}) — "
+                                    f"делю на {half} + {len(ids) - half}")
+                        retry.extend([ids[:half], ids[half:]])
+                        continue
+                    log.error(f"  ❌ relation/{ids[0]}: {e}")
+                    yield ids[0], None
+                    continue
+                sizer.done(len(ids), size)
+                log.info(f"  Overpass: {len(ids)} relation одним запросом, "
+                         f"{size / 1024**2:.1f} МБ")
+                for osm_id in ids:
+                    yield osm_id, found.get(osm_id)
@@ -0,0 +1,6 @@
+"""Тесты offline-tiles: скрипты лежат уровнем выше и импортируются как модули."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
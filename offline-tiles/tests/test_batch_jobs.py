@@ -0,0 +1,68 @@
+"""--batch: общие тайлы пакетов запрашиваются один раз."""
+
+import pytest
+
+import generate_region_tiles as tiles
+
+# Пакеты: регион (z4–5), соседний регион (z5–6) и столица (z5)
+TARGETS = [
+    {"min_zoom": 4, "max_zoom": 5},
+    {"min_zoom": 5, "max_zoom": 6},
+    {"min_zoom": 5, "max_zoom": 5},
+]
+TILES = {
+    (0, 4): [(4, 9, 5)],
+    (0, 5): [(5, 18, 10), (5, 18, 11), (5, 19, 10)],
+    (1, 5): [(5, 18, 11), (5, 19, 10), (5, 20, 10)],
+    (2, 5): [(5, 18, 11)],
+    (1, 6): [(6, 40, 20)],
+}
+
+
+def _tiles_for(target, z):
+    return iter(TILES.get((TARGETS.index(target), z), []))
+
+
+def test_shared_tiles_yielded_once_with_owners():
+    owners, pending = {}, {}
+    jobs = list(tiles.iter_jobs(TARGETS, owners, pending, tiles_for=_tiles_for))
+    assert jobs == [(4, 9, 5), (5, 18, 10), (5, 18, 11), (5, 19, 10), (5, 20, 10), (6, 40, 20)]
+    # Тайлы только пакета 0 в owners не попадают (consume пишет их по умолчанию в 0)
+    assert owners == {
+        (5, 18, 11): [0, 1, 2],
+        (5, 19, 10): [0, 1],
+        (5, 20, 10): [1],
+        (6, 40, 20): [1],
+    }
+    assert pending == {4: 1, 5: 4, 6: 1}
+
+
+def test_lazy_merge_and_target_completion():
+    owners, pending = {}, {}
+    jobs = tiles.iter_jobs(TARGETS, owners, pending, tiles_for=_tiles_for)
+    assert next(jobs) == (4, 9, 5)
+    # Зум 5 ещё не начат — в owners ничего лишнего
+    assert owners == {}
+    for _ in range(4):
+        next(jobs)
+    pending[4] = 0
+    pending[5] = 0
+    # Генератор ещё не ушёл дальше z5 — пакеты z4–5 не закрываем
+    assert not tiles.target_complete(TARGETS[0], pending)
+    next(jobs)
+    assert tiles.target_complete(TARGETS[0], pending)
+    assert tiles.target_complete(TARGETS[2], pending)
+    assert not tiles.target_complete(TARGETS[1], pending)
+
+
+def test_single_target_has_no_owners():
+    owners, pending = {}, {}
+    jobs = list(tiles.iter_jobs(TARGETS[:1], owners, pending, tiles_for=_tiles_for))
+    assert len(jobs) == 4 and owners == {} and pending == {4: 1, 5: 3}
+
+
+def test_unordered_stream_rejected():
+    counts = [0]
+    merged = tiles._merge_zoom_tiles([(0, iter([(5, 2, 1), (5, 1, 1)]))], counts)
+    with pytest.raises(ValueError):
+        list(merged)
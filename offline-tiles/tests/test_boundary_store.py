@@ -0,0 +1,75 @@
+"""Компактный формат контуров .geobin: запись и чтение без потерь."""
+
+import json
+import os
+
+import pytest
+from shapely.geometry import MultiPolygon, Polygon, mapping, shape
+
+import boundary_store
+
+SHELL = [(39.1234567, 55.6), (41.4, 55.6000001), (41.4, 56.9), (39.1234567, 56.9), (39.1234567, 55.6)]
+HOLE = [(40.0, 56.0), (40.5, 56.0), (40.5, 56.5), (40.0, 56.0)]
+ISLAND = [(20.0, 54.5), (22.9, 54.3), (22.0, 55.3), (20.0, 54.5)]
+
+GEOMETRIES = {
+    "polygon": Polygon(SHELL, [HOLE]),
+    "multipolygon": MultiPolygon([Polygon(SHELL, [HOLE]), Polygon(ISLAND)]),
+}
+
+
+@pytest.fixture(params=[False, True], ids=["scalar", "vectorized"])
+def vectorized(request, monkeypatch):
+    if request.param and not boundary_store.VECTORIZED:
+        pytest.skip("NumPy / Shapely 2 недоступны")
+    monkeypatch.setattr(boundary_store, "VECTORIZED", request.param)
+    return request.param
+
+
+@pytest.mark.parametrize("name", GEOMETRIES)
+def test_quantized_round_trip(tmp_path, vectorized, name):
+    geom = GEOMETRIES[name]
+    path = str(tmp_path / "region.geobin")
+    info = boundary_store.write_geobin(path, mapping(geom), {"name": "Регион"})
+    # Координаты OSM — с шагом 1e-7°, квантование без потерь
+    assert info["quantized"]
+    parts = geom.geoms if isinstance(geom, MultiPolygon) else [geom]
+    assert info["points"] == sum(len(ring.coords) for p in parts for ring in [p.exterior, *p.interiors])
+
+    restored, props = boundary_store.read_geobin(path)
+    assert props == {"name": "Регион"}
+    assert boundary_store._same_geometry(restored, shape(mapping(geom)))
+
+
+def test_unquantizable_coordinates_stored_as_float(tmp_path, vectorized):
+    geom = Polygon([(39.123456789, 55.6), (41.4, 55.6), (41.4, 56.9), (39.123456789, 55.6)])
+    path = str(tmp_path / "region.geobin")
+    assert not boundary_store.write_geobin(path, mapping(geom))["quantized"]
+    restored, props = boundary_store.read_geobin(path)
+    assert props == {}
+    assert boundary_store._same_geometry(restored, geom)
+
+
+def test_rejects_other_geometry_types(tmp_path):
+    with pytest.raises(ValueError):
+        boundary_store.write_geobin(str(tmp_path / "x.geobin"), {"type": "Point", "coordinates": [1, 2]})
+
+
+def test_convert_file_and_boundary_path(tmp_path):
+    src = tmp_path / "region.geojson"
+    geom = GEOMETRIES["multipolygon"]
+    src.write_text(json.dumps({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"name": "Регион"}, "geometry": mapping(geom)}]}))
+    # .geobin ещё нет — читаем GeoJSON
+    assert boundary_store.boundary_path(str(tmp_path), "region") == str(src)
+
+    info = boundary_store.convert_file(str(src))
+    assert info["path"] == str(tmp_path / "region.geobin")
+    assert boundary_store.boundary_path(str(tmp_path), "region") == info["path"]
+    assert boundary_store._same_geometry(boundary_store.load_boundary(info["path"]),
+                                         boundary_store.load_boundary(str(src)))
+
+    # GeoJSON новее .geobin — копия устарела
+    stamp = os.path.getmtime(info["path"])
+    os.utime(src, (stamp + 10, stamp + 10))
+    assert boundary_store.boundary_path(str(tmp_path), "region") == str(src)
@@ -0,0 +1,69 @@
+"""AIMD-регулятор параллельности загрузки (--adaptive)."""
+
+import time
+
+import pytest
+
+import generate_region_tiles as tiles
+
+OK = ("OK", 10, 1, 1, b"png")
+ERR = ("ERR", 10, 1, 1, "HTTP 500")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_additive_increase_up_to_max(clock):
+    ctl = tiles.ConcurrencyController(4, 2, 6)
+    # +1/лимит за тайл: ≈ +1 за «лимит» успешных тайлов
+    for _ in range(4):
+        ctl.record(OK, 0.05)
+    assert ctl.limit == 4 and ctl._limit > 4.9
+    ctl.record(OK, 0.05)
+    assert ctl.limit == 5
+    for _ in range(100):
+        ctl.record(OK, 0.05)
+    assert ctl.limit == 6 and ctl.peak == 6 and ctl.decreases == 0
+
+
+def test_error_decreases_once_per_period(clock):
+    ctl = tiles.ConcurrencyController(16, 2, 32)
+    ctl.record(ERR, 0.1)
+    assert (ctl.limit, ctl.decreases, ctl.errors) == (12, 1, 1)
+    # Второй отказ в пределах периода (≥ 0.5 сек) лимит не трогает
+    ctl.record(ERR, 0.1)
+    assert ctl.limit == 12
+    clock[0] += 1.0
+    ctl.record(ERR, 0.1)
+    assert (ctl.limit, ctl.decreases) == (9, 2)
+
+
+def test_throttled_and_latency_spike_are_congestion(clock):
+    ctl = tiles.ConcurrencyController(16, 2, 32)
+    ctl.record(OK, 0.05, throttled=True)
+    assert (ctl.limit, ctl.throttled) == (12, 1)
+
+    ctl = tiles.ConcurrencyController(16, 2, 32)
+    for _ in range(20):
+        ctl.record(OK, 0.05)
+    before = ctl._limit
+    clock[0] += 10
+    for _ in range(30):                 # задержка ×10: сглаженная перевалит за 2 × базовую
+        ctl.record(OK, 0.5)
+        clock[0] += 0.01
+    assert ctl.decreases == 1 and ctl._limit < before
+
+
+def test_limit_never_below_min(clock):
+    ctl = tiles.ConcurrencyController(3, 2, 8)
+    for _ in range(5):
+        ctl.record(ERR, 0.1)
+        clock[0] += 1.0
+    assert ctl.limit == 2
+    # initial вне диапазона приводится к [min_limit, max_limit]
+    assert tiles.ConcurrencyController(100, 2, 8).limit == 8
+    assert tiles.ConcurrencyController(0, 0, 8).limit == 1
@@ -0,0 +1,44 @@
+"""Уровни детализации --lod: какие уровни пишутся и что остаётся на диске."""
+
+import os
+
+import pytest
+
+import generate_svg_paths as svg
+
+
+@pytest.fixture
+def output(tmp_path, monkeypatch):
+    ts = tmp_path / "russiaRegionsPaths.ts"
+    monkeypatch.setattr(svg, "OUTPUT_TS", str(ts))
+    monkeypatch.setattr(svg, "LOD_INDEX_TS", str(tmp_path / "russiaRegionsPaths.lods.ts"))
+    return tmp_path
+
+
+def _levels(*tolerances):
+    return {tol: {"moscow": {"path": f"M0,0l{tol},0,0,1z"}} for tol in tolerances}
+
+
+def test_lod_levels_only_finer_than_base():
+    assert svg.lod_levels(0.02, [0.005, 0.02, 0.05, 0.01, 0.005]) == [0.01, 0.005]
+    assert svg.lod_levels(0.02, None) == []
+
+
+def test_rerun_with_fewer_levels_removes_stale_files(output):
+    (output / "russiaRegionsPaths.ts").write_text("// основной файл\n")
+    svg.generate_lod_ts(_levels(0.01, 0.005, 0.002), 0.02, 1)
+    assert sorted(os.listdir(output)) == [
+        "russiaRegionsPaths.lod0.ts", "russiaRegionsPaths.lod1.ts", "russiaRegionsPaths.lod2.ts",
+        "russiaRegionsPaths.lods.ts", "russiaRegionsPaths.ts",
+    ]
+
+    svg.generate_lod_ts(_levels(0.005), 0.02, 1)
+    assert sorted(os.listdir(output)) == [
+        "russiaRegionsPaths.lod0.ts", "russiaRegionsPaths.lods.ts", "russiaRegionsPaths.ts",
+    ]
+    assert "TOLERANCE = 0.005;" in (output / "russiaRegionsPaths.lod0.ts").read_text()
+
+    # Без --lod — пустой индекс и ни одного модуля уровня
+    svg.generate_lod_ts({}, 0.02, 1)
+    assert sorted(os.listdir(output)) == ["russiaRegionsPaths.lods.ts", "russiaRegionsPaths.ts"]
+    assert "REGION_PATH_LODS: RegionPathLod[] = [];" in (output / "russiaRegionsPaths.lods.ts").read_text()
@@ -0,0 +1,72 @@
+"""Дедуплицированная схема MBTiles (images + map + view tiles)."""
+
+import sqlite3
+
+from shapely.geometry import box
+
+import generate_region_tiles as tiles
+
+REGION = box(39.0, 55.6, 41.4, 56.9)
+SEA = b"\x89PNG sea"       # одинаковые «пустые» тайлы
+LAND = b"\x89PNG land"
+
+
+def _read_tiles(path) -> dict:
+    """Тайлы так, как их читает бэкенд: SELECT из tiles (y — TMS)."""
+    with sqlite3.connect(str(path)) as db:
+        return {(z, x, row): data for z, x, row, data in db.execute(
+            "SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles")}
+
+
+def test_dedup_schema_and_tiles_view(tmp_path):
+    path = tmp_path / "region.mbtiles"
+    db = tiles.create_mbtiles(str(path), "test", REGION, 6, 6, dedup=True)
+    assert tiles.mbtiles_is_dedup(db)
+    kinds = dict(db.execute("SELECT name, type FROM sqlite_master WHERE name IN ('images', 'map', 'tiles')"))
+    assert kinds == {"images": "table", "map": "table", "tiles": "view"}
+
+    rows = [(6, 38, 19, SEA), (6, 38, 20, SEA), (6, 39, 19, LAND), (6, 39, 20, SEA)]
+    written = tiles.insert_tiles(db, rows, dedup=True)
+    # Одинаковые изображения записаны один раз
+    assert written == (2, len(SEA) + len(LAND))
+    assert tiles.insert_tile(db, 6, 40, 20, SEA, dedup=True) is False
+    tiles.finalize_mbtiles(db, vacuum=False)
+    db.close()
+
+    top = (1 << 6) - 1
+    assert _read_tiles(path) == {
+        (6, 38, top - 19): SEA, (6, 38, top - 20): SEA, (6, 39, top - 19): LAND,
+        (6, 39, top - 20): SEA, (6, 40, top - 20): SEA,
+    }
+    with sqlite3.connect(str(path)) as db:
+        assert db.execute("SELECT COUNT(*) FROM images").fetchone() == (2,)
+        assert db.execute("SELECT 1 FROM sqlite_master WHERE name = 'map_index'").fetchone()
+
+
+def test_overwrite_drops_orphan_images(tmp_path):
+    path = tmp_path / "region.mbtiles"
+    db = tiles.create_mbtiles(str(path), "test", REGION, 6, 6, dedup=True)
+    tiles.insert_tiles(db, [(6, 38, 19, SEA), (6, 39, 19, LAND)], dedup=True)
+    # Перезапись тайла: LAND больше никому не нужен
+    tiles.insert_tile(db, 6, 39, 19, SEA, dedup=True)
+    assert tiles.drop_orphan_images(db) == 1
+    assert db.execute("SELECT COUNT(*) FROM images").fetchone() == (1,)
+    assert db.execute("SELECT COUNT(*) FROM tiles").fetchone() == (2,)
+    db.close()
+
+
+def test_resume_keeps_existing_schema(tmp_path):
+    path = tmp_path / "region.mbtiles"
+    tiles.create_mbtiles(str(path), "test", REGION, 6, 6, dedup=True).close()
+    # --resume без --dedup: продолжаем в схеме файла
+    db = tiles.create_mbtiles(str(path), "test", REGION, 6, 6, resume=True, dedup=False)
+    assert tiles.mbtiles_is_dedup(db)
+    db.close()
+
+    flat = tmp_path / "flat.mbtiles"
+    tiles.create_mbtiles(str(flat), "test", REGION, 6, 6).close()
+    db = tiles.create_mbtiles(str(flat), "test", REGION, 6, 6, resume=True, dedup=True)
+    assert not tiles.mbtiles_is_dedup(db)
+    tiles.insert_tiles(db, [(6, 38, 19, SEA), (6, 38, 20, SEA)])
+    assert db.execute("SELECT COUNT(*) FROM tiles").fetchone() == (2,)
+    db.close()
@@ -0,0 +1,160 @@
+"""Потоковый разбор ответов Overpass и повтор при remark «runtime error»."""
+
+import io
+import json
+
+import pytest
+
+import overpass_client as oc
+
+SQUARE = [(37.0, 55.0), (37.4, 55.0), (37.4, 55.4), (37.0, 55.4)]
+
+
+def _way(ref, points, role="outer"):
+    return {"type": "way", "ref": ref, "role": role,
+            "geometry": [{"lat": lat, "lon": lon} for lon, lat in points]}
+
+
+def _relation(osm_id: int) -> dict:
+    # Квадрат из двух outer ways + inner way и узел
+    a, b, c, d = SQUARE
+    return {"type": "relation", "id": osm_id, "bounds": {"minlat": 55.0, "maxlat": 55.4},
+                "members": [
+                    {"type": "node", "ref": 1, "role": "admin_centre"},
+                    _way(10, [a, b, c]), _way(11, [c, d, a]),
+                    _way(12, [(37.1, 55.1), (37.2, 55.1), (37.2, 55.2), (37.1, 55.1)], role="inner"),
+                ],
+                "tags": {"name": "Владимирская область", "admin_level": "4"}}
+
+
+def _response(remark=None, osm_ids=(72197,)) -> str:
+    # relation и отдельный way (не relation — пропускается)
+    data = {"version": 0.6, "osm3s": {"copyright": "OSM"},
+            "elements": [*map(_relation, osm_ids), {"type": "way", "id": 5, "geometry": []}]}
+    if remark:
+        data["remark"] = remark
+    return json.dumps(data, ensure_ascii=False, indent=2)
+
+
+@pytest.mark.parametrize("chunk", [1, 7, oc.STREAM_CHUNK])
+def test_parse_relations_any_chunk(monkeypatch, chunk):
+    # Блок в 1 символ — каждое число и строка рвутся на границе блока
+    monkeypatch.setattr(oc, "STREAM_CHUNK", chunk)
+    relations = oc.parse_relations(io.StringIO(_response()))
+    assert list(relations) == [72197]
+    relation = relations[72197]
+    assert relation["tags"]["name"] == "Владимирская область"
+    assert relation["ways"] == 2
+    assert relation["geometry"].geom_type == "Polygon"
+    assert relation["geometry"].area == pytest.approx(0.16)
+
+
+def test_runtime_error_remark():
+    with pytest.raises(oc.OverpassRemark):
+        oc.parse_relations(io.StringIO(_response("runtime error: Query timed out after 300 seconds.")))
+    # Прочие remark — не ошибка
+    assert list(oc.parse_relations(io.StringIO(_response("runtime remark: ok")))) == [72197]
+
+
+def test_truncated_response():
+    with pytest.raises(ValueError):
+        oc.parse_relations(io.StringIO(_response()[:-40]))
+
+
+class _Response:
+    def __init__(self, body: str):
+        self.status_code = 200
+        self.body = body.encode("utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, size):
+        for i in range(0, len(self.body), size):
+            yield self.body[i:i + size]
+
+
+@pytest.fixture
+def overpass(monkeypatch):
+    """Клиент с одним эндпоинтом; ответы сервера — из списка bodies."""
+    bodies = []
+    monkeypatch.setattr(oc.requests, "post", lambda *a, **kw: _Response(bodies.pop(0)))
+    client = oc.OverpassClient(["http://overpass.test/api/interpreter"], slots=1, rate=1000)
+    monkeypatch.setattr(client, "_backoff", lambda ep: 0.0)
+    return client, bodies
+
+
+def test_single_relation_retried_after_remark(overpass):
+    client, bodies = overpass
+    bodies += [_response("runtime error: Query timed out"), _response()]
+    relation = oc.fetch_relation(client, 72197)
+    assert relation["geometry"].area == pytest.approx(0.16)
+    assert client.endpoints[0].requests == 2
+    assert client.endpoints[0].throttled == 1
+
+
+def test_group_split_instead_of_retry(overpass):
+    client, bodies = overpass
+    bodies.append(_response("runtime error: out of memory"))
+    # Группу fetch_relations поделит пополам — повторять её целиком незачем
+    with pytest.raises(oc.OverpassRemark):
+        oc._fetch_group(client, [72197, 72198])
+    assert client.endpoints[0].requests == 1
+
+
+def test_group_size():
+    sizer = oc._GroupSize(8, max_bytes=100)
+    assert sizer.next() == 8
+    sizer.done(8, 400)                  # 50 байт на relation
+    assert (sizer.limit, sizer.next()) == (16, 2)
+    sizer.failed(16)
+    assert (sizer.ceiling, sizer.limit) == (8, 8)
+    sizer.done(2, 2)                    # relation мелкие — упор в ceiling
+    assert sizer.limit == 8
+    sizer.failed(1)
+    assert (sizer.ceiling, sizer.next()) == (1, 1)
+
+
+BIG = 151231   # Якутия: в группе с ней сервер не успевает
+
+
+@pytest.mark.parametrize("failure", ["client timeout", "504"])
+def test_slow_group_split_down_to_single(monkeypatch, failure):
+    posts = []
+    slow_single = [True]
+
+    def post(url, data, timeout, stream):
+        ids = [int(i) for i in data["data"].split("(id:")[1].split(")")[0].split(",")]
+        posts.append(ids)
+        assert timeout > oc.BATCH_TIMEOUT
+        if BIG in ids and (len(ids) > 1 or (slow_single and slow_single.pop())):
+            if failure == "504":
+                response = _Response("")
+                response.status_code = 504
+                return response
+            raise oc.requests.ReadTimeout("read timed out")
+        return _Response(_response(osm_ids=ids))
+
+    monkeypatch.setattr(oc.requests, "post", post)
+    client = oc.OverpassClient(["http://overpass.test/api/interpreter"], slots=1, rate=1000)
+    monkeypatch.setattr(client, "_backoff", lambda ep: 0.0)
+
+    ids = [BIG] + list(range(1, 8))
+    found = dict(oc.fetch_relations(client, ids, group=8))
+    assert sorted(found) == sorted(ids)
+    assert all(relation["geometry"] is not None for relation in found.values())
+    # Каждая группа с BIG — один запрос (8 → 4 → 2 → 1), одиночный — с повтором
+    assert [p for p in posts if BIG in p] == [ids, ids[:4], ids[:2], [BIG], [BIG]]
+
+
+def test_read_timeout_while_streaming_body():
+    # Таймаут чтения тела requests отдаёт как ConnectionError(ReadTimeoutError)
+    error = oc.requests.ConnectionError(oc.ReadTimeoutError(None, None, "Read timed out."))
+    assert oc._is_timeout(error)
+    assert not oc._is_timeout(oc.requests.ConnectionError("connection refused"))
@@ -0,0 +1,93 @@
+"""Планировщик OverpassClient: слоты, token bucket, пауза и выбор эндпоинта."""
+
+import pytest
+
+import overpass_client as oc
+
+A = "http://a.test/api/interpreter"
+B = "http://b.test/api/interpreter"
+
+
+class _Clock:
+    """time.monotonic и Condition без потоков: wait(t) сдвигает часы на t."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.waits = []
+
+    def __call__(self):
+        return self.now
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def wait(self, timeout=None):
+        if timeout is None:
+            raise AssertionError("все слоты заняты — в одном потоке не дождаться")
+        self.waits.append(round(timeout, 6))
+        self.now += timeout
+
+    def notify_all(self):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(oc.time, "monotonic", clock)
+    return clock
+
+
+def _client(clock, urls, slots=2, rate=0.5):
+    client = oc.OverpassClient(urls, slots=slots, rate=rate)
+    client._cond = clock
+    return client
+
+
+def test_token_bucket_spaces_requests(clock):
+    client = _client(clock, [A])
+    ep = client.endpoints[0]
+    # Полное ведро — два запроса сразу, третий через 1 / rate
+    assert client._acquire() is ep and client._acquire() is ep
+    assert ep.ready_in(clock.now) == float("inf")
+    client._release(ep)
+    assert client._acquire() is ep
+    assert clock.waits == [2.0]
+    assert (ep.in_flight, ep.requests) == (2, 3)
+
+
+def test_throttled_endpoint_paused(clock):
+    client = _client(clock, [A], slots=1, rate=1000)
+    ep = client._acquire()
+    client._release(ep, throttled=True, delay=30)
+    assert (ep.failures, ep.throttled) == (1, 1)
+    assert client._acquire() is ep
+    assert clock.waits == [30.0]
+    client._release(ep)
+    assert ep.failures == 0
+
+
+def test_least_loaded_endpoint_first(clock):
+    client = _client(clock, [A, B], rate=1000)
+    a, b = client.endpoints
+    assert [client._acquire() for _ in range(4)] == [a, b, a, b]
+    assert clock.waits == []
+
+
+def test_avoid_unless_only_ready(clock):
+    client = _client(clock, [A, B], slots=1, rate=1000)
+    a, b = client.endpoints
+    # Оба готовы — после неудачи на a берём b
+    assert client._acquire(avoid=a) is b
+    client._release(b)
+    # b на паузе — a готов раньше, берём его, хоть он и «неудачный»
+    b.blocked_until = clock.now + 60
+    assert client._acquire(avoid=a) is a
+    client._release(a)
+    # Оба на паузе — ждём тот, что освободится раньше
+    a.blocked_until = clock.now + 10
+    assert client._acquire(avoid=b) is a
+    assert clock.waits == [10.0]
@@ -0,0 +1,76 @@
+"""--incremental: манифест path по регионам, пересчёт только изменённых."""
+
+import json
+
+import pytest
+
+import generate_svg_paths as svg
+
+BOUNDS = {"xmin": -1.0, "xmax": 1.0, "ymin": 0.0, "ymax": 2.0}
+
+
+@pytest.fixture
+def world(tmp_path, monkeypatch):
+    """Два региона с SHA-1 из индекса; convert_levels записывает, что его просили."""
+    state = {"bounds": dict(BOUNDS), "calls": []}
+    index = {"moscow": {"sha1": "a1"}, "tver": {"sha1": "b1"}}
+
+    def compute_bounds():
+        svg._albers_bounds = dict(state["bounds"])
+
+    def convert_levels(tolerances, workers=1, topology=False, rids=None, bounds=None):
+        state["calls"].append(sorted(rids))
+        return {tol: {rid: {"path": f"M{rid}:{index[rid]['sha1']}:{tol}z", "cx": 1.0, "cy": 2.0}
+                      for rid in rids} for tol in tolerances}
+
+    monkeypatch.setattr(svg, "PATHS_MANIFEST", str(tmp_path / ".paths_manifest.json"))
+    monkeypatch.setattr(svg, "_compute_albers_bounds", compute_bounds)
+    monkeypatch.setattr(svg, "_available_regions", lambda: sorted(index))
+    monkeypatch.setattr(svg, "_load_index", lambda: index)
+    monkeypatch.setattr(svg, "convert_levels", convert_levels)
+    state["index"] = index
+    return state
+
+
+def test_second_run_uses_manifest(world):
+    first = svg.convert_incremental([0.02])
+    assert world["calls"] == [["moscow", "tver"]]
+    manifest = json.loads(open(svg.PATHS_MANIFEST, encoding="utf-8").read())
+    assert manifest["version"] == svg.MANIFEST_VERSION and manifest["bounds"] == BOUNDS
+    assert manifest["regions"]["tver"]["sha1"] == "b1"
+
+    second = svg.convert_incremental([0.02])
+    assert world["calls"] == [["moscow", "tver"]]
+    assert second == first
+    # Результат — копии: encode_paths не должен портить кэш
+    second[0.02]["moscow"]["path"] = "M0,0z"
+    assert svg.convert_incremental([0.02])[0.02]["moscow"] == first[0.02]["moscow"]
+
+
+def test_only_changed_region_reconverted(world):
+    svg.convert_incremental([0.02])
+    world["index"]["tver"]["sha1"] = "b2"
+    paths = svg.convert_incremental([0.02])
+    assert world["calls"][-1] == ["tver"]
+    assert paths[0.02]["tver"]["path"] == "Mtver:b2:0.02z"
+    # Новый уровень детализации — нужен всем регионам
+    svg.convert_incremental([0.02, 0.005])
+    assert world["calls"][-1] == ["moscow", "tver"]
+
+
+@pytest.mark.parametrize("change", ["bounds", "version", "full", "topology"])
+def test_everything_reconverted(world, monkeypatch, change):
+    svg.convert_incremental([0.02], topology=change == "topology")
+    kwargs = {}
+    if change == "bounds":
+        world["bounds"]["xmax"] = 1.5          # охват карты общий для всех path
+    elif change == "version":
+        monkeypatch.setattr(svg, "MANIFEST_VERSION", svg.MANIFEST_VERSION + 1)
+    elif change == "full":
+        kwargs["full"] = True
+    else:
+        # С топологией path зависит от соседей: изменился один — пересчёт всех
+        world["index"]["tver"]["sha1"] = "b2"
+        kwargs["topology"] = True
+    svg.convert_incremental([0.02], **kwargs)
+    assert world["calls"][-1] == ["moscow", "tver"]
@@ -0,0 +1,46 @@
+"""--pyramid: сборка тайла из четырёх детей."""
+
+import io
+
+import pytest
+from shapely.geometry import box
+
+import generate_region_tiles as tiles
+
+Image = pytest.importorskip("PIL.Image")
+
+REGION = box(39.0, 55.6, 41.4, 56.9)
+COLORS = {(0, 0): (255, 0, 0), (1, 0): (0, 255, 0), (0, 1): (0, 0, 255), (1, 1): (255, 255, 0)}
+
+
+def _png(color) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (256, 256), color).save(out, "PNG")
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("dedup", [False, True], ids=["flat", "dedup"])
+def test_read_child_tiles_order(tmp_path, dedup):
+    db = tiles.create_mbtiles(str(tmp_path / "r.mbtiles"), "test", REGION, 7, 8, dedup=dedup)
+    x, y = 77, 39
+    tiles.insert_tiles(db, [(8, 2 * x + dx, 2 * y + dy, f"{dx}{dy}".encode())
+                            for dx, dy in tiles.PYRAMID_CHILDREN], dedup=dedup)
+    # Соседние тайлы того же зума не подмешиваются
+    tiles.insert_tiles(db, [(8, 2 * x + 2, 2 * y, b"x"), (8, 2 * x, 2 * y + 2, b"y")], dedup=dedup)
+    assert tiles.read_child_tiles(db, 7, x, y) == [b"00", b"10", b"01", b"11"]
+    db.close()
+
+
+def test_build_parent_tile_quadrants():
+    children = [_png(COLORS[child]) for child in tiles.PYRAMID_CHILDREN]
+    status, z, x, y, data = tiles.build_parent_tile(7, 77, 39, children)
+    assert (status, z, x, y) == ("OK", 7, 77, 39)
+    parent = Image.open(io.BytesIO(data)).convert("RGB")
+    assert parent.size == (256, 256)
+    for (dx, dy), color in COLORS.items():
+        assert parent.getpixel((64 + dx * 128, 64 + dy * 128)) == color
+
+
+def test_build_parent_tile_bad_child():
+    status, *_, error = tiles.build_parent_tile(7, 77, 39, [b"not a png"] * 4)
+    assert status == "ERR" and error.startswith("pyramid:")
@@ -0,0 +1,78 @@
+"""--recompress: перекодирование тайлов и бюджет размера --max-tile-kb."""
+
+import io
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import generate_region_tiles as tiles
+
+Image = pytest.importorskip("PIL.Image")
+features = pytest.importorskip("PIL.features")
+
+
+def _png(noise: bool) -> bytes:
+    """256×256: шум (плохо сжимается) или заливка с полосой."""
+    if noise:
+        rnd = random.Random(7)
+        im = Image.frombytes("RGB", (256, 256), bytes(rnd.getrandbits(8) for _ in range(256 * 256 * 3)))
+    else:
+        im = Image.new("RGB", (256, 256), (170, 211, 223))
+        im.paste((240, 238, 230), (0, 100, 256, 140))
+    out = io.BytesIO()
+    im.save(out, "PNG")   # без optimize — как отдаёт tileserver
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("mode", ["png", "palette"])
+def test_lossless_modes_never_grow(mode):
+    for data in (_png(False), _png(True)):
+        status, _, _, _, out, before = tiles.recompress_tile(10, 1, 1, data, mode)
+        assert status == "OK" and before == len(data)
+        assert len(out) <= len(data)
+        assert Image.open(io.BytesIO(out)).size == (256, 256)
+
+
+def test_palette_budget_reduces_colors():
+    data = _png(True)
+    full = tiles.recompress_tile(10, 1, 1, data, "palette")[4]
+    budget = len(full) - 1
+    out = tiles.recompress_tile(10, 1, 1, data, "palette", max_bytes=budget)[4]
+    assert len(out) < len(full)
+    assert len(Image.open(io.BytesIO(out)).getcolors(256) or []) <= tiles.PALETTE_STEPS[1]
+
+
+def test_webp_budget_lowers_quality_down_to_minimum():
+    if not features.check("webp"):
+        pytest.skip("Pillow без WebP")
+    data = _png(True)
+    free = tiles.recompress_tile(10, 1, 1, data, "webp", quality=80)[4]
+    # Недостижимый бюджет: качество снижается до WEBP_MIN_QUALITY, тайл всё равно пишется
+    tight = tiles.recompress_tile(10, 1, 1, data, "webp", quality=80, max_bytes=100)[4]
+    floor = tiles.recompress_tile(10, 1, 1, data, "webp", quality=tiles.WEBP_MIN_QUALITY)[4]
+    assert tight == floor and len(tight) < len(free)
+    assert Image.open(io.BytesIO(tight)).format == "WEBP"
+
+
+def test_broken_tile_is_error():
+    status, *_, error, before = tiles.recompress_tile(10, 1, 1, b"not png", "png")
+    assert status == "ERR" and error.startswith("recompress:") and before == 7
+
+
+def test_recompress_results_savings_and_passthrough():
+    data = _png(True)
+    # Как поток загрузчика — генератор (recompress_results закрывает его)
+    results = (r for r in [
+        ("OK", 10, 1, 1, data), ("MISSING", 10, 1, 2, None),
+        ("ERR", 11, 1, 3, "HTTP 500"), ("OK", 11, 2, 2, _png(False)),
+    ])
+    savings = {}
+    budget = 1024
+    with ThreadPoolExecutor(2) as pool:
+        out = list(tiles.recompress_results(results, pool, "palette", 80, budget, 1, savings))
+    assert sorted(r[:4] for r in out) == sorted([
+        ("OK", 10, 1, 1), ("MISSING", 10, 1, 2), ("ERR", 11, 1, 3), ("OK", 11, 2, 2)])
+    before, after, over = savings[10]
+    assert before == len(data) and after < before and over == 1   # шум в 1 КБ не влезает
+    assert savings[11][2] == 0
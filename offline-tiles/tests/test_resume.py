@@ -0,0 +1,77 @@
+"""--resume и --retry-failed: что считается готовым и что повторяется."""
+
+import pytest
+from shapely.geometry import box
+
+import generate_region_tiles as tiles
+
+REGION = box(39.0, 55.6, 41.4, 56.9)
+Z = 8
+
+
+def _create(path, resume=False, dedup=False):
+    return tiles.create_mbtiles(str(path), "test", REGION, Z, Z, resume=resume, dedup=dedup)
+
+
+@pytest.fixture(params=[False, True], ids=["flat", "dedup"])
+def interrupted(request, tmp_path):
+    """MBTiles прерванного запуска: два тайла сохранены, один — 404, один — ошибка.
+    Пишет поток записи, как в generate_region_tiles."""
+    path = tmp_path / "region.mbtiles"
+    _create(path, dedup=request.param).close()
+    writer = tiles.MBTilesWriter(str(path), dedup=request.param, batch_size=2)
+    writer.start()
+    writer.put_tile(Z, 155, 79, b"png-a")
+    writer.put_tile(Z, 155, 80, b"png-b")
+    writer.put_failure(Z, 156, 79, "MISSING", None)
+    writer.put_failure(Z, 156, 80, "ERR", "HTTP 500")
+    writer.close()
+    return path
+
+
+def test_resume_keeps_tiles_and_skips_done(interrupted):
+    db = _create(interrupted, resume=True)
+    planned = [(Z, 155, 79), (Z, 155, 80), (Z, 156, 79), (Z, 156, 80), (Z, 157, 79)]
+    # Сохранённые и 404 не качаем; ERR и новые — качаем
+    assert list(tiles.skip_done_tiles(db, planned)) == [(Z, 156, 80), (Z, 157, 79)]
+    assert tiles.count_done_tiles(db, Z, Z) == 3
+    assert tiles.stored_tiles(db, Z) == {(155, 79), (155, 80)}
+    db.close()
+
+
+def test_retry_failed_returns_err_tiles_in_xyz(interrupted):
+    db = _create(interrupted, resume=True)
+    assert tiles.failed_tiles(db) == [(Z, 156, 80)]
+
+    tiles.record_failure(db, Z, 156, 80, "ERR", "timeout")
+    attempts, error = db.execute("SELECT attempts, error FROM failed_tiles WHERE status = 'ERR'").fetchone()
+    assert (attempts, error) == (2, "timeout")
+
+    # Тайл скачан повторно — из failed_tiles уходит, 404 остаётся
+    tiles.insert_tile(db, Z, 156, 80, b"png-c", dedup=tiles.mbtiles_is_dedup(db))
+    assert tiles.clear_recovered_failures(db) == 1
+    assert tiles.failed_tiles(db) == []
+    assert db.execute("SELECT status FROM failed_tiles").fetchall() == [("MISSING",)]
+    db.close()
+
+
+def test_without_resume_starts_over(interrupted):
+    db = _create(interrupted)
+    assert tiles.count_done_tiles(db, Z, Z) == 0
+    assert tiles.failed_tiles(db) == []
+    db.close()
+
+
+def test_target_zoom_tiles_resume_and_retry(interrupted):
+    db = _create(interrupted, resume=True)
+    plan = tiles.plan_tiles(REGION, Z, Z)
+    planned = list(tiles.iter_tiles(plan, ordered=True))
+    done = {(Z, 155, 79), (Z, 155, 80), (Z, 156, 79)}
+    assert done <= set(planned)
+
+    resumed = list(tiles.target_zoom_tiles({"plan": plan, "resume": True, "db": db}, Z))
+    assert resumed == [tile for tile in planned if tile not in done]
+
+    retry = {"plan": plan, "resume": True, "db": db, "retry": tiles.failed_tiles(db)}
+    assert list(tiles.target_zoom_tiles(retry, Z)) == [(Z, 156, 80)]
+    db.close()
@@ -0,0 +1,35 @@
+"""Метрики запуска: время этапов и гистограммы."""
+
+import time
+
+import generate_region_tiles as tiles
+
+
+def test_nested_stage_not_counted_twice(monkeypatch):
+    clock = iter([0.0, 1.0, 4.0, 10.0])   # fetch 0–10, внутри finalize 1–4
+    monkeypatch.setattr(time, "perf_counter", lambda: next(clock))
+    metrics = tiles.RunMetrics()
+    with metrics.stage("fetch"):
+        with metrics.stage("finalize"):
+            pass
+    assert metrics.stages == {"fetch": 7.0, "finalize": 3.0}
+
+
+def test_stages_accumulate(monkeypatch):
+    clock = iter([0.0, 2.0, 5.0, 6.0])
+    monkeypatch.setattr(time, "perf_counter", lambda: next(clock))
+    metrics = tiles.RunMetrics()
+    for _ in range(2):
+        with metrics.stage("finalize"):
+            pass
+    assert metrics.stages == {"finalize": 3.0}
+
+
+def test_histogram_quantiles():
+    hist = tiles.Histogram(tiles.LATENCY_BUCKETS)
+    for value in (0.005, 0.02, 0.02, 0.3, 20):
+        hist.observe(value)
+    data = hist.to_dict()
+    assert data["count"] == 5
+    assert hist.quantile(0.5) <= 0.025
+    assert hist.quantile(1.0) >= 10
@@ -0,0 +1,85 @@
+"""Кодировка path --encoding relative: браузер восстанавливает те же точки."""
+
+import re
+
+import pytest
+from shapely.geometry import MultiPolygon, Polygon
+
+import generate_svg_paths as svg
+
+# Числа path SVG: «1.2.5» — это 1.2 и .5, «3-1» — 3 и -1
+NUMBER = re.compile(r"-?(?:\d+\.?\d*|\.\d+)")
+
+
+def _tenths(text: str) -> list[int]:
+    return [round(float(v) * 10) for v in NUMBER.findall(text)]
+
+
+def decode_relative(d: str) -> list[list[tuple[int, int]]]:
+    """«M x,y l dx,dy … z» → кольца в целых десятых, как их строит браузер."""
+    rings = []
+    for start, deltas in re.findall(r"M([^l]*)l([^z]*)z", d):
+        x, y = _tenths(start)
+        ring = [(x, y)]
+        values = _tenths(deltas)
+        for dx, dy in zip(values[::2], values[1::2]):
+            x, y = x + dx, y + dy
+            ring.append((x, y))
+        rings.append(ring)
+    return rings
+
+
+def absolute_rings(d: str) -> list[list[tuple[int, int]]]:
+    """Кольца absolute-path без повторов подряд и без замыкающих точек
+    (их рисует z); кольца меньше чем из трёх точек не рисуются."""
+    rings = []
+    for sub in re.findall(r"M ([^MZ]*) Z", d):
+        ring = []
+        for token in sub.split():
+            x, y = token.split(",")
+            pt = (round(float(x) * 10), round(float(y) * 10))
+            if not ring or ring[-1] != pt:
+                ring.append(pt)
+        while len(ring) > 1 and ring[-1] == ring[0]:
+            ring.pop()
+        if len(ring) >= 3:
+            rings.append(ring)
+    return rings
+
+
+def test_svg_numbers_grammar():
+    assert svg._svg_numbers([30, 4, -12, 5, 3]) == "3,.4-1.2.5.3"
+    assert _tenths(svg._svg_numbers([30, 4, -12, 5, 3])) == [30, 4, -12, 5, 3]
+    assert [svg._tenths(v) for v in (0, 30, 4, -4, -12, 105)] == ["0", "3", ".4", "-.4", "-1.2", "10.5"]
+
+
+def test_relative_round_trip_hand_made():
+    d = ("M 100.5,200.1 100.5,200.1 101,199.3 99.9,198 100.5,200.1 Z "
+         "M 5,5 5,5 Z "                                   # вырожденное кольцо — выбрасывается
+         "M 0,0 -3.4,0.2 -3.4,-7 0,0 0,0 Z")
+    encoded = svg.encode_path(d, "relative")
+    assert encoded.count("M") == 2
+    assert decode_relative(encoded) == absolute_rings(d)
+    assert len(encoded) < len(d)
+
+
+def test_absolute_is_unchanged():
+    d = "M 1,2 3,4 5,6 1,2 Z"
+    assert svg.encode_path(d, "absolute") == d
+
+
+@pytest.fixture
+def projection(monkeypatch):
+    # Фиксированные константы вписывания — без чтения всех контуров
+    monkeypatch.setattr(svg, "_projection", (900.0, 0.1, 0.8))
+
+
+def test_relative_round_trip_projected(projection):
+    shell = [(37.0 + i * 0.013, 55.0 + (i % 7) * 0.011) for i in range(60)] + [(37.5, 56.2), (36.9, 56.0)]
+    hole = [(37.3, 55.5), (37.5, 55.5), (37.4, 55.6)]
+    geom = MultiPolygon([Polygon(shell, [hole]), Polygon([(40, 60), (41, 60), (40.5, 61)])])
+    d = svg.geometry_to_svg_path(geom, 0.0)
+    encoded = svg.encode_path(d, "relative")
+    rings = absolute_rings(d)
+    assert len(rings) == 3
+    assert decode_relative(encoded) == rings
@@ -0,0 +1,103 @@
+"""Постоянный кэш тайлов (--tile-cache): LRU и сброс при смене стиля."""
+
+import itertools
+import os
+import time
+
+import pytest
+
+import generate_region_tiles as tiles
+
+SERVER = "http://tiles.test"
+
+
+class _Resp:
+    def __init__(self, content: bytes):
+        self.status_code = 200
+        self.content = content
+
+
+class _Session:
+    """styles.json / style.json tileserver'а: styles[стиль] — содержимое."""
+
+    def __init__(self):
+        self.styles = {"basic": b'{"v": 1}', "dark": b'{"v": 1}'}
+
+    def get(self, url, timeout):
+        if url.endswith("/styles.json"):
+            return _Resp(b"[]")
+        return _Resp(self.styles[url.split("/styles/")[1].split("/")[0]])
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(time, "time", lambda: float(next(ticks)))
+
+
+@pytest.fixture
+def cache(tmp_path, clock):
+    cache = tiles.TileCache(str(tmp_path / "cache"))
+    cache.bind(_Session(), SERVER, "basic")
+    yield cache
+    cache.close()
+
+
+def test_put_get_and_shared_blobs(cache):
+    cache.put("OK", 10, 1, 1, b"sea" * 100)
+    cache.put("OK", 10, 1, 2, b"sea" * 100)
+    cache.put("MISSING", 10, 1, 3, None)
+    cache.put("ERR", 10, 1, 4, "HTTP 500")
+    assert cache.get(10, 1, 1) == ("OK", b"sea" * 100)
+    assert cache.get(10, 1, 3) == ("MISSING", None)
+    assert cache.get(10, 1, 4) is None
+    # Одинаковые тайлы — один файл на диске
+    assert cache.size == 300
+    assert cache.db.execute("SELECT COUNT(*), SUM(refs) FROM blobs").fetchone() == (1, 2)
+
+
+def test_lru_eviction(cache):
+    cache.max_bytes = 2500
+    cache.put("OK", 10, 1, 1, b"a" * 1000)
+    cache.put("OK", 10, 1, 2, b"b" * 1000)
+    assert cache.get(10, 1, 1) is not None      # (10, 1, 1) читали позже, чем писали (10, 1, 2)
+    cache.put("OK", 10, 1, 3, b"c" * 1000)      # 3000 > 2500 — вытесняем до 90% лимита
+
+    assert cache.evicted == 1 and cache.size == 2000
+    assert cache.get(10, 1, 2) is None
+    assert cache.get(10, 1, 1) is not None and cache.get(10, 1, 3) is not None
+    blobs = [f for _, _, files in os.walk(os.path.join(cache.path, "blobs")) for f in files]
+    assert len(blobs) == 2
+
+
+def test_style_change_drops_only_its_scope(tmp_path, clock):
+    session = _Session()
+    cache = tiles.TileCache(str(tmp_path / "cache"))
+    cache.bind(session, SERVER, "dark")
+    cache.put("OK", 10, 1, 1, b"dark tile")
+    assert cache.bind(session, SERVER, "basic") is False
+    cache.put("OK", 10, 1, 1, b"basic tile")
+    cache.close()
+
+    # Перезапуск, стиль не менялся — кэш на месте
+    cache = tiles.TileCache(str(tmp_path / "cache"))
+    assert cache.bind(session, SERVER, "basic") is False
+    assert cache.get(10, 1, 1) == ("OK", b"basic tile")
+
+    session.styles["basic"] = b'{"v": 2}'
+    assert cache.bind(session, SERVER, "basic") is True
+    assert cache.get(10, 1, 1) is None
+    assert cache.bind(session, SERVER, "dark") is False
+    assert cache.get(10, 1, 1) == ("OK", b"dark tile")
+    assert cache.size == len(b"dark tile")
+    cache.close()
+
+
+def test_wrap_serves_hits_without_submit(cache):
+    cache.put("OK", 10, 1, 1, b"png")
+    submitted = []
+    submit = cache.wrap(lambda z, x, y: submitted.append((z, x, y)))
+    future = submit(10, 1, 1)
+    assert future.from_cache and future.result() == ("OK", 10, 1, 1, b"png")
+    submit(10, 1, 2)
+    assert submitted == [(10, 1, 2)]
@@ -0,0 +1,59 @@
+"""Перебор тайлов региона: квадродерево против полного перебора bbox."""
+
+import pytest
+from shapely.geometry import Polygon
+
+import generate_region_tiles as tiles
+
+# Невыпуклый полигон (буква «Г») около Владимира — есть и целиком покрытые
+# блоки, и граничные тайлы, и пустая «выемка» внутри bbox
+REGION = Polygon([
+    (39.0, 55.6), (41.4, 55.6), (41.4, 56.0), (39.8, 56.0),
+    (39.8, 56.9), (39.0, 56.9),
+])
+MIN_ZOOM, MAX_ZOOM = 4, 11
+
+VECTORIZED = [False, True] if tiles.VECTORIZED else [False]
+
+
+def _plan(mode: str, vectorized: bool) -> list[dict]:
+    return tiles.plan_tiles(REGION, MIN_ZOOM, MAX_ZOOM, mode, vectorized=vectorized)
+
+
+@pytest.mark.parametrize("vectorized", VECTORIZED)
+def test_quadtree_matches_bbox(vectorized):
+    plan = _plan("quadtree", vectorized)
+    # Квадродерево действительно свернуло внутренние тайлы в блоки
+    assert any(level["blocks"] for level in plan)
+    quadtree = list(tiles.iter_tiles(plan))
+    bbox = list(tiles.iter_tiles(_plan("bbox", vectorized)))
+    # Без повторов и то же множество тайлов
+    assert len(quadtree) == len(set(quadtree))
+    assert set(quadtree) == set(bbox)
+
+
+def test_scalar_matches_vectorized():
+    if not tiles.VECTORIZED:
+        pytest.skip("NumPy / Shapely 2 недоступны")
+    scalar = set(tiles.iter_tiles(_plan("quadtree", False)))
+    assert scalar == set(tiles.iter_tiles(_plan("quadtree", True)))
+
+
+@pytest.mark.parametrize("mode", tiles.ENUMERATE_MODES)
+def test_plan_count_and_zoom_order(mode):
+    plan = _plan(mode, tiles.VECTORIZED)
+    listed = list(tiles.iter_tiles(plan))
+    assert tiles.count_tiles(plan) == len(listed)
+    assert [level["z"] for level in plan] == list(range(MIN_ZOOM, MAX_ZOOM + 1))
+    # Зумы идут по порядку — --resume держит в памяти готовые тайлы одного зума
+    assert [z for z, _, _ in listed] == sorted(z for z, _, _ in listed)
+
+
+def test_every_tile_intersects_region():
+    for z, x, y in tiles.iter_tiles(_plan("quadtree", tiles.VECTORIZED)):
+        assert REGION.intersects(tiles.tile_bbox(z, x, y))
+
+
+def test_ordered_iteration_is_sorted():
+    plan = _plan("quadtree", tiles.VECTORIZED)
+    assert list(tiles.iter_tiles(plan, ordered=True)) == sorted(tiles.iter_tiles(plan))